@@ -1,11 +1,62 @@
 #!/usr/bin/env python3
 
+import atexit
+import concurrent.futures
+import contextlib
+import difflib
+import functools
+import getpass
+import gzip
+import http.server
+import json
 import os
+import pwd
+import queue
+import re
+import shlex
+import shutil
+import signal
+import socketserver
+import struct
+import subprocess
 import sys
+import threading
 import time
 
+try:
+    import readline
+except ImportError:
+    readline = None
+
 VERBOSE_MODE = False
-LOGFILE_NAME = ".postgre.log"
+LOG_DIR = "/var/log/postgre_installer"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_MAX_AGE = 7 * 86400
+LOG_KEEP = 10
+STATE_TTL = 30
+DATABASE_SIZE_TTL = 300
+NATIVE_PROBES = True
+PROFILER = None
+
+PGDATA = "/var/lib/pgsql/data"
+SERVICE = "postgresql"
+CLUSTER = None
+CLUSTERS_FILE = "/etc/postgre_installer/clusters.json"
+CLUSTER_ROOT = "/var/lib/pgsql/clusters"
+SYSTEMD_DIR = "/etc/systemd/system"
+BASE_UNIT = "/usr/lib/systemd/system/postgresql.service"
+POSTGRES_BIN = "/usr/bin/postgres"
+OS_RELEASE = "/etc/os-release"
+BOOT_TARGET_WANTS = "/etc/systemd/system/multi-user.target.wants"
+RPM_CACHE = "/var/cache/postgre_installer/rpms"
+RPM_DIR = None
+PAGE_SIZE = 50
+COPY_BUFFER = 1024 * 1024
+BACKUP_ROOT = "/var/backups/postgre_installer"
+STATE_DIR = "/var/lib/postgre_installer"
+BENCH_HISTORY = os.path.join(STATE_DIR, "bench_history.jsonl")
+ARCHIVE_DIR = os.path.join(BACKUP_ROOT, "wal_archive")
+ARCHIVE_HELPER = "/usr/local/bin/postgre-wal"
 
 
 class TextFormat:
@@ -37,13 +88,367 @@ class TextFormat:
         lightcyan = '\033[96m'
 
 
-def cmd(command):
+class Profiler:
+    """Timed spans of commands, probes, menus and sleeps with parent/child relations per thread"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        stack = self.local.__dict__.setdefault("stack", [])
+        if stack:
+            args["parent"] = stack[-1][0]
+        frame = [name, 0.0]
+        stack.append(frame)
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - begin
+            stack.pop()
+            if stack:
+                stack[-1][1] += duration
+            event = {"name": name, "cat": category, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                     "ts": round((begin - self.started) * 1e6), "dur": round(duration * 1e6), "args": args,
+                     "self": duration - frame[1]}
+            with self.lock:
+                self.events.append(event)
+
+    def export(self, path):
+        """Write Chrome trace-event JSON (chrome://tracing, Perfetto) and print summary table"""
+
+        with self.lock:
+            events = list(self.events)
+        summary = {}
+        for event in events:
+            entry = summary.setdefault((event["cat"], event["name"]), [0, 0.0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += event["dur"] / 1000.0
+            entry[2] += event.pop("self") * 1000.0
+            entry[3] = max(entry[3], event["dur"] / 1000.0)
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        rows = sorted(summary.items(), key=lambda item: -item[1][2])
+        printf(format_table(["Category", "Name", "Count", "Total ms", "Self ms", "Max ms"],
+                            [[category, name, str(count), "%.1f" % total, "%.1f" % own, "%.1f" % longest]
+                             for (category, name), (count, total, own, longest) in rows]), TextFormat.Colors.orange)
+        printf("Trace saved into " + path, TextFormat.Colors.green, TextFormat.bold)
+
+
+def span(name, category, **args):
+    """Profiler span, no-op unless --profile is passed"""
+
+    return PROFILER.span(name, category, **args) if PROFILER is not None else contextlib.ExitStack()
+
+
+def traced(category):
+    """Decorator which records every call of function as span"""
+
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(function.__qualname__, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def pause(seconds):
+    """Sleep which is visible in profile"""
+
+    if seconds:
+        with span("sleep", "sleep", seconds=seconds):
+            time.sleep(seconds)
+
+
+def prompt(text):
+    """Wait for user input, kept out of render time of menus"""
+
+    with span("input", "wait"):
+        return str(input(text))
+
+
+class OperationLog:
+    """JSON lines record of every command with its step, duration, exit code and output.
+
+    Records are queued and written in batches by background thread, file is gzipped away when it grows over
+    max_bytes or gets older than max_age and only keep newest archives are left.
+    """
+
+    def __init__(self, directory=LOG_DIR, max_bytes=LOG_MAX_BYTES, max_age=LOG_MAX_AGE, keep=LOG_KEEP):
+        self.directory = directory
+        self.path = os.path.join(directory, "operations.jsonl")
+        self.max_bytes, self.max_age, self.keep = max_bytes, max_age, keep
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.file = None
+        self.started = None
+        self.local = threading.local()
+        self.default_step = "menu"
+
+    @contextlib.contextmanager
+    def step(self, name):
+        """Label records of commands run by this thread inside block"""
+
+        previous = getattr(self.local, "step", None)
+        self.local.step = name
+        try:
+            yield
+        finally:
+            self.local.step = previous
+
+    def write(self, record):
+        record.setdefault("step", getattr(self.local, "step", None) or self.default_step)
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.writer, daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+        self.queue.put(record)
+
+    def open(self):
+        """Open log in fixed location, fall back into home directory when it is not writable"""
+
+        for directory in (self.directory, os.path.join(os.path.expanduser("~"), ".postgre_installer")):
+            try:
+                os.makedirs(directory, exist_ok=True)
+                self.directory, self.path = directory, os.path.join(directory, "operations.jsonl")
+                self.file = open(self.path, "a", buffering=1024 * 1024)
+                break
+            except OSError:
+                self.file = None
+        try:
+            with open(self.path) as file:
+                self.started = json.loads(file.readline())["epoch"]
+        except (OSError, ValueError, KeyError):
+            self.started = time.time()
+
+    def archives(self):
+        return sorted((os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                       if name.startswith("operations-") and name.endswith(".jsonl.gz")), key=os.path.getmtime)
+
+    def rotate(self):
+        self.file.close()
+        stamp, number = time.strftime("%Y%m%d-%H%M%S"), 0
+        archive = os.path.join(self.directory, "operations-" + stamp + ".jsonl.gz")
+        while os.path.exists(archive):
+            number += 1
+            archive = os.path.join(self.directory, "operations-" + stamp + "." + str(number) + ".jsonl.gz")
+        with open(self.path, "rb") as source, gzip.open(archive, "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(self.path)
+        for path in self.archives()[:-self.keep]:
+            os.remove(path)
+        self.file = open(self.path, "a", buffering=1024 * 1024)
+        self.started = time.time()
+
+    def writer(self):
+        self.open()
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            if self.file is None:
+                continue
+            try:
+                if self.file.tell() and time.time() - self.started >= self.max_age:
+                    self.rotate()
+                self.file.writelines(json.dumps(record) + "\n" for record in batch if record is not None)
+                self.file.flush()
+                if self.file.tell() >= self.max_bytes:
+                    self.rotate()
+            except OSError:
+                pass
+        if self.file is not None:
+            self.file.close()
+
+    def close(self):
+        """Flush queued records, called at exit"""
+
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(5)
+
+    def records(self):
+        """Records of archives and current file, oldest first"""
+
+        paths = (self.archives() if os.path.isdir(self.directory) else []) + [self.path]
+        for path in paths:
+            try:
+                with (gzip.open(path, "rt") if path.endswith(".gz") else open(path)) as file:
+                    for line in file:
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            continue
+            except OSError:
+                continue
+
+
+OPERATION_LOG = OperationLog()
+
+
+class ServerState:
+    """Cached snapshot of installed\\running\\autorun status"""
+
+    def __init__(self, ttl=STATE_TTL):
+        self.ttl = ttl
+        self.installed = False
+        self.running = False
+        self.autorun = False
+        self.updated = None
+
+    def is_stale(self):
+        return self.updated is None or time.monotonic() - self.updated > self.ttl
+
+    @traced("probe")
+    def refresh(self):
+        """Collect all facts at once, skip service probes if server is not installed"""
+
+        self.installed = probe_installed()
+        self.running = self.installed and probe_running()
+        self.autorun = self.installed and probe_autorun()
+        self.updated = time.monotonic()
+        return self
+
+    def get(self):
+        return self.refresh() if self.is_stale() else self
+
+    def invalidate(self):
+        self.updated = None
+
+
+SERVER_STATE = ServerState()
+
+
+class CommandResult:
+    """Exit code, output lines and duration of finished command"""
+
+    def __init__(self, argv, returncode, lines, duration, timed_out=False):
+        self.argv = argv
+        self.returncode = returncode
+        self.lines = lines
+        self.duration = duration
+        self.timed_out = timed_out
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.timed_out
+
+    @property
+    def output(self):
+        return "".join(self.lines)
+
+
+def user_context(user):
+    """Build command prefix, environment and home directory to run command as another user.
+
+    Privileges are dropped by setpriv (runuser where it is missing) instead of preexec_fn, which may deadlock
+    in child forked while other threads hold locks.
+    """
+
+    entry = pwd.getpwnam(user)
+    env = dict(os.environ, HOME=entry.pw_dir, USER=entry.pw_name, LOGNAME=entry.pw_name)
+    home = entry.pw_dir if os.path.isdir(entry.pw_dir) else "/"
+    if os.getuid() == entry.pw_uid:
+        return [], env, home
+    if shutil.which("setpriv"):
+        return ["setpriv", "--reuid", str(entry.pw_uid), "--regid", str(entry.pw_gid), "--init-groups", "--"], env, home
+    return ["runuser", "-u", entry.pw_name, "--"], env, home
+
+
+def run(argv, timeout=None, log=True, echo=False, user=None, env=None):
+    """Execute command without shell, stream output line by line into terminal and record it in operation log"""
+
+    with span(os.path.basename(argv[0]), "command", argv=" ".join(argv)):
+        prefix, cwd = [], None
+        if user is not None:
+            prefix, env, cwd = user_context(user)
+        started = time.monotonic()
+        try:
+            # own process group lets timeout kill whole tree, children holding stdout would block reading otherwise
+            process = subprocess.Popen(prefix + argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, universal_newlines=True, bufsize=1, env=env, cwd=cwd,
+                                       start_new_session=True)
+        except OSError as error:
+            if log:
+                OPERATION_LOG.write({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "epoch": time.time(),
+                                     "command": argv, "user": user, "duration": 0.0, "exit_code": 127,
+                                     "timed_out": False, "output": [str(error)]})
+            return CommandResult(argv, 127, [str(error) + "\n"], time.monotonic() - started)
+
+        expired = threading.Event()
+
+        def kill_group():
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+        def kill():
+            expired.set()
+            kill_group()
+
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+        lines = []
+        try:
+            for line in process.stdout:
+                lines.append(line)
+                if echo:
+                    print(line, end="", flush=True)
+            returncode = process.wait()
+        except KeyboardInterrupt:
+            kill_group()  # Ctrl+C from terminal does not reach own process group
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+        result = CommandResult(argv, returncode, lines, time.monotonic() - started, expired.is_set())
+        if log:
+            OPERATION_LOG.write({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "epoch": time.time(),
+                                 "command": argv, "user": user, "duration": round(result.duration, 3),
+                                 "exit_code": returncode, "timed_out": result.timed_out,
+                                 "output": [line.rstrip("\n") for line in lines]})
+        return result
+
+
+def interactive(argv, user=None):
+    """Execute command attached to terminal and return its exit code"""
+
+    prefix, env, cwd = user_context(user) if user is not None else ([], None, None)
+    try:
+        with span(os.path.basename(argv[0]), "command", argv=" ".join(argv)):
+            return subprocess.call(prefix + argv, env=env, cwd=cwd)
+    except OSError as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        return 127
+
+
+def cmd(argv, timeout=None):
     """Execute command in quiet/verbose mode and log output into file"""
 
-    if VERBOSE_MODE:
-        os.system(command + " | tee -a " + LOGFILE_NAME)
-    else:
-        os.system(command + " &>> " + LOGFILE_NAME)
+    return run(argv, timeout=timeout, echo=VERBOSE_MODE)
+
+
+def report_failure(result):
+    """Print which command failed and how"""
+
+    reason = "timed out" if result.timed_out else "exited with code " + str(result.returncode)
+    printf("[Failed] \"" + " ".join(result.argv) + "\" " + reason + ". See " + OPERATION_LOG.path + " for details.",
+           TextFormat.Colors.red, TextFormat.bold)
 
 
 def printf(text, color="", style="", end="\n"):
@@ -55,12 +460,11 @@ def printf(text, color="", style="", end="\n"):
 def clear(delay=0, hard=False):
     """A simple function which clear terminal"""
 
-    time.sleep(delay)
+    pause(delay)
     if hard:
-        os.system("reset")
+        print(chr(27) + "c", end="", flush=True)
     else:
-        print(chr(27) + "[2J")
-        os.system("clear")
+        print(chr(27) + "[H" + chr(27) + "[2J" + chr(27) + "[3J", end="", flush=True)
 
 
 def show_welcome(timeout=0, only_banner=False):
@@ -83,13 +487,14 @@ def show_welcome(timeout=0, only_banner=False):
 #                           by Vlad Savchuk <group 385>
 """
     printf(banner, TextFormat.Colors.lightgreen, TextFormat.bold)
-    time.sleep(timeout)
+    pause(timeout)
 
     if not only_banner:
         printf("   Hey there! This script will help you to configure\nyour PostgreSQL server on CentOS.")
     print()
 
 
+@traced("menu")
 def show_status():
     """Print install\\running status into terminal"""
 
@@ -120,9 +525,15 @@ def show_status():
         printf("\t⚫ ", TextFormat.Colors.red, TextFormat.bold, end="")
         printf("No", TextFormat.Colors.red, TextFormat.bold)
     print("========================")
+    clusters = load_clusters()
+    if clusters:
+        show_clusters(clusters)
+        if CLUSTER is not None:
+            printf("Menus manage cluster " + CLUSTER + ".", TextFormat.Colors.lightblue)
     print()
 
 
+@traced("menu")
 def main_menu():
     """Function that show main menu and wait for user input"""
 
@@ -133,10 +544,12 @@ def main_menu():
            "  2. Manage & Configure server\n"
            "  3. Operations with databases\n"
            "  4. Delete server\n"
+           "  5. Clusters\n"
            "  q. Exit")
-    return str(input(TextFormat.underline + TextFormat.bold + "Your choice" + TextFormat.reset + " >>> "))
+    return prompt(TextFormat.underline + TextFormat.bold + "Your choice" + TextFormat.reset + " >>> ")
 
 
+@traced("menu")
 def config_menu():
     """Function that show config menu and wait for user input"""
 
@@ -151,6 +564,10 @@ def config_menu():
         menu_str += "\n"
         menu_str += "  5. Edit configuration file"
         menu_str += "\n"
+        menu_str += "  6. Tune configuration for hardware"
+        menu_str += "\n"
+        menu_str += "  7. Change parameter (reload when possible)"
+        menu_str += "\n"
         menu_str += "  0. Back (to Main menu)"
 
         clear()
@@ -159,7 +576,10 @@ def config_menu():
         printf("[Main menu]", end=" ")
         printf("> Manage & Configure menu:", TextFormat.bold)
         printf(menu_str)
-        return str(input(TextFormat.underline + TextFormat.bold + "Your choice" + TextFormat.reset + " >>> "))
+        pending = pending_restart()
+        if pending:
+            printf("[Pending Restart] " + ", ".join(sorted(pending)), TextFormat.Colors.yellow, TextFormat.bold)
+        return prompt(TextFormat.underline + TextFormat.bold + "Your choice" + TextFormat.reset + " >>> ")
     clear()
     show_welcome()
     printf("[Not Installed] Install PostgreSQL first.", TextFormat.Colors.yellow, TextFormat.bold)
@@ -167,6 +587,7 @@ def config_menu():
     return '0'
 
 
+@traced("menu")
 def operations_menu():
     """Function that show operations menu and wait for user input"""
 
@@ -177,6 +598,16 @@ def operations_menu():
             menu_str += "  2. Show users\n"
             menu_str += "  3. Show databases\n"
             menu_str += "  4. Show tables in database\n"
+            menu_str += "  5. Export tables\n"
+            menu_str += "  6. Import tables\n"
+            menu_str += "  7. Backup databases\n"
+            menu_str += "  8. Restore from backup\n"
+            menu_str += "  9. Live performance dashboard\n"
+            menu_str += "  10. Slow-query and top-statement analyzer\n"
+            menu_str += "  11. Benchmark (pgbench)\n"
+            menu_str += "  12. Maintenance (vacuum & reindex bloated objects)\n"
+            menu_str += "  13. Index advisor\n"
+            menu_str += "  14. WAL archiving & point-in-time restore\n"
             menu_str += "  0. Back (to Main menu)"
 
             clear()
@@ -184,7 +615,11 @@ def operations_menu():
             printf("[Main menu]", end=" ")
             printf("> Operations menu:", TextFormat.bold)
             printf(menu_str)
-            return str(input(TextFormat.underline + TextFormat.bold + "Your choice" + TextFormat.reset + " >>> "))
+            try:
+                get_session()
+            except SessionError as error:
+                printf("[No Connection] " + str(error), TextFormat.Colors.yellow, TextFormat.bold)
+            return prompt(TextFormat.underline + TextFormat.bold + "Your choice" + TextFormat.reset + " >>> ")
         else:
             clear()
             show_welcome()
@@ -215,18 +650,31 @@ def print_progress_bar(iteration, total, prefix='Progress:', suffix='Complete',
     percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
     filled_length = int(length * iteration // total)
     bar = fill * filled_length + '-' * (length - filled_length)
-    print('\r%s |%s| %s%% %s' % (prefix, bar, percent, suffix), print_end)
+    print('\r%s |%s| %s%% %s' % (prefix, bar, percent, suffix), end=print_end, flush=True)
 
 
 def send_notify(message):
     """Function which send graphical notification"""
 
-    os.system("sudo -u $USER DISPLAY=:0 DBUS_SESSION_BUS_ADDRESS=unix:path=/run/user/1000/bus notify-send -a "
-              "terminal \"PostgreSQL - Installation Script\" \"" + message + "\"")
+    user = os.environ.get("SUDO_USER") or os.environ.get("USER") or "root"
+    try:
+        uid = pwd.getpwnam(user).pw_uid
+    except KeyError:
+        return
+    env = dict(os.environ, DISPLAY=":0", DBUS_SESSION_BUS_ADDRESS="unix:path=/run/user/" + str(uid) + "/bus")
+    prefix = user_context(user)[0]
+    try:
+        subprocess.Popen(prefix + ["notify-send", "-a", "terminal", "PostgreSQL - Installation Script", message],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    except OSError:
+        pass
 
 
 def version():
-    return os.popen("postgres -V").read() if is_installed() else "PostgreSQL not found."
+    if not is_installed():
+        return "PostgreSQL not found."
+    result = native_version() if NATIVE_PROBES else None
+    return result if result is not None else run(["postgres", "-V"], timeout=10, log=False).output
 
 
 def is_root():
@@ -239,11 +687,14 @@ def is_root():
     return True
 
 
+@traced("probe")
 def is_centos():
     """Check if script running on CentOS"""
 
-    result = os.popen("hostnamectl").read()
-    if "centos" not in result.lower():
+    centos = native_centos() if NATIVE_PROBES else None
+    if centos is None:
+        centos = "centos" in run(["hostnamectl"], timeout=10, log=False).output.lower()
+    if not centos:
         printf("[Not Supported] Sorry, but this script only works with CentOS.", TextFormat.Colors.yellow,
                TextFormat.bold)
         return False
@@ -253,29 +704,215 @@ def is_centos():
 def is_installed():
     """Check if PostgreSQL installed"""
 
-    result = os.popen("yum list installed -q | grep postgresql").read()
-    if len(result) != 0:
-        return True
-    return False
+    return SERVER_STATE.get().installed
 
 
 def is_running():
     """Check PostgreSQL running status"""
 
-    result = os.popen("systemctl status postgresql 2>&1 | grep -i running").read()
-    if len(result) != 0:
-        return True
-    return False
+    return SERVER_STATE.get().running
 
 
 def is_autorun():
     """Check if PostgreSQL starting at system boot"""
 
-    result = os.popen("ls /etc/systemd/system/multi-user.target.wants/ | grep postgresql.service").read()
-    if len(result) == 0:
+    return SERVER_STATE.get().autorun
+
+
+@traced("probe")
+def probe_installed():
+    """Check if PostgreSQL installed by server binary or package manager"""
+
+    if NATIVE_PROBES:
+        return os.path.exists(POSTGRES_BIN)
+    result = run(["yum", "list", "installed", "-q"], timeout=300, log=False)
+    return any("postgresql" in line for line in result.lines)
+
+
+@traced("probe")
+def probe_running():
+    """Check PostgreSQL running status by pid file, fallback to systemd"""
+
+    result = native_running() if NATIVE_PROBES else None
+    if result is not None:
+        return result
+    result = run(["systemctl", "status", SERVICE], timeout=10, log=False)
+    return "running" in result.output.lower()
+
+
+@traced("probe")
+def probe_autorun():
+    """Look for PostgreSQL unit in boot target"""
+
+    if NATIVE_PROBES and os.path.isdir(BOOT_TARGET_WANTS):
+        return os.path.lexists(os.path.join(BOOT_TARGET_WANTS, SERVICE + ".service"))
+    result = run(["systemctl", "is-enabled", SERVICE], timeout=10, log=False)
+    return result.output.strip() == "enabled"
+
+
+def native_centos():
+    """Read distribution id from os-release, None if file is missing"""
+
+    try:
+        with open(OS_RELEASE) as file:
+            fields = dict(line.rstrip("\n").split("=", 1) for line in file if "=" in line)
+    except OSError:
+        return None
+    ids = (fields.get("ID", "") + " " + fields.get("ID_LIKE", "")).replace('"', "").lower()
+    return "centos" in ids.split()
+
+
+def native_running(data_dir=None):
+    """Check that postmaster from pid file is alive, None if data directory is unreadable"""
+
+    data_dir = data_dir or PGDATA
+    try:
+        with open(os.path.join(data_dir, "postmaster.pid")) as file:
+            pid = file.readline().strip()
+    except FileNotFoundError:
+        if not os.path.exists(data_dir) or os.access(data_dir, os.R_OK | os.X_OK):
+            return False
+        return None
+    except OSError:
+        return None
+    if not pid.isdigit():
         return False
-    else:
-        return True
+    try:
+        with open("/proc/" + pid + "/comm") as file:
+            return file.read().strip() in ("postgres", "postmaster")
+    except FileNotFoundError:
+        return False
+    except OSError:
+        return None
+
+
+def server_version_num(data_dir=None):
+    """Major version of cluster as number like server_version_num (90200, 120000), 0 if unknown"""
+
+    data_dir = data_dir or PGDATA
+    try:
+        with open(os.path.join(data_dir, "PG_VERSION")) as file:
+            parts = file.read().strip().split(".")
+    except OSError:
+        return 0
+    if int(parts[0]) >= 10:
+        return int(parts[0]) * 10000
+    return int(parts[0]) * 10000 + int(parts[1]) * 100
+
+
+def system_identifier(data_dir=None):
+    """Database system identifier from pg_control, every initdb gets new one"""
+
+    with open(os.path.join(data_dir or PGDATA, "global", "pg_control"), "rb") as file:
+        return str(struct.unpack("=Q", file.read(8))[0])
+
+
+def native_version(data_dir=None):
+    """Read major version of initialized cluster, None if there is no cluster yet"""
+
+    data_dir = data_dir or PGDATA
+    try:
+        with open(os.path.join(data_dir, "PG_VERSION")) as file:
+            return "postgres (PostgreSQL) " + file.read().strip() + "\n"
+    except OSError:
+        return None
+
+
+class Prefetch:
+    """Background download of server packages into local cache"""
+
+    def __init__(self, cache_dir=RPM_CACHE):
+        self.cache_dir = cache_dir
+        self.thread = None
+        self.result = None
+
+    def start(self):
+        if self.is_complete():
+            return  # valid cache from earlier run is reused
+        marker = os.path.join(self.cache_dir, ".complete")
+        if os.path.exists(marker):
+            os.remove(marker)  # clean_directory keeps dot files, stale marker would outlive its packages
+        clean_directory(self.cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self.download, daemon=True)
+        self.thread.start()
+
+    def download(self):
+        self.result = run(["yum", "-y", "install", "--downloadonly", "--downloaddir=" + self.cache_dir,
+                           "postgresql-server"], timeout=1800, log=False)
+        if self.result.ok and local_rpms(self.cache_dir):
+            open(os.path.join(self.cache_dir, ".complete"), "w").close()
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+
+    def is_complete(self):
+        return os.path.exists(os.path.join(self.cache_dir, ".complete")) and bool(local_rpms(self.cache_dir))
+
+
+PREFETCH = Prefetch()
+
+
+def local_rpms(directory):
+    """List rpm files in directory"""
+
+    try:
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".rpm"))
+    except OSError:
+        return []
+
+
+def package_step():
+    """Choose package install step: offline directory, prefetched cache or network"""
+
+    if RPM_DIR is not None:
+        return ("Installing postgresql-server package from " + RPM_DIR + "...",
+                ["yum", "-y", "--disablerepo=*", "localinstall"] + local_rpms(RPM_DIR))
+    if PREFETCH.running():
+        printf(" · Waiting for background package download to finish...", TextFormat.Colors.lightblue)
+        PREFETCH.wait()
+    if PREFETCH.is_complete():
+        return ("Installing postgresql-server package from local cache...",
+                ["yum", "-y", "localinstall"] + local_rpms(PREFETCH.cache_dir))
+    return "Installing postgresql-server package from yum...", ["yum", "-y", "install", "postgresql-server"]
+
+
+def initdb_step():
+    """Initialize default cluster, or selected one from its instance unit"""
+
+    if CLUSTER is None:
+        return "Initializing database...", ["postgresql-setup", "--initdb"]
+    return ("Initializing cluster " + CLUSTER + "...",
+            ["postgresql-setup", "--initdb", "--unit", SERVICE, "--port", os.environ["PGPORT"]])
+
+
+def start_step():
+    return "Starting service...", ["systemctl", "start", SERVICE]
+
+
+def enable_step():
+    return "Configuring PostgreSQL to start on every system boot automatically...", ["systemctl", "enable", SERVICE]
+
+
+def install_steps():
+    """Steps of full installation"""
+
+    return [package_step(), initdb_step(), start_step(), enable_step()]
+
+
+def print_steps(steps, failed=None):
+    """Print finished steps marked as done and optionally the failed one"""
+
+    for title in steps:
+        printf(" · " + title, TextFormat.Colors.lightblue, end=" ")
+        printf("Done.", TextFormat.Colors.green, TextFormat.bold)
+    if failed is not None:
+        printf(" · " + failed, TextFormat.Colors.lightblue, end=" ")
+        printf("Failed.", TextFormat.Colors.red, TextFormat.bold)
 
 
 def install():
@@ -285,57 +922,40 @@ def install():
 
         send_notify("Installation started..")
         clear()
-        print_progress_bar(0, 4)
-        printf(" · Installing postgresql-server package from yum...\n", TextFormat.Colors.lightblue)
-        cmd("sudo yum -y install postgresql-server")
-
-        clear(3)
-        print_progress_bar(1, 4)
-        printf(" · Installing postgresql-server package from yum...", TextFormat.Colors.lightblue, end=" ")
-        printf("Done.", TextFormat.Colors.green, TextFormat.bold)
-        time.sleep(1)
-        printf(" · Initializing database...\n", TextFormat.Colors.lightblue)
-        cmd("sudo postgresql-setup --initdb")
-
-        clear(3)
-        print_progress_bar(2, 4)
-        printf(" · Installing postgresql-server package from yum...", TextFormat.Colors.lightblue, end=" ")
-        printf("Done.", TextFormat.Colors.green, TextFormat.bold)
-        printf(" · Initializing database...", TextFormat.Colors.lightblue, end=" ")
-        printf("Done.", TextFormat.Colors.green, TextFormat.bold)
-        time.sleep(1)
-        printf(" · Starting service...\n", TextFormat.Colors.lightblue)
-        cmd("sudo systemctl start postgresql")
-
-        clear(3)
-        print_progress_bar(3, 4)
-        printf(" · Installing postgresql-server package from yum...", TextFormat.Colors.lightblue, end=" ")
-        printf("Done.", TextFormat.Colors.green, TextFormat.bold)
-        printf(" · Initializing database...", TextFormat.Colors.lightblue, end=" ")
-        printf("Done.", TextFormat.Colors.green, TextFormat.bold)
-        printf(" · Starting service...", TextFormat.Colors.lightblue, end=" ")
-        printf("Done.", TextFormat.Colors.green, TextFormat.bold)
-        time.sleep(1)
-        printf(" · Configuring PostgreSQL to start on every system boot automatically...\n",
-               TextFormat.Colors.lightblue)
-        cmd("sudo systemctl enable postgresql")
+        steps = install_steps()
+        titles = [title for title, _ in steps]
+        for i, (title, argv) in enumerate(steps):
+            if i:
+                clear(3)
+                print_progress_bar(i, len(steps))
+                print_steps(titles[:i])
+                pause(1)
+            else:
+                print_progress_bar(0, len(steps))
+            printf(" · " + title + "\n", TextFormat.Colors.lightblue)
+            with OPERATION_LOG.step(title):
+                result = cmd(argv)
+            if not result.ok:
+                SERVER_STATE.invalidate()
+                clear(3)
+                print_progress_bar(i, len(steps))
+                print_steps(titles[:i], failed=title)
+                print()
+                report_failure(result)
+                send_notify("Installation failed!")
+                input("Press <Enter> to continue..")
+                clear()
+                return
 
         clear(3)
-        print_progress_bar(4, 4)
-        printf(" · Installing postgresql-server package from yum...", TextFormat.Colors.lightblue,
-               end=" ")
-        printf("Done.", TextFormat.Colors.green, TextFormat.bold)
-        printf(" · Initializing database...", TextFormat.Colors.lightblue, end=" ")
-        printf("Done.", TextFormat.Colors.green, TextFormat.bold)
-        printf(" · Starting service...", TextFormat.Colors.lightblue, end=" ")
-        printf("Done.", TextFormat.Colors.green, TextFormat.bold)
-        printf(" · Configuring PostgreSQL to start on every system boot automatically...",
-               TextFormat.Colors.lightblue, end=" ")
-        printf("Done.", TextFormat.Colors.green, TextFormat.bold)
-        time.sleep(1)
+        print_progress_bar(len(steps), len(steps))
+        print_steps(titles)
+        pause(1)
         print()
+        SERVER_STATE.invalidate()
         printf("Successfully installed!", TextFormat.Colors.green, TextFormat.bold)
         send_notify("Successfully installed!")
+        ask_tune()
         clear(3)
 
     else:
@@ -345,156 +965,3978 @@ def install():
         clear(3)
 
 
-def config(choice):
-    """Configure & Manage PostgreSQL"""
+TUNING_PROFILES = ("oltp", "analytics", "mixed")
 
-    if choice == '1':
-        if is_running():
-            cmd("sudo systemctl stop postgresql")
-            printf("Stopping..", TextFormat.Colors.lightblue)
-            time.sleep(1)
-        else:
-            cmd("sudo systemctl start postgresql")
-            printf("Starting..", TextFormat.Colors.lightblue)
-            time.sleep(1)
 
-    elif choice == '2':
-        cmd("sudo systemctl restart postgresql")
-        printf("Restarting..", TextFormat.Colors.lightblue)
-        time.sleep(1)
+def hardware():
+    """Total memory in kB, CPU count and whether data directory lives on SSD"""
 
-    elif choice == '3':
-        if is_autorun():
-            cmd("sudo systemctl disable postgresql")
-            printf("Disable autorun..", TextFormat.Colors.lightblue)
-            time.sleep(1)
-        else:
-            cmd("sudo systemctl enable postgresql")
-            printf("Enable autorun..", TextFormat.Colors.lightblue)
-            time.sleep(1)
+    memory = 0
+    with open("/proc/meminfo") as file:
+        for line in file:
+            if line.startswith("MemTotal:"):
+                memory = int(line.split()[1])
+    return memory, os.cpu_count() or 1, is_ssd(PGDATA if os.path.exists(PGDATA) else "/")
 
-    elif choice == '4':
-        os.system("sudo passwd postgres")
-        time.sleep(3)
 
-    elif choice == '5':
-        if os.system("sudo ls /var/lib/pgsql/data | grep postresql.conf") != "":
-            printf("Opening configuration file..", TextFormat.Colors.lightblue)
-            time.sleep(1)
-            os.system("sudo nano /var/lib/pgsql/data/postgresql.conf")
-        else:
-            printf("[Not Exist] Configuration file not exist, try to reinstall.", TextFormat.Colors.yellow)
+def is_ssd(path):
+    """Read rotational flag of block device holding path, partitions keep it in parent device"""
 
-    clear()
+    device = os.stat(path).st_dev
+    sys_path = os.path.realpath("/sys/dev/block/%d:%d" % (os.major(device), os.minor(device)))
+    for candidate in (sys_path, os.path.dirname(sys_path)):
+        try:
+            with open(os.path.join(candidate, "queue", "rotational")) as file:
+                return file.read().strip() == "0"
+        except OSError:
+            continue
+    flags = []
+    for name in os.listdir("/sys/block") if os.path.isdir("/sys/block") else []:
+        try:
+            with open(os.path.join("/sys/block", name, "queue", "rotational")) as file:
+                flags.append(file.read().strip())
+        except OSError:
+            continue
+    return bool(flags) and "1" not in flags
 
 
-def operations(choice):
-    """Operations with PostgreSQL"""
+def memory_value(kb):
+    """Format kB as postgresql.conf memory value"""
 
-    if choice == '1':
-        printf("Entering into psql..\n", TextFormat.Colors.lightblue)
-        clear(1)
-        os.system("sudo su - postgres -c \"psql\"")
-        printf("Exited from psql.", TextFormat.Colors.lightblue)
-        time.sleep(1)
+    if kb >= 1024 * 1024 and kb % (1024 * 1024) == 0:
+        return str(kb // 1024 // 1024) + "GB"
+    if kb >= 1024:
+        return str(kb // 1024) + "MB"
+    return str(kb) + "kB"
 
-    elif choice == '2':
-        db_list = os.popen("sudo su - postgres -c \"psql -c \\\"\\\\du\\\"\"").read()
-        printf(db_list, TextFormat.Colors.orange)
-        input("Press <Enter> to continue..")
 
-    elif choice == '3':
-        db_list = os.popen("sudo su - postgres -c \"psql -l\"").read()
-        printf(db_list, TextFormat.Colors.orange)
-        input("Press <Enter> to continue..")
+def compute_settings(profile, memory, cpus, ssd, version, connections=100):
+    """Settings for workload profile which are supported by server version"""
 
-    elif choice == '4':
-        db_list = os.popen("sudo su - postgres -c \"psql -l\"").read()
-        printf(db_list, TextFormat.Colors.orange)
-        db_name = input("Choose database (enter name) >>> ")
-        tables_list = os.popen("sudo su - postgres -c \"psql -c \\\"\\\\c " + db_name + "\\\" -c \\\"\\\\dt\\\"\"").read()
-        printf(tables_list, TextFormat.Colors.orange)
-        table_name = input("Choose table (enter name) >>> ")
-        table_content = os.popen("sudo su - postgres -c \"psql -c \\\"\\\\c " + db_name + "\\\" -c \\\"SELECT * FROM " + table_name + ";\\\"\"").read()
-        printf(table_content, TextFormat.Colors.orange)
-        input("Press <Enter> to continue..")
+    shared_buffers = memory // 4
+    divider = {"oltp": 3, "mixed": 2, "analytics": 1}[profile]
+    parallel = max(1, min(4 if profile != "oltp" else 2, cpus // 2))
+    settings = {
+        "shared_buffers": memory_value(shared_buffers),
+        "effective_cache_size": memory_value(memory * 3 // 4),
+        "work_mem": memory_value(max(4096, (memory - shared_buffers) // (connections * divider) // parallel)),
+        "maintenance_work_mem": memory_value(min(2 * 1024 * 1024, memory // (16 if profile == "oltp" else 8))),
+        "checkpoint_completion_target": "0.9",
+        "wal_buffers": "16MB",
+        "default_statistics_target": "500" if profile == "analytics" else "100",
+        "random_page_cost": "1.1" if ssd else "4",
+        "effective_io_concurrency": "200" if ssd else "2",
+    }
+    wal_gb = {"oltp": 4, "mixed": 8, "analytics": 16}[profile]
+    if version >= 90500:
+        settings["max_wal_size"] = str(wal_gb) + "GB"
+        settings["min_wal_size"] = str(wal_gb // 4) + "GB"
+    else:
+        settings["checkpoint_segments"] = str(wal_gb * 16)
+    if version >= 90400:
+        # standby refuses to start with less than its primary has, so never go below default of 8
+        settings["max_worker_processes"] = str(max(8, cpus))
+    if version >= 90600:
+        settings["max_parallel_workers_per_gather"] = str(parallel)
+    if version >= 100000:
+        settings["max_parallel_workers"] = str(cpus)
+    if version >= 110000:
+        settings["max_parallel_maintenance_workers"] = str(parallel)
+    return settings
 
-    clear()
 
+# "=" is optional in active lines only, otherwise prose comment starting with parameter name would match
+CONF_LINE = re.compile(r"^(?P<comment>\s*#\s*)?(?P<name>[a-z_.]+)(?(comment)\s*=\s*|(?:\s*=\s*|\s+))"
+                       r"(?P<value>'(?:[^']|'')*'|[^\s#]+)(?P<rest>.*)$", re.IGNORECASE)
 
-def remove():
-    """Remove PostgreSQL"""
 
-    if is_installed():
-        printf("Do you want to keep configurations and databases?", TextFormat.Colors.yellow, TextFormat.bold)
-        answer = str(input("[y,n] >>> "))
-        if (answer.lower() == 'y') | (answer.lower() == 'n'):
-            send_notify("Removing PostgreSQL..")
-            clear()
-            printf(" · Removing postgresql-server package...\n", TextFormat.Colors.lightblue)
-            cmd("sudo yum -y remove postgresql-server")
-            clear(3)
-            printf(" · Removing postgresql-server package...", TextFormat.Colors.lightblue, end=" ")
-            printf("Done.", TextFormat.Colors.green, TextFormat.bold)
-            time.sleep(1)
+CONF_INCLUDE = re.compile(r"^\s*(?P<kind>include_if_exists|include_dir|include)\s*=?\s*'(?P<path>[^']*)'",
+                          re.IGNORECASE)
 
-            if answer.lower() == 'n':
-                printf(" · Removing configurations from /var/lib/pgsql ...\n", TextFormat.Colors.lightblue)
-                cmd("sudo rm -rf /var/lib/pgsql/*")
-                clear(3)
-                printf(" · Removing postgresql-server package...", TextFormat.Colors.lightblue, end=" ")
-                printf("Done.", TextFormat.Colors.green, TextFormat.bold)
-                printf(" · Removing configurations from /var/lib/pgsql ...", TextFormat.Colors.lightblue, end=" ")
-                printf("Done.", TextFormat.Colors.green, TextFormat.bold)
-                time.sleep(1)
-                print()
 
-            printf("All done!", TextFormat.Colors.green, TextFormat.bold)
-            send_notify("Successfully removed!")
-            clear(3)
-        else:
-            printf("[Cancelled] Removing aborted.", TextFormat.Colors.lightblue, TextFormat.bold)
-            clear(3)
-    else:
-        clear()
-        show_welcome()
-        printf("[Not Installed] Can`t remove PostgreSQL, because it is not installed!", TextFormat.Colors.yellow,
-               TextFormat.bold)
-        clear(3)
+def unquote_conf(value):
+    if value.startswith("'") and value.endswith("'") and len(value) > 1:
+        return value[1:-1].replace("''", "'").replace("\\'", "'")
+    return value
 
 
-def entry_point():
-    global VERBOSE_MODE
+def quote_conf(value):
+    if re.match(r"^-?[A-Za-z0-9_.]+$", value):
+        return value
+    return "'" + value.replace("'", "''") + "'"
 
-    if sys.argv.__contains__("--verbose") | sys.argv.__contains__("-v"):
-        VERBOSE_MODE = True
-        main()
 
-    elif sys.argv.__contains__("--status") | sys.argv.__contains__("-s"):
-        show_status()
+class ConfigFile:
+    """postgresql.conf with its include files, edited line by line so comments and layout survive"""
 
-    elif sys.argv.__contains__("--author") | sys.argv.__contains__("-a"):
-        show_welcome(only_banner=True)
-        printf("If you have any questions or suggestions,\nfeel free to write me here: t.me/savchuk_vlad.")
+    def __init__(self, path):
+        self.path = path
+        with open(path) as file:
+            self.lines = file.readlines()
+        self.original = list(self.lines)
+        self.children = {}
+        for i, line in enumerate(self.lines):
+            match = CONF_INCLUDE.match(line)
+            if not match:
+                continue
+            target = os.path.join(os.path.dirname(path), match.group("path"))
+            if match.group("kind").lower() == "include_dir":
+                paths = sorted(os.path.join(target, name) for name in os.listdir(target)
+                               if name.endswith(".conf")) if os.path.isdir(target) else []
+            else:
+                paths = [target] if os.path.isfile(target) else []
+            self.children[i] = [ConfigFile(child) for child in paths]
 
-    elif sys.argv.__contains__("--version") | sys.argv.__contains__("-V"):
-        print(version())
+    def files(self):
+        yield self
+        for children in self.children.values():
+            for child in children:
+                yield from child.files()
 
-    elif sys.argv.__contains__("--help") | sys.argv.__contains__("-h"):
-        man_page = r""".\" manpage for PostgreSQL Installer
-.\" Contact t.me/savchuk_vlad to correct errors or typos
-.TH posgtgre.py 1 "31 May 2020" "version 1.0" "PostgreSQL Installer manpage"
+    def assignments(self):
+        """Active assignments in order the server reads them: file, line index, name, value"""
 
-.SH NAME
-.B PostgreSQL Installer
-- install, configure, manage and remove PostgreSQL server on CentOS.
+        for i, line in enumerate(self.lines):
+            if i in self.children:
+                for child in self.children[i]:
+                    yield from child.assignments()
+                continue
+            match = CONF_LINE.match(line)
+            if match and not match.group("comment"):
+                yield self, i, match.group("name").lower(), unquote_conf(match.group("value"))
 
-.SH SYNOPSIS
-.B postgre.py
-.RI "[" FLAG "]..."
+    def values(self):
+        return {name: value for _, _, name, value in self.assignments()}
 
-.SH DESCRIPTION
-.B postgre.py
+    def set(self, name, value):
+        """Replace last active assignment wherever it is, else commented default line, else append"""
+
+        name = name.lower()
+        line = name + " = " + quote_conf(value) + "\t\t# set by postgre.py\n"
+        last = None
+        for file, index, other, _ in self.assignments():
+            if other == name:
+                last = file, index
+        if last is not None:
+            last[0].lines[last[1]] = line
+            return
+        for i, other in enumerate(self.lines):
+            match = CONF_LINE.match(other)
+            if match and match.group("comment") and match.group("name").lower() == name:
+                self.lines[i] = line
+                return
+        self.lines.append(line)
+
+    def diff(self):
+        return "".join("".join(difflib.unified_diff(file.original, file.lines, file.path, file.path + " (new)"))
+                       for file in self.files())
+
+    def save(self):
+        """Write changed files, keep backup copy of every one"""
+
+        for file in self.files():
+            if file.lines != file.original:
+                shutil.copy2(file.path, file.path + ".bak-" + time.strftime("%Y%m%d-%H%M%S"))
+                with open(file.path, "w") as output:
+                    output.writelines(file.lines)
+                file.original = list(file.lines)
+
+
+class HbaFile:
+    """pg_hba.conf rules with comments kept in place"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path) as file:
+            self.lines = file.readlines()
+        self.original = list(self.lines)
+
+    def rules(self):
+        """Index and fields of every rule line"""
+
+        for i, line in enumerate(self.lines):
+            fields = line.split("#", 1)[0].split()
+            if fields:
+                yield i, fields
+
+    def has_rule(self, fields):
+        wanted = [field.lower() for field in fields]
+        return any([field.lower() for field in rule[:len(wanted)]] == wanted for _, rule in self.rules())
+
+    def add_rule(self, fields, comment="added by postgre.py"):
+        """Insert rule before all others, the first matching rule wins"""
+
+        if self.has_rule(fields):
+            return False
+        first = next((i for i, _ in self.rules()), len(self.lines))
+        self.lines.insert(first, "\t".join(fields) + "\t# " + comment + "\n")
+        return True
+
+    def diff(self):
+        return "".join(difflib.unified_diff(self.original, self.lines, self.path, self.path + " (new)"))
+
+    def save(self):
+        if self.lines != self.original:
+            shutil.copy2(self.path, self.path + ".bak-" + time.strftime("%Y%m%d-%H%M%S"))
+            with open(self.path, "w") as output:
+                output.writelines(self.lines)
+            self.original = list(self.lines)
+
+
+UNIT_FACTORS = {"B": 1, "kB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4,
+                "us": 0.001, "ms": 1, "s": 1000, "min": 60000, "h": 3600000, "d": 86400000}
+MEMORY_UNITS = ("B", "kB", "MB", "GB", "TB")
+BOOL_VALUES = ("on", "off", "true", "false", "yes", "no", "1", "0")
+
+
+def setting_number(value, unit):
+    """Convert value with optional unit suffix into units of pg_settings.unit (like "8kB"), None if invalid"""
+
+    match = re.match(r"^\s*(-?\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*$", value)
+    if not match:
+        return None
+    number, suffix = float(match.group(1)), match.group(2)
+    if not suffix:
+        return number
+    base = re.match(r"^(\d*)\s*(\S*)$", unit or "")
+    base_unit = base.group(2) if base else ""
+    if suffix not in UNIT_FACTORS or base_unit not in UNIT_FACTORS or \
+            (suffix in MEMORY_UNITS) != (base_unit in MEMORY_UNITS):
+        return None
+    return number * UNIT_FACTORS[suffix] / (UNIT_FACTORS[base_unit] * int(base.group(1) or 1))
+
+
+def validate_setting(value, info):
+    """Check value against pg_settings row, return error message or None"""
+
+    if info["vartype"] == "bool" and value.lower() not in BOOL_VALUES:
+        return "expects on or off"
+    if info["vartype"] == "enum":
+        allowed = info["enumvals"].strip("{}").replace('"', "").split(",")
+        if value.lower() not in [item.lower() for item in allowed]:
+            return "expects one of " + ", ".join(allowed)
+    if info["vartype"] in ("integer", "real"):
+        number = setting_number(value, info["unit"])
+        if number is None:
+            return "expects number" + (" in " + info["unit"] if info["unit"] != "[NULL]" else "")
+        if info["min_val"] != "[NULL]" and number < float(info["min_val"]) or \
+                info["max_val"] != "[NULL]" and number > float(info["max_val"]):
+            return "out of range " + info["min_val"] + ".." + info["max_val"] + " " + \
+                   (info["unit"] if info["unit"] != "[NULL]" else "")
+    if info["context"] == "internal":
+        return "can not be changed"
+    return None
+
+
+SETTINGS_QUERY = "SELECT name, setting, unit, vartype, min_val, max_val, enumvals, context, sourcefile FROM pg_settings"
+
+
+def settings_info(session, names=None):
+    """pg_settings rows as dicts by name"""
+
+    sql = SETTINGS_QUERY
+    if names is not None:
+        sql += " WHERE name IN (" + ", ".join(quote_literal(name.lower()) for name in names) + ")"
+    columns, rows = session.query(sql)
+    return {row[0]: dict(zip(columns, row)) for row in rows}
+
+
+PENDING_RESTART = "/var/lib/pgsql/.postgre_pending_restart.json"
+DEFAULT_SERVER = (PGDATA, SERVICE, PENDING_RESTART, os.environ.get("PGPORT"))
+
+
+def pending_restart():
+    """Restart-only parameters written but not applied yet"""
+
+    try:
+        with open(PENDING_RESTART) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def add_pending_restart(changes):
+    pending = pending_restart()
+    pending.update(changes)
+    with open(PENDING_RESTART, "w") as file:
+        json.dump(pending, file, indent=2)
+
+
+def clear_pending_restart():
+    if os.path.exists(PENDING_RESTART):
+        os.remove(PENDING_RESTART)
+
+
+def apply_changes(session, changes, restart=None):
+    """Reload configuration and restart only if some changed parameter has postmaster context.
+
+    restart=None asks user, False keeps restart-only changes pending for maintenance window.
+    """
+
+    info = settings_info(session, changes)
+    session.query("SELECT pg_reload_conf()")
+    need_restart = {name: value for name, value in changes.items()
+                    if name in info and info[name]["context"] == "postmaster"}
+    reloaded = sorted(set(changes) - set(need_restart))
+    if reloaded:
+        printf("Applied by reload: " + ", ".join(reloaded), TextFormat.Colors.green)
+    if not need_restart:
+        return True
+    printf("Need restart: " + ", ".join(sorted(need_restart)), TextFormat.Colors.yellow)
+    if restart is None:
+        restart = input("Restart server now? Otherwise changes wait for \"restart-pending\" [y,n] >>> ").lower() == 'y'
+    if not restart:
+        add_pending_restart(need_restart)
+        return True
+    return restart_server()
+
+
+def restart_server():
+    """Restart service and forget pending restart-only changes"""
+
+    close_session()
+    result = cmd(["systemctl", "restart", SERVICE])
+    SERVER_STATE.invalidate()
+    if not result.ok:
+        report_failure(result)
+        return False
+    clear_pending_restart()
+    printf("Server restarted.", TextFormat.Colors.green, TextFormat.bold)
+    return True
+
+
+def set_parameters(session, changes, ask=True, restart=None):
+    """Validate parameters, write them into configuration files, show diff and apply, return True on success"""
+
+    info = settings_info(session, changes)
+    errors = []
+    for name, value in changes.items():
+        if name not in info and "." not in name:
+            errors.append(name + ": unknown parameter")
+        elif name in info:
+            error = validate_setting(value, info[name])
+            if error:
+                errors.append(name + ": " + error)
+    if errors:
+        for error in errors:
+            printf("[Invalid] " + error, TextFormat.Colors.red, TextFormat.bold)
+        return False
+
+    conf = ConfigFile(os.path.join(PGDATA, "postgresql.conf"))
+    system = {}
+    for name, value in changes.items():
+        if name in info and info[name]["sourcefile"].endswith("postgresql.auto.conf"):
+            system[name] = value
+        else:
+            conf.set(name, value)
+    printf(conf.diff(), TextFormat.Colors.orange)
+    for name, value in system.items():
+        printf("ALTER SYSTEM SET " + name + " = " + quote_literal(value), TextFormat.Colors.orange)
+    if ask and input("Write these changes? [y,n] >>> ").lower() != 'y':
+        return False
+    conf.save()
+    for name, value in system.items():
+        session.query("ALTER SYSTEM SET " + name + " = " + quote_literal(value))
+    return apply_changes(session, changes, restart)
+
+
+def parse_assignments(items):
+    """name=value pairs from list of strings"""
+
+    changes = {}
+    for item in items:
+        if "=" not in item:
+            return None
+        name, value = item.split("=", 1)
+        changes[name.strip().lower()] = unquote_conf(value.strip())
+    return changes
+
+
+def tune(profile, ask=True, write=True):
+    """Compute settings for hardware, show difference with current file and write it, return written changes"""
+
+    path = os.path.join(PGDATA, "postgresql.conf")
+    memory, cpus, ssd = hardware()
+    conf = ConfigFile(path)
+    current = conf.values()
+    connections = int(current.get("max_connections", "100"))
+    settings = compute_settings(profile, memory, cpus, ssd, server_version_num(), connections)
+    changes = {name: value for name, value in settings.items() if current.get(name) != value}
+    printf("Hardware: " + memory_value(memory) + " RAM, " + str(cpus) + " CPU, " + ("SSD" if ssd else "HDD") +
+           " storage; profile: " + profile, TextFormat.Colors.lightblue)
+    if not changes:
+        printf("Configuration is already tuned.", TextFormat.Colors.green, TextFormat.bold)
+        return False
+    printf(format_table(["Parameter", "Current", "New"],
+                        [[name, current.get(name, "(default)"), value] for name, value in sorted(changes.items())]),
+           TextFormat.Colors.orange)
+    if not write or ask and input("Write these settings into " + path + "? [y,n] >>> ").lower() != 'y':
+        return False
+    for name, value in changes.items():
+        conf.set(name, value)
+    conf.save()
+    return changes
+
+
+def ask_tune():
+    """Offer tuning for hardware and apply it by reload or restart"""
+
+    profile = input("Tune configuration for this hardware? [" + "/".join(TUNING_PROFILES) + "/n] >>> ").lower()
+    changes = tune(profile) if profile in TUNING_PROFILES else None
+    if changes and is_running():
+        try:
+            apply_changes(get_session(), changes)
+            if input("Run benchmark to check throughput against baseline? [y,n] >>> ").lower() == 'y':
+                benchmark_menu(get_session(), ask=False)
+        except SessionError as error:
+            printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        pause(3)
+
+
+def config(choice):
+    """Configure & Manage PostgreSQL"""
+
+    result = None
+
+    if choice == '1':
+        if is_running():
+            result = cmd(["systemctl", "stop", SERVICE])
+            SERVER_STATE.invalidate()
+            printf("Stopping..", TextFormat.Colors.lightblue)
+            pause(1)
+        else:
+            result = cmd(["systemctl", "start", SERVICE])
+            SERVER_STATE.invalidate()
+            printf("Starting..", TextFormat.Colors.lightblue)
+            pause(1)
+
+    elif choice == '2':
+        close_session()
+        result = cmd(["systemctl", "restart", SERVICE])
+        SERVER_STATE.invalidate()
+        if result.ok:
+            clear_pending_restart()
+        printf("Restarting..", TextFormat.Colors.lightblue)
+        pause(1)
+
+    elif choice == '3':
+        if is_autorun():
+            result = cmd(["systemctl", "disable", SERVICE])
+            SERVER_STATE.invalidate()
+            printf("Disable autorun..", TextFormat.Colors.lightblue)
+            pause(1)
+        else:
+            result = cmd(["systemctl", "enable", SERVICE])
+            SERVER_STATE.invalidate()
+            printf("Enable autorun..", TextFormat.Colors.lightblue)
+            pause(1)
+
+    elif choice == '4':
+        interactive(["passwd", "postgres"])
+        pause(3)
+
+    elif choice == '5':
+        path = os.path.join(PGDATA, "postgresql.conf")
+        if os.path.exists(path):
+            printf("Opening configuration file..", TextFormat.Colors.lightblue)
+            pause(1)
+            before = ConfigFile(path).values()
+            interactive(["nano", path])
+            after = ConfigFile(path).values()
+            changes = {name: value for name, value in after.items() if before.get(name) != value}
+            changes.update({name: "" for name in before if name not in after})
+            if changes and is_running():
+                try:
+                    apply_changes(get_session(), changes)
+                except SessionError as error:
+                    printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+                pause(3)
+        else:
+            printf("[Not Exist] Configuration file not exist, try to reinstall.", TextFormat.Colors.yellow)
+            pause(3)
+
+    elif choice == '6':
+        ask_tune()
+
+    elif choice == '7':
+        try:
+            session = get_session()
+            info = settings_info(session)
+            name = choose_name("Parameter (enter name) >>> ", info).lower()
+            if name in info:
+                unit = info[name]["unit"] if info[name]["unit"] != "[NULL]" else ""
+                printf("Current value: " + info[name]["setting"] + " " + unit + " (" + info[name]["context"] + ")",
+                       TextFormat.Colors.lightblue)
+                value = input("New value >>> ").strip()
+                if value:
+                    set_parameters(session, {name: unquote_conf(value)})
+            else:
+                printf("[Not Exist] Unknown parameter.", TextFormat.Colors.yellow)
+        except SessionError as error:
+            printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        input("Press <Enter> to continue..")
+
+    if choice in ('1', '2', '3') and not result.ok:
+        report_failure(result)
+        pause(3)
+
+    clear()
+
+
+class SessionError(Exception):
+    """Query failed or psql session died"""
+
+
+class PsqlSession:
+    """Long-lived psql process which runs queries over one connection"""
+
+    MARKER = "__postgre_py_done__"
+    FIELD_SEP = "\x1f"
+    RECORD_SEP = "\x1e"
+    ERROR_PATTERN = re.compile(r"^psql:<stdin>:\d+: (ERROR|FATAL):\s*(.*)$", re.MULTILINE)
+
+    def __init__(self, database="postgres", user="postgres"):
+        prefix, env, cwd = user_context(user)
+        argv = ["psql", "-X", "-q", "-A", "-F", self.FIELD_SEP, "-R", self.RECORD_SEP,
+                "-P", "footer=off", "-P", "null=[NULL]", "-d", database]
+        # psql buffers stdout when it is a pipe, line buffering makes every marker arrive immediately
+        if shutil.which("stdbuf"):
+            argv = ["stdbuf", "-oL"] + argv
+        self.database = database
+
+        try:
+            # own session keeps Ctrl+C in terminal from killing psql in the middle of reply
+            self.process = subprocess.Popen(prefix + argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT, start_new_session=True, env=env, cwd=cwd)
+        except OSError as error:
+            raise SessionError(str(error))
+        self.query("SELECT 1")
+
+    def send(self, text):
+        """Send commands and read everything they print until marker"""
+
+        with span("psql", "query", sql=text[:200]):
+            try:
+                self.process.stdin.write((text + "\n\\echo " + self.MARKER + "\n").encode())
+                self.process.stdin.flush()
+            except OSError:
+                raise SessionError("psql session is closed")
+            end = (self.MARKER + "\n").encode()
+            chunks, tail = [], b""
+            while True:
+                chunk = os.read(self.process.stdout.fileno(), 65536)
+                if not chunk:
+                    raise SessionError(b"".join(chunks).decode(errors="replace").strip() or "psql session is closed")
+                chunks.append(chunk)
+                tail = (tail + chunk)[-len(end):]
+                if tail == end:
+                    break
+            text = b"".join(chunks).decode(errors="replace")
+            text = text[:-len(end)]
+            error = self.ERROR_PATTERN.search(text)
+            if error:
+                raise SessionError(error.group(2))
+            return text
+
+    def query(self, sql):
+        """Run SQL statement and return column names and rows"""
+
+        text = self.send(sql.rstrip().rstrip(";") + ";").rstrip("\n").rstrip(self.RECORD_SEP)
+        if not text:
+            return [], []
+        records = [record.split(self.FIELD_SEP) for record in text.split(self.RECORD_SEP)]
+        return records[0], records[1:]
+
+    def value(self, sql):
+        """Run SQL statement which returns single value"""
+
+        rows = self.query(sql)[1]
+        return rows[0][0] if rows else None
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def connect(self, database):
+        """Switch session to another database, psql would quit on failed reconnect so check name first"""
+
+        if not self.value("SELECT 1 FROM pg_database WHERE datallowconn AND datname = " + quote_literal(database)):
+            raise SessionError("database \"" + database + "\" does not exist")
+        self.send("\\connect " + quote_literal(database))
+        self.database = database
+
+    def rollback(self):
+        """Abort current transaction, ignore errors of dead session"""
+
+        try:
+            self.send("ROLLBACK;")
+        except SessionError:
+            pass
+
+    def close(self):
+        if self.process.stdin.closed:
+            return
+        try:
+            self.process.stdin.write(b"\\q\n")
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+SESSION = None
+
+
+def get_session():
+    """Return shared psql session, reopen it if it is closed"""
+
+    global SESSION
+    if SESSION is None or not SESSION.is_alive():
+        SESSION = PsqlSession()
+    return SESSION
+
+
+def close_session():
+    global SESSION
+    if SESSION is not None:
+        SESSION.close()
+        SESSION = None
+
+
+USERS_QUERY = """
+SELECT rolname AS "Role name",
+       concat_ws(', ', CASE WHEN rolsuper THEN 'Superuser' END, CASE WHEN rolcreaterole THEN 'Create role' END,
+                 CASE WHEN rolcreatedb THEN 'Create DB' END, CASE WHEN NOT rolcanlogin THEN 'Cannot login' END,
+                 CASE WHEN rolreplication THEN 'Replication' END) AS "Attributes"
+FROM pg_roles WHERE rolname !~ '^pg_' ORDER BY 1
+"""
+
+DATABASES_QUERY = """
+SELECT datname AS "Name", pg_get_userbyid(datdba) AS "Owner", pg_encoding_to_char(encoding) AS "Encoding",
+       datcollate AS "Collate", pg_size_pretty(pg_database_size(oid)) AS "Size"
+FROM pg_database WHERE datallowconn ORDER BY 1
+"""
+
+
+CATALOG_TABLES_QUERY = """
+SELECT CASE WHEN n.nspname = 'public' THEN quote_ident(c.relname)
+            ELSE quote_ident(n.nspname) || '.' || quote_ident(c.relname) END,
+       n.nspname, c.relpages::bigint * current_setting('block_size')::int
+FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f') AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+  AND n.nspname !~ '^pg_toast'
+"""
+
+CATALOG_SIGNATURE_QUERY = "SELECT md5(string_agg(oid::text || ':' || xmin::text, ',' ORDER BY oid)) FROM pg_class"
+
+
+class CatalogCache:
+    """Names and approximate sizes of databases, roles, schemas and tables"""
+
+    def __init__(self, size_ttl=DATABASE_SIZE_TTL):
+        self.databases = []
+        self.roles = []
+        self.tables = {}
+        self.sizes = {}
+        self.size_ttl = size_ttl
+        self.sized = None
+
+    def refresh(self, session):
+        """Reload shared catalogs and tables of current database if its pg_class changed.
+
+        Tables of other databases are checked against their signature when they are looked up next time.
+        """
+
+        rows = session.query("SELECT datname FROM pg_database WHERE datallowconn")[1]
+        self.databases = [row[0] for row in rows]
+        self.roles = [row[0] for row in session.query("SELECT rolname FROM pg_roles")[1]]
+        for database in list(self.tables):
+            if database not in self.databases:
+                del self.tables[database]
+        if session.database in self.tables:
+            self.table_sizes(session, session.database)
+
+    def database_sizes(self, session):
+        """Sizes of databases, walking their directories only when shown and not more often than size TTL"""
+
+        stale = self.sized is None or time.monotonic() - self.sized > self.size_ttl
+        if stale or set(self.sizes) != set(self.databases):
+            rows = session.query("SELECT datname, pg_database_size(oid) FROM pg_database WHERE datallowconn")[1]
+            self.sizes = {name: int(size) for name, size in rows}
+            self.sized = time.monotonic()
+        return self.sizes
+
+    def table_sizes(self, session, database):
+        """Tables of database with sizes, from cache if catalog signature did not change"""
+
+        if session.database != database:
+            session.connect(database)
+        signature = session.value(CATALOG_SIGNATURE_QUERY)
+        cached = self.tables.get(database)
+        if cached is None or cached[0] != signature:
+            rows = session.query(CATALOG_TABLES_QUERY)[1]
+            cached = signature, {name: (schema, int(size)) for name, schema, size in rows}
+            self.tables[database] = cached
+        return cached[1]
+
+
+CATALOG = CatalogCache()
+
+
+def match_names(text, candidates, limit=10):
+    """Prefix matches first, then substring and fuzzy matches"""
+
+    matches = sorted(name for name in candidates if name.startswith(text))
+    if matches or not text:
+        return matches
+    matches = sorted(name for name in candidates if text.lower() in name.lower())
+    return matches or difflib.get_close_matches(text, list(candidates), n=limit, cutoff=0.6)
+
+
+def choose_name(prompt, candidates):
+    """Ask for name with <Tab> completion and suggest closest match on typo"""
+
+    def complete(text, state):
+        matches = match_names(text, candidates)
+        return matches[state] if state < len(matches) else None
+
+    if readline is not None:
+        readline.set_completer_delims(" \t\n")
+        readline.set_completer(complete)
+        readline.parse_and_bind("tab: complete")
+    try:
+        answer = input(prompt).strip()
+    finally:
+        if readline is not None:
+            readline.set_completer(None)
+    if answer in candidates or not answer:
+        return answer
+    matches = match_names(answer, candidates)
+    if len(matches) == 1 and input("Did you mean \"" + matches[0] + "\"? [y,n] >>> ").lower() == 'y':
+        return matches[0]
+    return answer
+
+
+def show_names(names, sizes, limit=50):
+    """Print names with sizes, or only count and hint when there are too many"""
+
+    if len(names) > limit:
+        printf(str(len(names)) + " objects, press <Tab> to complete name.", TextFormat.Colors.darkgrey)
+        return
+    rows = [[name, pretty_size(sizes[name])] for name in sorted(names)]
+    printf(format_table(["Name", "Size"], rows), TextFormat.Colors.orange)
+
+
+def pretty_size(size):
+    for unit in ("bytes", "kB", "MB", "GB"):
+        if size < 10240 or unit == "GB":
+            return str(size) + " " + unit
+        size //= 1024
+
+
+def show_query(sql):
+    """Print query result as table through shared session"""
+
+    printf(format_table(*get_session().query(sql)), TextFormat.Colors.orange)
+
+
+def quote_literal(text):
+    """Quote text as SQL string literal"""
+
+    return "'" + text.replace("'", "''") + "'"
+
+
+def format_table(columns, rows, max_width=40):
+    """Render rows as aligned text table"""
+
+    def cut(value):
+        value = value.replace("\n", "\\n")
+        return value if len(value) <= max_width else value[:max_width - 1] + "…"
+
+    rows = [[cut(value) for value in row] for row in rows]
+    widths = [len(column) for column in columns]
+    for row in rows:
+        for i, value in enumerate(row):
+            widths[i] = max(widths[i], len(value))
+    lines = [" | ".join(column.ljust(widths[i]) for i, column in enumerate(columns)),
+             "-+-".join("-" * width for width in widths)]
+    lines += [" | ".join(value.ljust(widths[i]) for i, value in enumerate(row)) for row in rows]
+    return "\n".join(lines)
+
+
+def browse_table(session, table_name, page_size=PAGE_SIZE):
+    """Show table page by page through scrollable server-side cursor"""
+
+    try:
+        relation = session.value("SELECT " + quote_literal(table_name) + "::regclass")
+        estimate = int(float(session.value("SELECT reltuples FROM pg_class WHERE oid = " +
+                                           quote_literal(relation) + "::regclass")))
+        session.query("BEGIN")
+        session.query("DECLARE browse SCROLL CURSOR FOR SELECT * FROM " + relation)
+    except SessionError as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        input("Press <Enter> to continue..")
+        session.rollback()
+        return
+
+    def move_forward(count):
+        """Move cursor forward, command tag tells how many rows it really passed"""
+
+        tag = re.search(r"^MOVE (\d+)$", session.send("\\set QUIET off\nMOVE FORWARD " + str(count) +
+                                                     " IN browse;\n\\set QUIET on"), re.MULTILINE)
+        return int(tag.group(1)) if tag else 0
+
+    pages = max(1, -(-estimate // page_size)) if estimate > 0 else None
+    page, message, position, total = 0, "", 0, None
+    try:
+        while True:
+            if total is None and page * page_size > position:
+                # moving forward relatively finds end of table on the way, without second pass to count rows
+                moved = move_forward(page * page_size - position)
+                if moved < page * page_size - position:
+                    total = position + moved
+            if total is not None:
+                estimate, pages = total, max(1, -(-total // page_size))
+                if page >= pages:
+                    page, message = pages - 1, "End of table."
+            # cursor is at most one page away from target now
+            session.query("MOVE ABSOLUTE " + str(page * page_size) + " IN browse")
+            columns, rows = session.query("FETCH FORWARD " + str(page_size) + " FROM browse")
+            position = page * page_size + len(rows)
+            if len(rows) < page_size:
+                total = position
+
+            clear()
+            first = page * page_size + 1
+            printf(relation, TextFormat.Colors.lightblue, TextFormat.bold, end=" ")
+            printf("page " + str(page + 1) + (" of ~" + str(pages) if pages else "") + ", rows " + str(first) +
+                   "-" + str(first + len(rows) - 1) + " of ~" + (str(estimate) if estimate > 0 else "unknown"),
+                   TextFormat.Colors.darkgrey)
+            printf(format_table(columns, rows), TextFormat.Colors.orange)
+            if message:
+                printf(message, TextFormat.Colors.yellow)
+                message = ""
+
+            answer = input("[n]ext, [p]revious, [j]ump <page>, [q]uit >>> ").strip().lower()
+            if answer in ("", "n"):
+                page += 1
+            elif answer == "p":
+                page = max(0, page - 1)
+            elif answer.startswith("j") and answer[1:].strip().isdigit():
+                page = max(0, int(answer[1:].strip()) - 1)
+            elif answer == "q":
+                break
+    except SessionError as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        input("Press <Enter> to continue..")
+    finally:
+        session.rollback()
+
+
+class TransferProgress:
+    """Bytes moved by all workers, shown as live throughput on progress bar"""
+
+    def __init__(self, total):
+        self.total = max(total, 1)
+        self.done = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+
+    def add(self, size):
+        with self.lock:
+            self.done += size
+
+    def show(self, end):
+        rate = self.done / max(time.monotonic() - self.started, 0.001) / 1024 / 1024
+        print_progress_bar(min(self.done, self.total), self.total,
+                           suffix="%s, %.1f MB/s " % (pretty_size(self.done), rate), print_end=end)
+
+    def loop(self):
+        while not self.stopped.wait(0.5):
+            self.show("\r")
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.show("\n")
+
+
+TRANSFER_FILE = re.compile(r"^(?P<table>.+?)(--\d+)?\.(?P<format>csv|bin)(?P<gz>\.gz)?$")
+
+
+def copy_options(fmt, header):
+    options = "binary" if fmt == "bin" else "csv" + (", HEADER" if header else "")
+    return " WITH (FORMAT " + options + ")"
+
+
+def postgres_process(argv, **kwargs):
+    """Start process as "postgres" user with pipes given in kwargs"""
+
+    prefix, env, cwd = user_context("postgres")
+    return subprocess.Popen(prefix + argv, env=env, cwd=cwd, **kwargs)
+
+
+def export_job(database, relation, where, path, fmt, header, progress, snapshot=None):
+    """Stream COPY TO STDOUT of one table or table chunk into file, gzip if path ends with .gz.
+
+    Workers given exported snapshot see the same data, so chunks and tables are consistent with each other.
+    """
+
+    query = "COPY (SELECT * FROM " + relation + " WHERE " + where + ") TO STDOUT" if where else \
+        "COPY " + relation + " TO STDOUT"
+    script = query + copy_options(fmt, header) + ";\n"
+    if snapshot is not None:
+        script = "BEGIN ISOLATION LEVEL REPEATABLE READ;\nSET TRANSACTION SNAPSHOT " + quote_literal(snapshot) + \
+            ";\n" + script + "COMMIT;\n"
+    process = postgres_process(["psql", "-X", "-q", "-v", "ON_ERROR_STOP=1", "-d", database],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process.stdin.write(script.encode())
+    process.stdin.close()
+    with (gzip.open(path, "wb", compresslevel=1) if path.endswith(".gz") else open(path, "wb")) as out:
+        while True:
+            chunk = process.stdout.read(COPY_BUFFER)
+            if not chunk:
+                break
+            out.write(chunk)
+            progress.add(len(chunk))
+    error = process.stderr.read().decode(errors="replace").strip()
+    return process.wait() == 0 and not error, error
+
+
+def import_job(database, relation, path, fmt, header, progress):
+    """Stream file into COPY FROM STDIN of one table, progress counts bytes read from disk"""
+
+    process = postgres_process(["psql", "-X", "-q", "-v", "ON_ERROR_STOP=1", "-d", database,
+                                "-c", "COPY " + relation + " FROM STDIN" + copy_options(fmt, header)],
+                               stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    with open(path, "rb") as raw:
+        source = gzip.GzipFile(fileobj=raw) if path.endswith(".gz") else raw
+        position = 0
+        try:
+            while True:
+                chunk = source.read(COPY_BUFFER)
+                if not chunk:
+                    break
+                process.stdin.write(chunk)
+                progress.add(raw.tell() - position)
+                position = raw.tell()
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+    error = process.stderr.read().decode(errors="replace").strip()
+    return process.wait() == 0 and not error, error
+
+
+def resolve_relation(session, name):
+    """Return quoted relation name, its size and page count"""
+
+    relation = session.value("SELECT " + quote_literal(name) + "::regclass")
+    rows = session.query("SELECT pg_relation_size(oid), relpages FROM pg_class WHERE oid = " +
+                         quote_literal(relation) + "::regclass")[1]
+    return relation, int(rows[0][0]), int(rows[0][1])
+
+
+def plan_export(session, database, tables, directory, fmt, compress, chunks):
+    """Split every table into ctid ranges by heap pages, one file per range"""
+
+    jobs, total = [], 0
+    extension = "." + fmt + (".gz" if compress else "")
+    if chunks > 1 and int(session.value("SHOW server_version_num")) < 140000:
+        # TID range scan appeared in 14, older server would scan whole table for every range
+        printf("[Warning] Server older than 14 cannot scan ctid ranges, every table is exported in one chunk.",
+               TextFormat.Colors.yellow)
+        chunks = 1
+    for name in tables:
+        relation, size, pages = resolve_relation(session, name)
+        total += size
+        count = max(1, min(chunks, pages))
+        bounds = [pages * i // count for i in range(count + 1)]
+        for i in range(count):
+            conditions = []
+            if i > 0:
+                conditions.append("ctid >= '(" + str(bounds[i]) + ",0)'::tid")
+            if i < count - 1:
+                conditions.append("ctid < '(" + str(bounds[i + 1]) + ",0)'::tid")
+            suffix = "--%03d" % i if count > 1 else ""
+            path = os.path.join(directory, relation.replace("/", "_") + suffix + extension)
+            jobs.append((relation, " AND ".join(conditions), path))
+    return jobs, total
+
+
+def plan_import(session, directory):
+    """Find exported files in directory and resolve their tables"""
+
+    jobs, total = [], 0
+    for name in sorted(os.listdir(directory)):
+        match = TRANSFER_FILE.match(name)
+        if match:
+            path = os.path.join(directory, name)
+            jobs.append((resolve_relation(session, match.group("table"))[0], path, match.group("format")))
+            total += os.path.getsize(path)
+    return jobs, total
+
+
+def run_transfer(tasks, total, jobs):
+    """Run transfer tasks in worker pool with live throughput, return names of failed tasks"""
+
+    progress = TransferProgress(total)
+    failed = []
+    progress.start()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(task, progress): name for name, task in tasks}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    ok, error = future.result()
+                except OSError as exception:
+                    ok, error = False, str(exception)
+                if not ok:
+                    failed.append((futures[future], error))
+    finally:
+        progress.stop()
+    for name, error in failed:
+        printf("[Failed] " + name + ": " + error, TextFormat.Colors.red, TextFormat.bold)
+    return failed
+
+
+def export_tables(session, database, tables, directory, jobs, fmt="csv", compress=False, chunks=1, header=False):
+    """Parallel export of tables, or ranges of large table, through COPY TO STDOUT"""
+
+    session.connect(database)
+    if not tables:
+        tables = sorted(CATALOG.table_sizes(session, database))
+    os.makedirs(directory, exist_ok=True)
+    snapshot = None
+    try:
+        if server_version_num() >= 90200:
+            # transaction stays open till workers finish, otherwise its snapshot can not be imported
+            session.query("BEGIN ISOLATION LEVEL REPEATABLE READ")
+            snapshot = session.value("SELECT pg_export_snapshot()")
+        plan, total = plan_export(session, database, tables, directory, fmt, compress, chunks)
+        tasks = [(path, lambda progress, relation=relation, where=where, path=path:
+                  export_job(database, relation, where, path, fmt, header, progress, snapshot))
+                 for relation, where, path in plan]
+        return run_transfer(tasks, total, jobs)
+    finally:
+        session.rollback()
+
+
+def import_tables(session, database, directory, jobs, header=False):
+    """Parallel import of every exported file in directory through COPY FROM STDIN"""
+
+    session.connect(database)
+    plan, total = plan_import(session, directory)
+    tasks = [(path, lambda progress, relation=relation, path=path, fmt=fmt:
+              import_job(database, relation, path, fmt, header, progress)) for relation, path, fmt in plan]
+    return run_transfer(tasks, total, jobs)
+
+
+DASHBOARD_QUERY = """
+SELECT sum(xact_commit + xact_rollback), sum(blks_hit), sum(blks_read), sum(tup_returned + tup_fetched),
+       sum(tup_inserted + tup_updated + tup_deleted),
+       (SELECT count(*) FROM pg_stat_activity WHERE state = 'active'),
+       (SELECT count(*) FROM pg_stat_activity WHERE state = 'idle'),
+       (SELECT count(*) FROM pg_stat_activity WHERE state LIKE 'idle in transaction%%'),
+       (%s)
+FROM pg_stat_database
+"""
+DASHBOARD_FIELDS = ("xacts", "blks_hit", "blks_read", "tup_read", "tup_written", "active", "idle", "idle_in_xact",
+                    "checkpoints")
+
+
+def postmaster_tree(data_dir=None):
+    """Postmaster and its children pids with resident memory in kB"""
+
+    data_dir = data_dir or PGDATA
+    try:
+        with open(os.path.join(data_dir, "postmaster.pid")) as file:
+            postmaster = file.readline().strip()
+    except OSError:
+        return {}
+    tree = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/" + pid + "/stat") as file:
+                parent = file.read().rsplit(")", 1)[1].split()[1]
+            if pid != postmaster and parent != postmaster:
+                continue
+            with open("/proc/" + pid + "/status") as file:
+                rss = next((int(line.split()[1]) for line in file if line.startswith("VmRSS:")), 0)
+        except (OSError, IndexError):
+            continue
+        tree[pid] = rss
+    return tree
+
+
+def dashboard_sample(session, query):
+    """One snapshot of cumulative counters"""
+
+    row = session.query(query)[1][0]
+    sample = {name: int(float(value)) if value != "[NULL]" else 0 for name, value in zip(DASHBOARD_FIELDS, row)}
+    sample["time"] = time.monotonic()
+    sample["tree"] = postmaster_tree()
+    return sample
+
+
+def dashboard_lines(previous, current):
+    """Render rates between two samples"""
+
+    elapsed = max(current["time"] - previous["time"], 0.001)
+
+    def rate(name):
+        return (current[name] - previous[name]) / elapsed
+
+    hit, read = current["blks_hit"] - previous["blks_hit"], current["blks_read"] - previous["blks_read"]
+    tree = current["tree"]
+    backends = len(tree) - 1 if tree else 0
+    rss = sorted(tree.values())
+    return [
+        TextFormat.bold + "PostgreSQL live dashboard" + TextFormat.reset + "  (every %.0f s, Ctrl+C to exit)" % elapsed,
+        "========================================",
+        "TPS:                  %10.1f" % rate("xacts"),
+        "Cache hit ratio:      %9.2f%%" % (100.0 * hit / (hit + read) if hit + read else 100.0),
+        "Tuples read/s:        %10.0f" % rate("tup_read"),
+        "Tuples written/s:     %10.0f" % rate("tup_written"),
+        "----------------------------------------",
+        "Active sessions:      %10d" % current["active"],
+        "Idle sessions:        %10d" % current["idle"],
+        "Idle in transaction:  %10d" % current["idle_in_xact"],
+        "Checkpoints/min:      %10.2f" % (rate("checkpoints") * 60),
+        "----------------------------------------",
+        "Server processes:     %10d" % backends,
+        "Total RSS:            %10s" % memory_value(sum(rss)),
+        "Largest process RSS:  %10s" % memory_value(rss[-1] if rss else 0),
+        "========================================",
+    ]
+
+
+def dashboard(session, interval=2.0):
+    """Sample statistics views and /proc at fixed interval and redraw screen in place until Ctrl+C"""
+
+    checkpoints = "SELECT num_timed + num_requested FROM pg_stat_checkpointer" \
+        if server_version_num() >= 170000 else "SELECT checkpoints_timed + checkpoints_req FROM pg_stat_bgwriter"
+    query = DASHBOARD_QUERY % checkpoints
+    clear()
+    previous = dashboard_sample(session, query)
+    try:
+        while True:
+            pause(interval)
+            current = dashboard_sample(session, query)
+            lines = dashboard_lines(previous, current)
+            print(chr(27) + "[H" + "".join(line + chr(27) + "[K\n" for line in lines) + chr(27) + "[J", end="",
+                  flush=True)
+            previous = current
+    except KeyboardInterrupt:
+        # interrupted reply leaves session out of sync, next get_session() opens a new one
+        session.close()
+        print()
+
+
+EXPORTER_DATABASE_QUERY = """
+SELECT s.datname, s.numbackends, s.xact_commit, s.xact_rollback, s.blks_read, s.blks_hit, s.tup_returned,
+       s.tup_fetched, s.tup_inserted, s.tup_updated, s.tup_deleted, %s, pg_database_size(d.oid)
+FROM pg_stat_database s JOIN pg_database d ON d.oid = s.datid
+WHERE d.datallowconn ORDER BY 1
+"""
+EXPORTER_DATABASE_METRICS = (
+    ("pg_stat_database_numbackends", "gauge", "Sessions connected to database"),
+    ("pg_stat_database_xact_commit_total", "counter", "Committed transactions"),
+    ("pg_stat_database_xact_rollback_total", "counter", "Rolled back transactions"),
+    ("pg_stat_database_blks_read_total", "counter", "Blocks read from disk"),
+    ("pg_stat_database_blks_hit_total", "counter", "Blocks found in shared buffers"),
+    ("pg_stat_database_tup_returned_total", "counter", "Rows returned by sequential scans"),
+    ("pg_stat_database_tup_fetched_total", "counter", "Rows fetched by index scans"),
+    ("pg_stat_database_tup_inserted_total", "counter", "Rows inserted"),
+    ("pg_stat_database_tup_updated_total", "counter", "Rows updated"),
+    ("pg_stat_database_tup_deleted_total", "counter", "Rows deleted"),
+    ("pg_stat_database_deadlocks_total", "counter", "Deadlocks detected"),
+    ("pg_stat_database_temp_bytes_total", "counter", "Bytes written into temporary files"),
+    ("pg_database_size_bytes", "gauge", "Disk space used by database"),
+)
+
+
+def prometheus_labels(labels):
+    if not labels:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    return "{" + ",".join(key + '="' + escape(value) + '"' for key, value in sorted(labels.items())) + "}"
+
+
+class MetricsCollector(threading.Thread):
+    """Collect server state and statistics views on own schedule into prerendered snapshot"""
+
+    def __init__(self, interval=15.0):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.session = None
+        self.stopped = threading.Event()
+        self.snapshot = (b"", b"{}")
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.collect()
+
+    def stop(self):
+        self.stopped.set()
+        if self.session is not None:
+            self.session.close()
+
+    def query(self, sql):
+        if self.session is None or not self.session.is_alive():
+            self.session = PsqlSession()
+        return self.session.query(sql)[1]
+
+    def server_samples(self):
+        """Statistics of running server, version dependent columns and views chosen by its version"""
+
+        version = server_version_num()
+        samples = [("pg_server_version_num", "gauge", "Server version number", {}, version)]
+        row = self.query("SELECT pg_is_in_recovery()::int, extract(epoch FROM pg_postmaster_start_time())")[0]
+        standby = row[0] == "1"
+        samples += [("pg_in_recovery", "gauge", "1 if server is standby", {}, int(row[0])),
+                    ("pg_postmaster_start_time_seconds", "gauge", "Server start time", {}, float(row[1]))]
+        columns = "s.deadlocks, s.temp_bytes" if version >= 90200 else "0, 0"
+        for row in self.query(EXPORTER_DATABASE_QUERY % columns):
+            for (name, kind, description), value in zip(EXPORTER_DATABASE_METRICS, row[1:]):
+                samples.append((name, kind, description, {"datname": row[0]}, float(value)))
+        for state, count in self.query("SELECT coalesce(state, 'unknown'), count(*) FROM pg_stat_activity GROUP BY 1"):
+            samples.append(("pg_stat_activity_count", "gauge", "Sessions by state", {"state": state}, int(count)))
+        checkpoints = "SELECT num_timed, num_requested FROM pg_stat_checkpointer" if version >= 170000 else \
+            "SELECT checkpoints_timed, checkpoints_req FROM pg_stat_bgwriter"
+        timed, requested = self.query(checkpoints)[0]
+        samples += [("pg_checkpoints_total", "counter", "Checkpoints", {"kind": "timed"}, int(timed)),
+                    ("pg_checkpoints_total", "counter", "Checkpoints", {"kind": "requested"}, int(requested))]
+        if not standby:
+            query = REPLICATION_QUERY.format(diff="pg_wal_lsn_diff", current="pg_current_wal_lsn", location="lsn",
+                                             lag="0") if version >= 100000 else \
+                REPLICATION_QUERY.format(diff="pg_xlog_location_diff", current="pg_current_xlog_location",
+                                         location="location", lag="0")
+            for replica in self.query(query):
+                if replica[4] != "[NULL]":
+                    samples.append(("pg_replication_lag_bytes", "gauge", "WAL not replayed by standby yet",
+                                    {"application_name": replica[0], "client_addr": replica[1]}, float(replica[4])))
+        tree = postmaster_tree()
+        samples += [("pg_processes", "gauge", "Postmaster and its children", {}, len(tree)),
+                    ("pg_processes_resident_bytes", "gauge", "Resident memory of server processes", {},
+                     sum(tree.values()) * 1024)]
+        return samples
+
+    def collect(self):
+        """Build new snapshot, scrapes keep reading previous one until it is swapped"""
+
+        started = time.monotonic()
+        samples, up, failed = [], 0, 0
+        try:
+            state = SERVER_STATE.refresh()
+            samples += [("postgre_installed", "gauge", "Server package is installed", {}, int(state.installed)),
+                        ("postgre_running", "gauge", "Postmaster is running", {}, int(state.running)),
+                        ("postgre_autorun", "gauge", "Service starts on boot", {}, int(state.autorun))]
+            if state.running:
+                samples += self.server_samples()
+                up = 1
+        except Exception as error:  # any error left uncaught would kill thread and freeze last snapshot
+            failed = 1
+            printf("[Failed] Collecting metrics: " + repr(error), TextFormat.Colors.red)
+            if self.session is not None:
+                self.session.close()
+            self.session = None
+        samples += [("pg_up", "gauge", "Statistics were collected", {}, up),
+                    ("postgre_collect_error", "gauge", "1 if last collection failed", {}, failed),
+                    ("postgre_collect_duration_seconds", "gauge", "Time spent collecting", {},
+                     round(time.monotonic() - started, 6)),
+                    ("postgre_collect_timestamp_seconds", "gauge", "When snapshot was collected", {}, time.time())]
+        cluster = {"cluster": CLUSTER or "default"}
+        families, metrics = [], {}
+        for name, kind, description, labels, value in samples:
+            if name not in metrics:
+                families.append((name, kind, description))
+            metrics.setdefault(name, []).append({"labels": labels, "value": value})
+        lines = []
+        for name, kind, description in families:
+            # every family is one block after its HELP and TYPE, samples of databases are interleaved otherwise
+            lines += ["# HELP " + name + " " + description, "# TYPE " + name + " " + kind]
+            lines += [name + prometheus_labels(dict(sample["labels"], **cluster)) + " " + repr(sample["value"])
+                      for sample in metrics[name]]
+        document = {"cluster": cluster["cluster"], "collected": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "metrics": metrics}
+        self.snapshot = ("\n".join(lines).encode() + b"\n", json.dumps(document).encode())
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serve cached snapshot, scrape never touches server"""
+
+    def do_GET(self):
+        text, document = self.server.collector.snapshot
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body, kind = text, "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/json":
+            body, kind = document, "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if VERBOSE_MODE:
+            super().log_message(format, *args)
+
+
+class MetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def serve(listen="127.0.0.1:9187", interval=15.0):
+    """Expose metrics in Prometheus text format on /metrics and as JSON on /json until Ctrl+C"""
+
+    host, _, port = listen.rpartition(":")
+    collector = MetricsCollector(interval)
+    collector.collect()
+    try:
+        server = MetricsServer((host or "0.0.0.0", int(port)), MetricsHandler)
+    except OSError as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        collector.stop()
+        return 1
+    server.collector = collector
+    collector.start()
+    printf("Serving metrics on http://" + listen + "/metrics and /json, collected every %g s (Ctrl+C to exit)"
+           % interval, TextFormat.Colors.lightblue)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        server.server_close()
+        collector.stop()
+    return 0
+
+
+STATEMENT_ORDER = {"total": "total_time", "mean": "mean_time", "calls": "calls", "io": "io_blocks"}
+
+
+def statements_query(version, where=""):
+    """pg_stat_statements columns with names which changed between versions unified"""
+
+    total = "total_exec_time" if version >= 130000 else "total_time"
+    # same statement run by other role or in other database has its own entry with same queryid
+    key = "userid::text || '/' || dbid::text || '/' || " + ("queryid::text" if version >= 90400 else "md5(query)")
+    return ("SELECT " + key + " AS key, calls, " + total +
+            " AS total_time, " + total + " / greatest(calls, 1) AS mean_time, rows, shared_blks_read + "
+            "shared_blks_written + local_blks_read + local_blks_written + temp_blks_read + temp_blks_written "
+            "AS io_blocks, regexp_replace(query, '\\s+', ' ', 'g') AS query FROM pg_stat_statements" + where)
+
+
+def enable_statements(session, ask=True, restart=None):
+    """Load pg_stat_statements through config engine and create extension, return True when it is usable"""
+
+    if not session.value("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_stat_statements'"):
+        printf("pg_stat_statements is shipped in postgresql-contrib package.", TextFormat.Colors.lightblue)
+        if ask and input("Install postgresql-contrib? [y,n] >>> ").lower() != 'y':
+            return False
+        result = cmd(["yum", "-y", "install", "postgresql-contrib"])
+        if not result.ok:
+            report_failure(result)
+            return False
+    libraries = session.value("SHOW shared_preload_libraries")
+    loaded = [name.strip() for name in libraries.split(",") if name.strip()]
+    if "pg_stat_statements" not in loaded:
+        printf("pg_stat_statements must be preloaded, this needs server restart.", TextFormat.Colors.lightblue)
+        if not set_parameters(session, {"shared_preload_libraries": ", ".join(loaded + ["pg_stat_statements"])},
+                              ask, restart):
+            return False
+        session = get_session()
+        if "pg_stat_statements" not in session.value("SHOW shared_preload_libraries"):
+            return False
+    session.query("CREATE EXTENSION IF NOT EXISTS pg_stat_statements")
+    return True
+
+
+def statements(session):
+    """Cumulative counters of every statement by key"""
+
+    columns, rows = session.query(statements_query(server_version_num()))
+    return {row[0]: dict(zip(columns, row)) for row in rows}
+
+
+def top_statements(session, order="total", limit=10):
+    """Print top statements by total time, mean time, calls or I/O blocks"""
+
+    columns, rows = session.query(statements_query(server_version_num()) + " ORDER BY " + STATEMENT_ORDER[order] +
+                                  " DESC LIMIT " + str(int(limit)))
+    printf(format_table(["Calls", "Total ms", "Mean ms", "Rows", "I/O blocks", "Query"],
+                        [[row[1], "%.1f" % float(row[2]), "%.2f" % float(row[3]), row[4], row[5], row[6]]
+                         for row in rows], max_width=60), TextFormat.Colors.orange)
+
+
+def save_snapshot(session):
+    """Save cumulative statement counters into file, return its path"""
+
+    directory = os.path.join(STATE_DIR, "snapshots")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(path, "w") as file:
+        json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "statements": statements(session)}, file)
+    return path
+
+
+def list_snapshots():
+    directory = os.path.join(STATE_DIR, "snapshots")
+    return sorted(name[:-5] for name in os.listdir(directory) if name.endswith(".json")) \
+        if os.path.isdir(directory) else []
+
+
+def load_snapshot(name):
+    with open(os.path.join(STATE_DIR, "snapshots", name + ".json")) as file:
+        return json.load(file)["statements"]
+
+
+def compare_snapshots(before, after, threshold=0.2, limit=20):
+    """Mean time of every statement during period between snapshots against its mean before the period"""
+
+    rows = []
+    for key, new in after.items():
+        old = before.get(key, {"calls": "0", "total_time": "0"})
+        calls = int(new["calls"]) - int(old["calls"])
+        if calls <= 0:
+            continue
+        period_mean = (float(new["total_time"]) - float(old["total_time"])) / calls
+        base_mean = float(old["total_time"]) / int(old["calls"]) if int(old["calls"]) else None
+        regressed = base_mean is not None and period_mean > base_mean * (1 + threshold)
+        change = "new" if base_mean is None else "%+.0f%%" % ((period_mean / base_mean - 1) * 100 if base_mean else 0)
+        rows.append((regressed, period_mean * calls, [str(calls), "%.2f" % period_mean,
+                                                      "-" if base_mean is None else "%.2f" % base_mean,
+                                                      change + (" REGRESSED" if regressed else ""), new["query"]]))
+    rows.sort(key=lambda row: (not row[0], -row[1]))
+    printf(format_table(["Calls", "Mean ms", "Before ms", "Change", "Query"], [row[2] for row in rows[:limit]],
+                        max_width=60), TextFormat.Colors.orange)
+    return sum(1 for row in rows if row[0])
+
+
+SLOW_LOG_LINE = re.compile(r"duration: (?P<ms>\d+(?:\.\d+)?) ms\s+(?:statement|execute [^:]*|parse [^:]*|"
+                           r"bind [^:]*): (?P<query>.*)$")
+SLOW_LOG_LIMIT = 10000
+
+
+def normalize_query(query):
+    """Replace literals so statements differing only in values aggregate together"""
+
+    query = re.sub(r"'(?:[^']|'')*'", "?", query)
+    query = re.sub(r"\b\d+(?:\.\d+)?\b", "?", query)
+    return re.sub(r"\s+", " ", query).strip()
+
+
+def parse_slow_log(paths, limit=SLOW_LOG_LIMIT):
+    """Stream server logs line by line and aggregate duration entries, memory bounded by distinct statements"""
+
+    stats = {}
+    for path in paths:
+        with (gzip.open(path, "rt", errors="replace") if path.endswith(".gz") else
+              open(path, errors="replace")) as file:
+            for line in file:
+                match = SLOW_LOG_LINE.search(line)
+                if not match:
+                    continue
+                query, duration = normalize_query(match.group("query")), float(match.group("ms"))
+                entry = stats.get(query)
+                if entry is None:
+                    if len(stats) >= limit:
+                        # drop cheapest half so memory stays bounded on huge logs
+                        for key in sorted(stats, key=lambda name: stats[name][1])[:limit // 2]:
+                            del stats[key]
+                    entry = stats[query] = [0, 0.0, 0.0]
+                entry[0] += 1
+                entry[1] += duration
+                entry[2] = max(entry[2], duration)
+    return stats
+
+
+def server_logs(session):
+    """Log files of running server, newest last"""
+
+    directory = session.value("SHOW log_directory")
+    directory = directory if os.path.isabs(directory) else os.path.join(PGDATA, directory)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    paths = [os.path.join(directory, name) for name in names if name.endswith((".log", ".log.gz", ".csv"))]
+    return sorted(paths, key=os.path.getmtime)
+
+
+def show_slow_log(session, paths=None, limit=20):
+    """Top statements from log_min_duration_statement entries"""
+
+    if session.value("SHOW log_min_duration_statement") == "-1":
+        printf("log_min_duration_statement is disabled, slow statements are not logged.", TextFormat.Colors.yellow)
+        threshold = input("Log statements slower than (ms, empty to skip) >>> ").strip()
+        if threshold.isdigit():
+            set_parameters(session, {"log_min_duration_statement": threshold}, ask=False)
+    stats = parse_slow_log(paths or server_logs(session))
+    top = sorted(stats.items(), key=lambda item: -item[1][1])[:limit]
+    printf(format_table(["Count", "Total ms", "Mean ms", "Max ms", "Query"],
+                        [[str(count), "%.1f" % total, "%.2f" % (total / count), "%.1f" % longest, query]
+                         for query, (count, total, longest) in top], max_width=60), TextFormat.Colors.orange)
+
+
+def analyzer_menu(session):
+    """Statement statistics and slow-query log analyzer"""
+
+    printf("  1. Top statements\n"
+           "  2. Save snapshot\n"
+           "  3. Compare snapshots\n"
+           "  4. Slow statements from server log\n"
+           "  0. Back")
+    choice = input("Your choice >>> ")
+    if choice == '4':
+        show_slow_log(session)
+    elif choice in ('1', '2', '3') and enable_statements(session):
+        session = get_session()
+        if choice == '1':
+            order = input("Order by [total,mean,calls,io] (default total) >>> ").strip() or "total"
+            top_statements(session, order if order in STATEMENT_ORDER else "total")
+        elif choice == '2':
+            printf("Saved into " + save_snapshot(session), TextFormat.Colors.green, TextFormat.bold)
+        else:
+            snapshots = list_snapshots()
+            printf("\n".join(snapshots) or "There are no snapshots.", TextFormat.Colors.orange)
+            before = choose_name("Snapshot before >>> ", snapshots)
+            after = choose_name("Snapshot after (empty for current counters) >>> ", snapshots)
+            if before in snapshots:
+                after = load_snapshot(after) if after in snapshots else statements(session)
+                compare_snapshots(load_snapshot(before), after)
+    if choice != '0':
+        input("Press <Enter> to continue..")
+
+
+SEQ_SCAN_QUERY = """
+SELECT relid, quote_ident(schemaname) || '.' || quote_ident(relname), pg_table_size(relid), seq_scan,
+       coalesce(idx_scan, 0), seq_tup_read / NULLIF(seq_scan, 0)
+FROM pg_stat_user_tables
+WHERE seq_scan > coalesce(idx_scan, 0) AND pg_table_size(relid) >= %d AND seq_tup_read / NULLIF(seq_scan, 0) >= %d
+ORDER BY seq_tup_read DESC LIMIT 20
+"""
+INDEX_CANDIDATE_QUERY = """
+SELECT quote_ident(s.attname)
+FROM pg_stats s JOIN pg_class c ON c.relname = s.tablename JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.oid = %s AND n.nspname = s.schemaname AND c.reltuples > 0 AND s.null_frac < 0.5
+  AND CASE WHEN s.n_distinct < 0 THEN -s.n_distinct ELSE s.n_distinct / c.reltuples END >= %s AND NOT EXISTS (
+      SELECT 1 FROM pg_index i JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+      WHERE i.indrelid = c.oid AND a.attname = s.attname)
+ORDER BY CASE WHEN s.n_distinct < 0 THEN -s.n_distinct * c.reltuples ELSE s.n_distinct END DESC LIMIT 1
+"""
+UNUSED_INDEXES_QUERY = """
+SELECT quote_ident(s.schemaname) || '.' || quote_ident(s.indexrelname),
+       quote_ident(s.schemaname) || '.' || quote_ident(s.relname), pg_relation_size(s.indexrelid)
+FROM pg_stat_user_indexes s JOIN pg_index i ON i.indexrelid = s.indexrelid
+WHERE s.idx_scan = 0 AND NOT i.indisunique AND NOT i.indisprimary
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = s.indexrelid)
+ORDER BY 3 DESC
+"""
+INDEX_DEFINITIONS_QUERY = """
+SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname), i.indrelid, i.indkey::text, i.indclass::text, %s,
+       coalesce(pg_get_expr(i.indexprs, i.indrelid), ''), coalesce(pg_get_expr(i.indpred, i.indrelid), ''),
+       a.amname, i.indisunique OR i.indisprimary, pg_relation_size(c.oid)
+FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid JOIN pg_namespace n ON n.oid = c.relnamespace
+     JOIN pg_am a ON a.oid = c.relam
+WHERE i.indisvalid AND n.nspname NOT IN ('pg_catalog', 'information_schema') AND n.nspname !~ '^pg_toast'
+"""
+MIN_SCAN_TABLE = 10 * 1024 * 1024
+MIN_TUPLES_PER_SCAN = 1000
+MIN_CANDIDATE_DISTINCT = 0.01
+
+
+def redundant_indexes(definitions):
+    """Find indexes equal to another index on same table or btree prefix of it, return (index, covering, same)"""
+
+    groups = {}
+    for name, table, keys, classes, key_count, expressions, predicate, method, unique, size in definitions:
+        groups.setdefault((table, expressions, predicate, method), []).append(
+            {"name": name, "columns": list(zip(keys.split(), classes.split())), "key_count": int(key_count),
+             "btree": method == "btree", "unique": unique == "t", "size": int(size)})
+    found = []
+    for indexes in groups.values():
+        for index in indexes:
+            if index["unique"] or len(index["columns"]) > index["key_count"]:
+                continue
+            for other in indexes:
+                keys = other["columns"][:other["key_count"]]
+                if other is index or keys[:len(index["columns"])] != index["columns"]:
+                    continue
+                same = keys == index["columns"]
+                if same and not other["unique"] and index["name"] < other["name"]:
+                    continue  # report only one of two equal indexes
+                if same or index["btree"]:
+                    found.append((index, other, same))
+                    break
+    return found
+
+
+def index_report(session):
+    """Access patterns and index findings of current database, each with estimated size and DDL"""
+
+    findings = []
+    for relid, table, size, seq_scan, idx_scan, per_scan in session.query(
+            SEQ_SCAN_QUERY % (MIN_SCAN_TABLE, MIN_TUPLES_PER_SCAN))[1]:
+        column = session.value(INDEX_CANDIDATE_QUERY % (relid, MIN_CANDIDATE_DISTINCT))
+        # column is picked by statistics only, not by queries which really filter on it, so it stays commented out
+        ddl = "-- candidate, check with EXPLAIN first: CREATE INDEX CONCURRENTLY ON " + table + " (" + column + ");" \
+            if column else "-- check WHERE clauses of queries on " + table + " with EXPLAIN"
+        findings.append(["Sequential scans", table, pretty_size(int(size)),
+                         seq_scan + " seq vs " + idx_scan + " index scans, " + per_scan + " rows per scan", ddl])
+    for index, table, size in session.query(UNUSED_INDEXES_QUERY)[1]:
+        findings.append(["Unused index", index, pretty_size(int(size)), "0 scans on " + table,
+                         "DROP INDEX CONCURRENTLY " + index + ";"])
+    key_count = "i.indnkeyatts" if server_version_num() >= 110000 else "i.indnatts"
+    definitions = session.query(INDEX_DEFINITIONS_QUERY % key_count)[1]
+    for index, other, same in redundant_indexes(definitions):
+        findings.append(["Duplicate index" if same else "Redundant index", index["name"], pretty_size(index["size"]),
+                         ("same as " if same else "prefix of ") + other["name"],
+                         "DROP INDEX CONCURRENTLY " + index["name"] + ";"])
+    return findings
+
+
+def show_findings(session, findings):
+    if not findings:
+        printf("No index findings.", TextFormat.Colors.green, TextFormat.bold)
+        return
+    reset = session.value("SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()")
+    since = reset if reset not in (None, "[NULL]") else "server initialization"
+    printf("Scans are counted since " + since + " on this server only.", TextFormat.Colors.lightblue)
+    printf(format_table(["Finding", "Object", "Size", "Detail", "Suggestion"], findings, max_width=70),
+           TextFormat.Colors.orange)
+
+
+def operations_query(choice):
+    """Listings and table browser over shared psql session"""
+
+    if choice == '2':
+        show_query(USERS_QUERY)
+        input("Press <Enter> to continue..")
+
+    elif choice == '3':
+        show_query(DATABASES_QUERY)
+        input("Press <Enter> to continue..")
+
+    elif choice == '4':
+        session = get_session()
+        CATALOG.refresh(session)
+        show_names(CATALOG.databases, CATALOG.database_sizes(session))
+        db_name = choose_name("Choose database (enter name) >>> ", CATALOG.databases)
+        tables = CATALOG.table_sizes(session, db_name)
+        show_names(tables, {name: size for name, (_, size) in tables.items()})
+        table_name = choose_name("Choose table (enter name) >>> ", tables)
+        browse_table(session, table_name)
+
+    elif choice in ('5', '6'):
+        session = get_session()
+        CATALOG.refresh(session)
+        db_name = choose_name("Choose database (enter name) >>> ", CATALOG.databases)
+        directory = input("Directory (default ./" + db_name + ") >>> ").strip() or db_name
+        jobs = input("Parallel workers (default " + str(os.cpu_count()) + ") >>> ").strip()
+        jobs = int(jobs) if jobs.isdigit() and int(jobs) > 0 else os.cpu_count()
+        if choice == '5':
+            tables = CATALOG.table_sizes(session, db_name)
+            names = choose_name("Tables, comma separated (empty for all) >>> ", tables)
+            compress = input("Compress with gzip? [y,n] >>> ").lower() == 'y'
+            failed = export_tables(session, db_name, [name.strip() for name in names.split(",") if name.strip()],
+                                   directory, jobs, compress=compress, header=True)
+        else:
+            failed = import_tables(session, db_name, directory, jobs, header=True)
+        printf("Some files failed." if failed else "All done!",
+               TextFormat.Colors.red if failed else TextFormat.Colors.green, TextFormat.bold)
+        input("Press <Enter> to continue..")
+
+    elif choice == '7':
+        physical = input("Physical base backup instead of per-database dumps? [y,n] >>> ").lower() == 'y'
+        target, manifest = backup(get_session(), physical=physical)
+        show_backup_report(manifest)
+        printf("Saved into " + target, TextFormat.Colors.green, TextFormat.bold)
+        input("Press <Enter> to continue..")
+
+    elif choice == '8':
+        backups = list_backups()
+        if not backups:
+            printf("[Not Exist] There are no backups in " + BACKUP_ROOT + ".", TextFormat.Colors.yellow)
+        else:
+            printf("\n".join(backups), TextFormat.Colors.orange)
+            name = choose_name("Choose backup (default " + backups[0] + ") >>> ", backups) or backups[0]
+            if name in backups:
+                failed = restore(get_session(), os.path.join(BACKUP_ROOT, name))
+                printf("Some databases failed." if failed else "All done!",
+                       TextFormat.Colors.red if failed else TextFormat.Colors.green, TextFormat.bold)
+        input("Press <Enter> to continue..")
+
+    elif choice == '9':
+        dashboard(get_session())
+
+    elif choice == '10':
+        analyzer_menu(get_session())
+
+    elif choice == '11':
+        benchmark_menu(get_session())
+
+    elif choice == '12':
+        maintenance_menu(get_session())
+
+    elif choice == '14':
+        archiving_menu(get_session())
+
+    elif choice == '13':
+        session = get_session()
+        CATALOG.refresh(session)
+        db_name = choose_name("Choose database (enter name) >>> ", CATALOG.databases)
+        session.connect(db_name)
+        show_findings(session, index_report(session))
+        input("Press <Enter> to continue..")
+
+
+def operations(choice):
+    """Operations with PostgreSQL"""
+
+    if choice == '1':
+        printf("Entering into psql..\n", TextFormat.Colors.lightblue)
+        clear(1)
+        interactive(["psql"], user="postgres")
+        printf("Exited from psql.", TextFormat.Colors.lightblue)
+        pause(1)
+
+    elif choice in ('2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12', '13', '14'):
+        try:
+            operations_query(choice)
+        except SessionError as error:
+            printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+            input("Press <Enter> to continue..")
+
+    clear()
+
+
+def is_initialized():
+    """Check if database cluster exists in data directory"""
+
+    return os.path.exists(os.path.join(PGDATA, "PG_VERSION"))
+
+
+def plan_apply(state, autostart):
+    """Build list of steps needed to bring server into desired state"""
+
+    steps = []
+    installed = is_installed()
+    if not installed:
+        steps.append(package_step())
+    if not installed or not is_initialized():
+        steps.append(initdb_step())
+    running = installed and is_running()
+    if state == "running" and not running:
+        steps.append(start_step())
+    elif state == "stopped" and running:
+        steps.append(("Stopping service...", ["systemctl", "stop", SERVICE]))
+    autorun = installed and is_autorun()
+    if autostart == "on" and not autorun:
+        steps.append(enable_step())
+    elif autostart == "off" and autorun:
+        steps.append(("Disabling start on system boot...", ["systemctl", "disable", SERVICE]))
+    return steps
+
+
+def apply():
+    """Non-interactive mode: run only steps which are not satisfied yet, return exit status"""
+
+    state = get_option(("--state",), "running")
+    autostart = get_option(("--autostart",), "on")
+    profile = get_option(("--tune",))
+    if state not in ("running", "stopped") or autostart not in ("on", "off") or \
+            profile not in TUNING_PROFILES + (None,):
+        printf("[Wrong Usage] postgre.py apply [--state running|stopped] [--autostart on|off] [--rpm-dir DIR] "
+               "[--tune oltp|analytics|mixed] [--dry-run]", TextFormat.Colors.yellow, TextFormat.bold)
+        return 2
+    if not is_root() or not is_centos():
+        return 2
+
+    steps = plan_apply(state, autostart)
+    if not steps and profile is None:
+        printf("Nothing to do, server is already in desired state.", TextFormat.Colors.green, TextFormat.bold)
+        return 0
+    if sys.argv.__contains__("--dry-run"):
+        for title, argv in steps:
+            printf(" · " + title, TextFormat.Colors.lightblue, end=" ")
+            printf(" ".join(argv), TextFormat.Colors.darkgrey)
+        if profile is not None and is_initialized():
+            tune(profile, ask=False, write=False)
+        return 0
+
+    for title, argv in steps:
+        printf(" · " + title, TextFormat.Colors.lightblue, end=" ")
+        sys.stdout.flush()
+        with OPERATION_LOG.step(title):
+            result = cmd(argv)
+        SERVER_STATE.invalidate()
+        if not result.ok:
+            printf("Failed.", TextFormat.Colors.red, TextFormat.bold)
+            report_failure(result)
+            return 1
+        printf("Done.", TextFormat.Colors.green, TextFormat.bold)
+
+    changes = tune(profile, ask=False) if profile is not None else None
+    if changes and state == "running":
+        try:
+            session = PsqlSession()
+            try:
+                ok = apply_changes(session, changes, restart=True)
+            finally:
+                session.close()
+        except SessionError as error:
+            printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+            return 1
+        return 0 if ok else 1
+    return 0
+
+
+CLUSTER_NAME = re.compile(r"^[a-z][a-z0-9_]*$")
+CLUSTER_UNIT = """.include {base}
+
+[Service]
+Environment=PGDATA={data}
+Environment=PGPORT={port}
+"""
+
+
+def load_clusters():
+    """Registry of named clusters: name -> data directory and port"""
+
+    try:
+        with open(CLUSTERS_FILE) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_clusters(clusters):
+    os.makedirs(os.path.dirname(CLUSTERS_FILE), exist_ok=True)
+    with open(CLUSTERS_FILE, "w") as file:
+        json.dump(clusters, file, indent=2, sort_keys=True)
+
+
+def select_cluster(name):
+    """Point server globals (data directory, unit, port of child psql/pg_dump/pgbench) to named cluster,
+    None selects default server back"""
+
+    global CLUSTER, PGDATA, SERVICE, PENDING_RESTART
+    if name is None:
+        PGDATA, SERVICE, PENDING_RESTART, port = DEFAULT_SERVER
+        CLUSTER = None
+        os.environ.pop("PGPORT", None)
+        if port is not None:
+            os.environ["PGPORT"] = port
+        SERVER_STATE.invalidate()
+        close_session()
+        return True
+    cluster = load_clusters().get(name)
+    if cluster is None:
+        return False
+    CLUSTER, PGDATA, SERVICE = name, cluster["data"], "postgresql-" + name
+    PENDING_RESTART = os.path.join(os.path.dirname(cluster["data"]), ".postgre_pending_restart.json")
+    os.environ["PGPORT"] = str(cluster["port"])
+    SERVER_STATE.invalidate()
+    close_session()
+    return True
+
+
+def cluster_status(clusters):
+    """Rows of status table read from data directories and boot target, no commands are run"""
+
+    rows = [["(default)", "5432", "/var/lib/pgsql/data", "postgresql"]] if os.path.exists(
+        "/var/lib/pgsql/data/PG_VERSION") else []
+    rows += [[name, str(cluster["port"]), cluster["data"], "postgresql-" + name]
+             for name, cluster in sorted(clusters.items())]
+    for row in rows:
+        version = native_version(row[2])
+        running = native_running(row[2])
+        standby = any(os.path.exists(os.path.join(row[2], name)) for name in ("standby.signal", "recovery.conf"))
+        row += [version.split()[-1] if version else "not initialized",
+                "unknown" if running is None else "running" if running else "stopped",
+                "on" if os.path.lexists(os.path.join(BOOT_TARGET_WANTS, row[3] + ".service")) else "off",
+                "standby" if standby else "primary"]
+    return rows
+
+
+def show_clusters(clusters):
+    printf(format_table(["Cluster", "Port", "Data directory", "Unit", "Version", "State", "Autorun", "Role"],
+                        cluster_status(clusters), max_width=50), TextFormat.Colors.orange)
+
+
+def free_port(clusters, first=5433):
+    """First port from given one which is not taken by default or registered cluster"""
+
+    used = {int(cluster["port"]) for cluster in clusters.values()} | {5432}
+    while first in used:
+        first += 1
+    return first
+
+
+def selinux_port(port):
+    """Allow postmaster to bind non-default port when SELinux is enforcing"""
+
+    try:
+        with open("/sys/fs/selinux/enforce") as file:
+            enforcing = file.read().strip() == "1"
+    except OSError:
+        enforcing = False
+    if not enforcing or not shutil.which("semanage"):
+        return True
+    result = run(["semanage", "port", "-a", "-t", "postgresql_port_t", "-p", "tcp", str(port)], log=True)
+    return result.ok or "already defined" in result.output
+
+
+def cluster_job(name, cluster, action):
+    """Initialize or run systemctl action for one cluster, return CommandResult"""
+
+    unit = "postgresql-" + name
+    with OPERATION_LOG.step(action + " cluster " + name):
+        if action != "create":
+            return run(["systemctl", action, unit], echo=VERBOSE_MODE)
+        result = run(["postgresql-setup", "--initdb", "--unit", unit, "--port", str(cluster["port"])],
+                     echo=VERBOSE_MODE)
+    if result.ok:
+        conf = ConfigFile(os.path.join(cluster["data"], "postgresql.conf"))
+        conf.set("port", str(cluster["port"]))
+        conf.save()
+    return result
+
+
+def cluster_actions(names, action, jobs=None):
+    """Run action for every cluster at once, print result per cluster and return names which failed"""
+
+    clusters = load_clusters()
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or len(names) or 1) as pool:
+        futures = {pool.submit(cluster_job, name, clusters[name], action): name for name in names}
+        for future in concurrent.futures.as_completed(futures):
+            name, result = futures[future], future.result()
+            printf(" · " + action.capitalize() + " " + name + "...", TextFormat.Colors.lightblue, end=" ")
+            printf("Done." if result.ok else "Failed.", TextFormat.Colors.green if result.ok else TextFormat.Colors.red,
+                   TextFormat.bold)
+            if not result.ok:
+                report_failure(result)
+                failed.append(name)
+    SERVER_STATE.invalidate()
+    return failed
+
+
+def register_cluster(clusters, name, port=None):
+    """Add cluster into registry with data directory parent and instance unit, return its port"""
+
+    port = free_port(clusters, port or 5433)
+    clusters[name] = {"data": os.path.join(CLUSTER_ROOT, name, "data"), "port": port}
+    postgres_directory(CLUSTER_ROOT)
+    postgres_directory(os.path.dirname(clusters[name]["data"]))
+    with open(os.path.join(SYSTEMD_DIR, "postgresql-" + name + ".service"), "w") as file:
+        file.write(CLUSTER_UNIT.format(base=BASE_UNIT, data=clusters[name]["data"], port=port))
+    if not selinux_port(port):
+        printf("[Warning] SELinux does not allow port " + str(port) + ".", TextFormat.Colors.yellow)
+    return port
+
+
+def create_clusters(names, port=None, jobs=None):
+    """Register clusters with instance units and initialize them concurrently, return names which failed"""
+
+    clusters = load_clusters()
+    for name in names:
+        if not CLUSTER_NAME.match(name) or name in clusters:
+            printf("[Wrong Name] \"" + name + "\" is invalid or already exists.", TextFormat.Colors.yellow,
+                   TextFormat.bold)
+            return names
+    for name in names:
+        port = register_cluster(clusters, name, port)
+    save_clusters(clusters)
+    result = cmd(["systemctl", "daemon-reload"])
+    if not result.ok:
+        report_failure(result)
+        return names
+    return cluster_actions(names, "create", jobs)
+
+
+def remove_cluster(name, purge=False):
+    """Stop and unregister cluster, data directory is deleted only with purge"""
+
+    clusters = load_clusters()
+    cluster = clusters.pop(name)
+    run(["systemctl", "disable", "--now", "postgresql-" + name], echo=VERBOSE_MODE)
+    if cluster.get("slot"):
+        # forgotten slot would keep primary from recycling WAL forever, it is dropped over replication
+        # connection which standby itself used, password of remote primary comes from ~/.pgpass
+        primary = "port=" + str(cluster["primary_port"]) + " user=" + cluster.get("primary_user", "postgres")
+        if cluster.get("primary_host"):
+            primary = "host=" + cluster["primary_host"] + " " + primary
+        result = run(["psql", "-X", "-q", "-d", primary + " replication=true", "-c",
+                      "DROP_REPLICATION_SLOT " + cluster["slot"]], echo=VERBOSE_MODE, user="postgres")
+        if not result.ok:
+            printf("[Warning] Replication slot \"" + cluster["slot"] + "\" was not dropped on primary (" + primary +
+                   "), drop it there by pg_drop_replication_slot() or primary keeps WAL forever.",
+                   TextFormat.Colors.yellow, TextFormat.bold)
+    unit = os.path.join(SYSTEMD_DIR, "postgresql-" + name + ".service")
+    if os.path.exists(unit):
+        os.remove(unit)
+    cmd(["systemctl", "daemon-reload"])
+    save_clusters(clusters)
+    if purge:
+        root = os.path.dirname(cluster["data"])
+        kept = pitr_copies(root)
+        if not kept:
+            shutil.rmtree(root, ignore_errors=True)
+            return
+        clean_directory(root, kept)
+        for path in kept:
+            printf(" · Kept " + path, TextFormat.Colors.lightblue)
+
+
+def clusters_menu():
+    """Manage named clusters from main menu"""
+
+    clear()
+    show_welcome()
+    clusters = load_clusters()
+    show_clusters(clusters)
+    printf("  1. Create clusters\n"
+           "  2. Start all clusters\n"
+           "  3. Stop all clusters\n"
+           "  4. Select cluster for other menus" + (" (now " + CLUSTER + ")" if CLUSTER else "") + "\n"
+           "  5. Add hot standby of " + (CLUSTER or "default cluster") + "\n"
+           "  6. Replication status\n"
+           "  0. Back (to Main menu)")
+    choice = prompt(TextFormat.underline + TextFormat.bold + "Your choice" + TextFormat.reset + " >>> ")
+    if choice == '1':
+        names = [name.strip() for name in input("Names, comma separated >>> ").split(",") if name.strip()]
+        port = input("First port (empty for next free) >>> ").strip()
+        if names:
+            create_clusters(names, int(port) if port.isdigit() else None)
+            if input("Start them now? [y,n] >>> ").lower() == 'y':
+                cluster_actions(names, "start")
+            input("Press <Enter> to continue..")
+    elif choice in ('2', '3'):
+        cluster_actions(sorted(clusters), "start" if choice == '2' else "stop")
+        input("Press <Enter> to continue..")
+    elif choice in ('5', '6'):
+        try:
+            if choice == '5':
+                name = input("Standby name >>> ").strip()
+                port = input("Port (empty for next free) >>> ").strip()
+                create_replica(get_session(), name, int(port) if port.isdigit() else None)
+            else:
+                show_replication(get_session())
+        except SessionError as error:
+            printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        close_session()
+        input("Press <Enter> to continue..")
+    elif choice == '4':
+        name = choose_name("Cluster (empty for default) >>> ", clusters)
+        if name:
+            select_cluster(name)
+        elif CLUSTER is not None:
+            printf("Restart script without --cluster to manage default cluster.", TextFormat.Colors.lightblue)
+            pause(2)
+    return choice
+
+
+REPLICATION_USER = "replicator"
+REPLICATION_QUERY = """
+SELECT application_name, coalesce(client_addr::text, 'local'), state, sync_state,
+       {diff}({current}(), replay_{location}), {lag}
+FROM pg_stat_replication ORDER BY 1
+"""
+
+
+def prepare_primary(session, allow=None, password=None, restart=None):
+    """Settings, pg_hba.conf rule and role which let standbys stream WAL from this server.
+
+    allow=None prepares for standby on same host, which connects through socket as "postgres".
+    """
+
+    version = server_version_num()
+    changes = {}
+    if session.value("SHOW wal_level") in ("minimal", "archive"):
+        changes["wal_level"] = "replica" if version >= 90600 else "hot_standby"
+    if int(session.value("SHOW max_wal_senders")) < 5:
+        changes["max_wal_senders"] = "10"
+    if version >= 110000 and int(session.value("SHOW max_replication_slots")) < 5:
+        changes["max_replication_slots"] = "10"
+    elif version < 110000 and session.value("SHOW wal_keep_segments") == "0":
+        changes["wal_keep_segments"] = "64"
+    if version < 100000 and session.value("SHOW hot_standby") == "off":
+        changes["hot_standby"] = "on"  # ignored by primary, standby gets it with copied configuration
+    if allow is not None and session.value("SHOW listen_addresses") in ("localhost", "127.0.0.1", ""):
+        changes["listen_addresses"] = "*"
+
+    hba = HbaFile(session.value("SHOW hba_file"))
+    if allow is None:
+        hba.add_rule(["local", "replication", "postgres", "peer"])
+    else:
+        hba.add_rule(["host", "replication", REPLICATION_USER, allow, "md5"])
+        exists = session.value("SELECT 1 FROM pg_roles WHERE rolname = " + quote_literal(REPLICATION_USER))
+        session.query(("ALTER" if exists else "CREATE") + " ROLE " + REPLICATION_USER +
+                      " WITH REPLICATION LOGIN PASSWORD " + quote_literal(password))
+    printf(hba.diff(), TextFormat.Colors.orange)
+    hba.save()
+    if changes:
+        return set_parameters(session, changes, ask=False, restart=restart)
+    session.query("SELECT pg_reload_conf()")
+    return True
+
+
+def binary_version(program):
+    """Version of client program as server_version_num, 0 if unknown"""
+
+    match = re.search(r"(\d+)\.(\d+)", run([program, "--version"], log=False).output)
+    if not match:
+        return 0
+    major, minor = int(match.group(1)), int(match.group(2))
+    return major * 10000 if major >= 10 else major * 10000 + minor * 100
+
+
+def configure_standby(data, name, port, primary_conninfo, slot):
+    """Own port, hot standby and connection to primary, recovery.conf before 12, standby.signal since"""
+
+    conf = ConfigFile(os.path.join(data, "postgresql.conf"))
+    conf.set("port", str(port))
+    conf.set("hot_standby", "on")
+    primary = {"primary_conninfo": primary_conninfo + " application_name=" + name}
+    if slot:
+        primary["primary_slot_name"] = name
+    if server_version_num(data) >= 120000:
+        for key, value in primary.items():
+            conf.set(key, value)
+        open(os.path.join(data, "standby.signal"), "w").close()
+    else:
+        with open(os.path.join(data, "recovery.conf"), "w") as file:
+            file.write("standby_mode = 'on'\n")
+            file.writelines(key + " = " + quote_conf(value) + "\n" for key, value in primary.items())
+        os.chmod(os.path.join(data, "recovery.conf"), 0o600)
+    conf.save()
+    postgres_files(data)
+
+
+def postgres_files(data):
+    """Give files written by root into data directory back to "postgres" user"""
+
+    uid = pwd.getpwnam("postgres").pw_uid
+    for entry in os.listdir(data):
+        path = os.path.join(data, entry)
+        if os.path.isfile(path) and os.stat(path).st_uid != uid:
+            shutil.chown(path, "postgres", "postgres")
+
+
+def save_pgpass(host, port, user, password):
+    """Keep password of replication connection in ~/.pgpass of "postgres" user, out of command lines, conninfo
+    and operation log"""
+
+    entry = pwd.getpwnam("postgres")
+    path = os.path.join(entry.pw_dir, ".pgpass")
+    key = ":".join(str(value).replace("\\", "\\\\").replace(":", "\\:")
+                   for value in (host, port, "replication", user)) + ":"
+    try:
+        with open(path) as file:
+            lines = [line for line in file if not line.startswith(key)]
+    except FileNotFoundError:
+        lines = []
+    lines.append(key + password.replace("\\", "\\\\").replace(":", "\\:") + "\n")
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, "w") as file:
+        file.writelines(lines)
+    os.chmod(path, 0o600)  # libpq ignores file readable by others
+    os.chown(path, entry.pw_uid, entry.pw_gid)
+
+
+def replication_password(confirm=False):
+    """Password of replication role from PGPASSWORD or asked without echo, never from command line"""
+
+    password = os.environ.get("PGPASSWORD")
+    while not password:
+        password = getpass.getpass("Password of \"" + REPLICATION_USER + "\" role >>> ")
+        if password and confirm and getpass.getpass("Repeat password >>> ") != password:
+            printf("[Wrong Input] Passwords do not match.", TextFormat.Colors.yellow)
+            password = None
+    return password
+
+
+def create_replica(session, name, port=None, source=None, password=None, restart=None):
+    """Hot standby cluster from pg_basebackup with streamed WAL.
+
+    Without source standby follows selected local cluster, else HOST[:PORT] prepared by "replica prepare".
+    """
+
+    clusters = load_clusters()
+    if not CLUSTER_NAME.match(name) or name in clusters:
+        printf("[Wrong Name] \"" + name + "\" is invalid or already exists.", TextFormat.Colors.yellow, TextFormat.bold)
+        return False
+    primary_port = os.environ.get("PGPORT", "5432")
+    if source is None:
+        printf(" · Preparing primary...", TextFormat.Colors.lightblue)
+        if not prepare_primary(session, restart=restart):
+            return False
+        session = get_session()
+        if session.value("SHOW wal_level") == "minimal" or session.value("SHOW max_wal_senders") == "0":
+            printf("[Failed] Primary must be restarted to apply replication settings first.", TextFormat.Colors.red,
+                   TextFormat.bold)
+            return False
+        directories = session.value("SHOW unix_socket_directories" if server_version_num() >= 90300 else
+                                    "SHOW unix_socket_directory")
+        host, user = directories.split(",")[0].strip(), "postgres"
+    else:
+        host, _, primary_port = source.partition(":")
+        primary_port, user = primary_port or "5432", REPLICATION_USER
+        save_pgpass(host, primary_port, user, password)
+    primary = "host=" + host + " port=" + primary_port + " user=" + user
+    slot = binary_version("pg_basebackup") >= 110000
+    port = register_cluster(clusters, name, port)
+    data = clusters[name]["data"]
+    clusters[name].update(primary_host=host, primary_port=int(primary_port), primary_user=user)
+    if slot:
+        clusters[name]["slot"] = name
+    save_clusters(clusters)
+    try:
+        ok = build_replica(name, port, data, primary, slot)
+    except (Exception, KeyboardInterrupt):
+        remove_cluster(name, purge=True)
+        raise
+    if not ok:
+        # registry entry, unit and slot of standby which never came up would only block the name and WAL
+        printf(" · Removing unfinished cluster \"" + name + "\"...", TextFormat.Colors.lightblue)
+        remove_cluster(name, purge=True)
+    SERVER_STATE.invalidate()
+    return ok
+
+
+def build_replica(name, port, data, primary, slot):
+    """Copy primary into registered cluster, configure it as standby and start it, return True on success"""
+
+    result = cmd(["systemctl", "daemon-reload"])
+    if not result.ok:
+        report_failure(result)
+        return False
+
+    printf(" · Copying primary with pg_basebackup...", TextFormat.Colors.lightblue, end=" ")
+    sys.stdout.flush()
+    argv = ["pg_basebackup", "-D", data, "-d", primary, "-X", "stream", "-c", "fast"]
+    result = run(argv + (["-C", "-S", name] if slot else []), echo=VERBOSE_MODE, user="postgres")
+    printf("Done." if result.ok else "Failed.", TextFormat.Colors.green if result.ok else TextFormat.Colors.red,
+           TextFormat.bold)
+    if not result.ok:
+        report_failure(result)
+        return False
+    configure_standby(data, name, port, primary, slot)
+    printf(" · Starting standby on port " + str(port) + "...", TextFormat.Colors.lightblue, end=" ")
+    sys.stdout.flush()
+    result = cmd(["systemctl", "start", "postgresql-" + name])
+    printf("Done." if result.ok else "Failed.", TextFormat.Colors.green if result.ok else TextFormat.Colors.red,
+           TextFormat.bold)
+    if not result.ok:
+        report_failure(result)
+    return result.ok
+
+
+def show_replication(session):
+    """Standbys of primary with lag in bytes and time, or replay delay when server itself is standby"""
+
+    if session.value("SELECT pg_is_in_recovery()") == "t":
+        delay = session.value("SELECT extract(epoch FROM now() - pg_last_xact_replay_timestamp())::int")
+        printf("Standby, last replayed transaction " + (delay + " s ago" if delay != "[NULL]" else "unknown"),
+               TextFormat.Colors.lightblue)
+        return
+    version = server_version_num()
+    query = REPLICATION_QUERY.format(diff="pg_wal_lsn_diff", current="pg_current_wal_lsn", location="lsn",
+                                     lag="coalesce(replay_lag::text, '0')") if version >= 100000 else \
+        REPLICATION_QUERY.format(diff="pg_xlog_location_diff", current="pg_current_xlog_location",
+                                 location="location", lag="'-'")
+    rows = session.query(query)[1]
+    if not rows:
+        printf("No standbys are connected.", TextFormat.Colors.lightblue)
+        return
+    printf(format_table(["Standby", "Client", "State", "Sync", "Lag", "Replay lag"],
+                        [row[:4] + [pretty_size(int(float(row[4]))) if row[4] != "[NULL]" else "-", row[5]]
+                         for row in rows]), TextFormat.Colors.orange)
+
+
+def replica_command():
+    """Non-interactive replica management, return exit status"""
+
+    action = sys.argv[2] if len(sys.argv) > 2 else None
+    port, source = get_option(("--port", "-p")), get_option(("--from",))
+    allow = get_option(("--allow",))
+    name = sys.argv[3] if len(sys.argv) > 3 and not sys.argv[3].startswith("-") else None
+    if action not in ("create", "prepare", "status") or (port is not None and not port.isdigit()) or \
+            (action == "create" and name is None) or (action == "prepare" and allow is None):
+        printf("[Wrong Usage] postgre.py replica create NAME [--port N] [--from HOST[:PORT]] | "
+               "prepare --allow CIDR | status", TextFormat.Colors.yellow, TextFormat.bold)
+        return 2
+    if not is_root():
+        return 2
+    password = None
+    if action == "prepare" or source is not None:
+        password = replication_password(confirm=action == "prepare")
+    try:
+        if action == "create" and source is not None:
+            return 0 if create_replica(None, name, int(port) if port else None, source, password) else 1
+        session = get_session()
+        try:
+            if action == "status":
+                show_replication(session)
+                return 0
+            if action == "prepare":
+                return 0 if prepare_primary(session, allow, password, restart=True) else 1
+            return 0 if create_replica(session, name, int(port) if port else None, restart=True) else 1
+        finally:
+            close_session()
+    except (SessionError, OSError) as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        return 1
+
+
+def cluster_command():
+    """Non-interactive cluster management, return exit status"""
+
+    action = sys.argv[2] if len(sys.argv) > 2 else "list"
+    actions = ("list", "create", "start", "stop", "restart", "enable", "disable", "remove")
+    port, jobs = get_option(("--port", "-p")), get_option(("--jobs", "-j"), "0")
+    values = {port, jobs, get_option(("--cluster",))}
+    names = [arg for arg in sys.argv[3:] if not arg.startswith("-") and arg not in values]
+    clusters = load_clusters()
+    if sys.argv.__contains__("--all"):
+        names = sorted(clusters)
+    if action not in actions or (port is not None and not port.isdigit()) or not jobs.isdigit() or \
+            (action not in ("list", "create") and any(name not in clusters for name in names)):
+        printf("[Wrong Usage] postgre.py cluster list | create NAME... [--port N] [--start] | "
+               "start|stop|restart|enable|disable NAME...|--all [--jobs N] | remove NAME [--purge]",
+               TextFormat.Colors.yellow, TextFormat.bold)
+        return 2
+    if action == "list":
+        show_clusters(clusters)
+        return 0
+    if not is_root():
+        return 2
+    if action == "remove":
+        for name in names:
+            remove_cluster(name, sys.argv.__contains__("--purge"))
+        return 0
+    if action == "create":
+        failed = create_clusters(names, int(port) if port else None, int(jobs))
+        if not failed and sys.argv.__contains__("--start"):
+            failed = cluster_actions(names, "start", int(jobs))
+    else:
+        failed = cluster_actions(names, action, int(jobs))
+    show_clusters(load_clusters())
+    return 1 if failed else 0
+
+
+def transfer():
+    """Non-interactive export/import, return exit status"""
+
+    database, directory = get_option(("--db",)), get_option(("--dir",))
+    fmt = get_option(("--format",), "csv")
+    jobs, chunks = get_option(("--jobs", "-j"), str(os.cpu_count())), get_option(("--chunks",), "1")
+    if database is None or directory is None or fmt not in ("csv", "bin") or not jobs.isdigit() \
+            or not chunks.isdigit():
+        printf("[Wrong Usage] postgre.py export|import --db NAME --dir DIR [--tables A,B] [--jobs N] "
+               "[--format csv|bin] [--compress] [--chunks N] [--header]", TextFormat.Colors.yellow, TextFormat.bold)
+        return 2
+    if not is_root():
+        return 2
+
+    header = sys.argv.__contains__("--header")
+    try:
+        session = PsqlSession()
+        try:
+            if sys.argv[1] == "export":
+                tables = [name for name in get_option(("--tables",), "").split(",") if name]
+                failed = export_tables(session, database, tables, directory, int(jobs) or 1, fmt,
+                                       sys.argv.__contains__("--compress"), int(chunks) or 1, header)
+            else:
+                failed = import_tables(session, database, directory, int(jobs) or 1, header)
+        finally:
+            session.close()
+    except (SessionError, OSError) as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        return 1
+    return 1 if failed else 0
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def postgres_directory(path):
+    """Create directory writable by "postgres" user"""
+
+    os.makedirs(path, exist_ok=True)
+    if os.getuid() == 0:
+        shutil.chown(path, "postgres", "postgres")
+
+
+def backup(session, databases=None, jobs=None, compress=6, physical=False):
+    """Dump every database in directory format with parallel jobs, return backup directory and manifest"""
+
+    jobs = jobs or os.cpu_count()
+    target = os.path.join(BACKUP_ROOT, time.strftime("%Y%m%d-%H%M%S"))
+    postgres_directory(BACKUP_ROOT)
+    postgres_directory(target)
+    manifest = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "physical": physical, "databases": {}}
+
+    if physical:
+        manifest["system_identifier"] = system_identifier()
+        wal_method = "stream" if server_version_num() >= 100000 else "fetch"
+        argv = ["pg_basebackup", "-D", os.path.join(target, "base"), "-Ft", "-X", wal_method, "-c", "fast"]
+        if compress:
+            argv += ["-z", "-Z", str(compress)]
+        started = time.monotonic()
+        result = run(argv, echo=VERBOSE_MODE, user="postgres")
+        if not result.ok:
+            report_failure(result)
+        manifest["base"] = {"ok": result.ok, "seconds": round(time.monotonic() - started, 1),
+                            "bytes": directory_size(os.path.join(target, "base"))}
+    else:
+        result = run(["pg_dumpall", "--globals-only", "-f", os.path.join(target, "globals.sql")],
+                     echo=VERBOSE_MODE, user="postgres")
+        manifest["globals"] = result.ok
+        if databases is None:
+            databases = [row[0] for row in session.query(
+                "SELECT datname FROM pg_database WHERE datallowconn AND NOT datistemplate ORDER BY 1")[1]]
+        parallel = ["-j", str(jobs)] if server_version_num() >= 90300 else []
+        for database in databases:
+            printf(" · Dumping " + database + "...", TextFormat.Colors.lightblue, end=" ")
+            sys.stdout.flush()
+            started = time.monotonic()
+            path = os.path.join(target, database)
+            with OPERATION_LOG.step("dump " + database):
+                result = run(["pg_dump", "-Fd", "-Z", str(compress), "-f", path] + parallel + [database],
+                             echo=VERBOSE_MODE, user="postgres")
+            manifest["databases"][database] = {"ok": result.ok, "seconds": round(time.monotonic() - started, 1),
+                                               "bytes": directory_size(path)}
+            printf("Done." if result.ok else "Failed.", TextFormat.Colors.green if result.ok else TextFormat.Colors.red,
+                   TextFormat.bold)
+            if not result.ok:
+                report_failure(result)
+
+    with open(os.path.join(target, "manifest.json"), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return target, manifest
+
+
+def show_backup_report(manifest):
+    """Per-database timing and size table"""
+
+    entries = dict(manifest["databases"])
+    if "base" in manifest:
+        entries["(base backup)"] = manifest["base"]
+    rows = [[name, "ok" if entry["ok"] else "FAILED", str(entry["seconds"]) + " s", pretty_size(entry["bytes"]),
+             "%.1f MB/s" % (entry["bytes"] / max(entry["seconds"], 0.1) / 1024 / 1024)]
+            for name, entry in sorted(entries.items())]
+    printf(format_table(["Database", "Status", "Time", "Size", "Speed"], rows), TextFormat.Colors.orange)
+
+
+def list_backups():
+    """Backups in backup root, newest first"""
+
+    try:
+        names = os.listdir(BACKUP_ROOT)
+    except OSError:
+        return []
+    return sorted((name for name in names if os.path.exists(os.path.join(BACKUP_ROOT, name, "manifest.json"))),
+                  reverse=True)
+
+
+def restore(session, source, jobs=None):
+    """Restore globals and every dumped database of logical backup with parallel pg_restore, return failed names"""
+
+    jobs = jobs or os.cpu_count()
+    with open(os.path.join(source, "manifest.json")) as file:
+        manifest = json.load(file)
+    if manifest.get("physical"):
+        printf("[Not Supported] Physical backup is restored by point-in-time recovery.", TextFormat.Colors.yellow,
+               TextFormat.bold)
+        return ["(base backup)"]
+
+    failed = []
+    if os.path.exists(os.path.join(source, "globals.sql")):
+        run(["psql", "-X", "-q", "-f", os.path.join(source, "globals.sql")], echo=VERBOSE_MODE, user="postgres")
+    existing = {row[0] for row in session.query("SELECT datname FROM pg_database")[1]}
+    for database, entry in sorted(manifest["databases"].items()):
+        if not entry["ok"]:
+            continue
+        printf(" · Restoring " + database + "...", TextFormat.Colors.lightblue, end=" ")
+        sys.stdout.flush()
+        target = ["--clean", "-d", database] if database in existing else ["-C", "-d", "postgres"]
+        result = run(["pg_restore", "-j", str(jobs)] + target + [os.path.join(source, database)],
+                     echo=VERBOSE_MODE, user="postgres")
+        printf("Done." if result.ok else "Failed.", TextFormat.Colors.green if result.ok else TextFormat.Colors.red,
+               TextFormat.bold)
+        if not result.ok:
+            failed.append(database)
+    return failed
+
+
+def backup_command():
+    """Non-interactive backup/restore, return exit status"""
+
+    jobs, compress = get_option(("--jobs", "-j"), str(os.cpu_count())), get_option(("--compress",), "6")
+    source = get_option(("--from",))
+    if not jobs.isdigit() or not compress.isdigit() or (sys.argv[1] == "restore" and source is None):
+        printf("[Wrong Usage] postgre.py backup [--jobs N] [--compress 0-9] [--physical] | "
+               "restore --from DIR [--jobs N]", TextFormat.Colors.yellow, TextFormat.bold)
+        return 2
+    if not is_root():
+        return 2
+
+    try:
+        session = PsqlSession()
+        try:
+            if sys.argv[1] == "backup":
+                target, manifest = backup(session, jobs=int(jobs) or 1, compress=int(compress),
+                                          physical=sys.argv.__contains__("--physical"))
+                show_backup_report(manifest)
+                printf("Saved into " + target, TextFormat.Colors.green, TextFormat.bold)
+                entries = list(manifest["databases"].values()) + [manifest.get("base", {"ok": True})]
+                failed = not all(entry["ok"] for entry in entries)
+            else:
+                failed = restore(session, source, int(jobs) or 1)
+        finally:
+            session.close()
+    except (SessionError, OSError) as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        return 1
+    return 1 if failed else 0
+
+
+BENCH_DATABASE = "pgbench"
+BENCH_TPS = re.compile(r"^tps = (?P<tps>\d+(?:\.\d+)?) \((?:excluding|without)")
+PERCENTILES = (50, 90, 95, 99)
+
+
+def ensure_pgbench(session):
+    """Find pgbench, offer postgresql-contrib package which ships it on older releases"""
+
+    if shutil.which("pgbench"):
+        return True
+    printf("pgbench is shipped in postgresql-contrib package.", TextFormat.Colors.lightblue)
+    if input("Install postgresql-contrib? [y,n] >>> ").lower() != 'y':
+        return False
+    result = cmd(["yum", "-y", "install", "postgresql-contrib"])
+    if not result.ok:
+        report_failure(result)
+    return result.ok
+
+
+def bench_initialize(session, scale):
+    """Create pgbench dataset, skip it when database already has same scale"""
+
+    if session.value("SELECT 1 FROM pg_database WHERE datname = " + quote_literal(BENCH_DATABASE)):
+        previous = session.database
+        session.connect(BENCH_DATABASE)
+        try:
+            current = session.value("SELECT count(*) FROM pgbench_branches") \
+                if session.value("SELECT count(*) FROM pg_class WHERE relname = 'pgbench_branches'") != "0" else None
+        finally:
+            session.connect(previous)
+        if current == str(scale):
+            return True
+    else:
+        session.query("CREATE DATABASE " + BENCH_DATABASE)
+    printf(" · Initializing dataset with scale " + str(scale) + "...", TextFormat.Colors.lightblue)
+    quiet = ["-q"] if server_version_num() >= 90300 else []
+    result = run(["pgbench", "-i", "-s", str(scale)] + quiet + [BENCH_DATABASE], echo=VERBOSE_MODE, user="postgres")
+    if not result.ok:
+        report_failure(result)
+    return result.ok
+
+
+def percentiles(latencies):
+    """Nearest-rank percentiles of latencies in milliseconds"""
+
+    if not latencies:
+        return {}
+    latencies.sort()
+    result = {"p" + str(p): latencies[max(0, -(-len(latencies) * p // 100) - 1)] / 1000.0 for p in PERCENTILES}
+    result["max"] = latencies[-1] / 1000.0
+    return result
+
+
+def read_bench_logs(paths):
+    """Transaction latencies in microseconds from pgbench -l logs, third field of every line"""
+
+    latencies = []
+    for path in paths:
+        with open(path) as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) > 2 and fields[2].isdigit():
+                    latencies.append(int(fields[2]))
+        os.remove(path)
+    return latencies
+
+
+def bench_run(clients, threads, duration, version):
+    """Run one pgbench round, return TPS and latency percentiles or None on failure"""
+
+    argv = ["pgbench", "-n", "-c", str(clients), "-j", str(threads), "-T", str(duration), "-l"]
+    if version >= 90500:
+        directory = os.path.join(STATE_DIR, "bench", time.strftime("%Y%m%d-%H%M%S"))
+        postgres_directory(os.path.dirname(directory))
+        postgres_directory(directory)
+        argv.append("--log-prefix=" + os.path.join(directory, "pgbench_log"))
+    else:
+        # older pgbench writes logs into working directory, which is home of "postgres" user
+        directory = pwd.getpwnam("postgres").pw_dir
+    result = run(argv + [BENCH_DATABASE], echo=VERBOSE_MODE, user="postgres")
+    logs = [os.path.join(directory, name) for name in os.listdir(directory) if name.startswith("pgbench_log.")]
+    latencies = read_bench_logs(logs)
+    if version >= 90500:
+        shutil.rmtree(directory, ignore_errors=True)
+    if not result.ok:
+        report_failure(result)
+        return None
+    tps = [float(match.group("tps")) for match in map(BENCH_TPS.match, result.lines) if match]
+    return {"tps": tps[0] if tps else len(latencies) / float(duration), "transactions": len(latencies),
+            "latency": percentiles(latencies)}
+
+
+def benchmark(session, scale=10, clients=(1, 4, 16), threads=(1, 4), duration=30):
+    """Sweep client and thread counts, append results into history and return them"""
+
+    if not ensure_pgbench(session) or not bench_initialize(session, scale):
+        return []
+    version = server_version_num()
+    started = time.strftime("%Y-%m-%d %H:%M:%S")
+    rounds = [(c, j) for c in clients for j in threads if j <= c and c % j == 0]
+    results = []
+    for number, (c, j) in enumerate(rounds):
+        print_progress_bar(number, len(rounds), prefix=" · Benchmarking:", suffix="clients %d, threads %d" % (c, j),
+                           print_end="\r")
+        measured = bench_run(c, j, duration, version)
+        if measured is not None:
+            measured.update(run=started, scale=scale, clients=c, threads=j, duration=duration, version=version)
+            results.append(measured)
+    print_progress_bar(len(rounds), len(rounds), prefix=" · Benchmarking:", suffix="Complete" + " " * 20)
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(BENCH_HISTORY, "a") as file:
+        for measured in results:
+            file.write(json.dumps(measured) + "\n")
+    return results
+
+
+def bench_history():
+    """Benchmark history grouped by run, oldest first"""
+
+    runs = {}
+    if os.path.exists(BENCH_HISTORY):
+        with open(BENCH_HISTORY) as file:
+            for line in file:
+                if line.strip():
+                    measured = json.loads(line)
+                    runs.setdefault(measured["run"], []).append(measured)
+    return runs
+
+
+def show_bench(results, baseline=None, threshold=0.1):
+    """Print benchmark results, compared with baseline when given, return number of regressions"""
+
+    previous = {(old["scale"], old["clients"], old["threads"]): old for old in baseline or []}
+    rows, regressions = [], 0
+    for measured in results:
+        old = previous.get((measured["scale"], measured["clients"], measured["threads"]))
+        latency = measured["latency"]
+        change = ""
+        if old and old["tps"]:
+            tps_change = measured["tps"] / old["tps"] - 1
+            p95_change = latency.get("p95", 0) / old["latency"]["p95"] - 1 if old["latency"].get("p95") else 0
+            change = "%+.1f%% tps, %+.1f%% p95" % (tps_change * 100, p95_change * 100)
+            if tps_change < -threshold or p95_change > threshold:
+                change += " REGRESSED"
+                regressions += 1
+        rows.append([str(measured["clients"]), str(measured["threads"]), "%.1f" % measured["tps"]] +
+                    ["%.2f" % latency.get("p" + str(p), 0) for p in PERCENTILES] + [change])
+    printf(format_table(["Clients", "Threads", "TPS"] + ["p%d ms" % p for p in PERCENTILES] + ["Against baseline"],
+                        rows, max_width=60), TextFormat.Colors.orange)
+    return regressions
+
+
+def benchmark_menu(session, ask=True):
+    """Run benchmark with asked parameters and compare it with previous run"""
+
+    scale, clients, threads, duration = "10", "1,4,16", "1,4", "30"
+    if ask:
+        scale = input("Scale factor (default 10) >>> ").strip() or scale
+        clients = input("Client counts (default 1,4,16) >>> ").strip() or clients
+        threads = input("Thread counts (default 1,4) >>> ").strip() or threads
+        duration = input("Seconds per round (default 30) >>> ").strip() or duration
+    numbers = [scale, duration] + clients.split(",") + threads.split(",")
+    if all(number.strip().isdigit() and int(number) > 0 for number in numbers):
+        baseline = list(bench_history().values())
+        results = benchmark(session, int(scale), [int(c) for c in clients.split(",")],
+                            [int(j) for j in threads.split(",")], int(duration))
+        show_bench(results, baseline[-1] if baseline else None)
+    else:
+        printf("[Wrong Input] Positive numbers expected.", TextFormat.Colors.yellow)
+    if ask:
+        input("Press <Enter> to continue..")
+
+
+DEAD_TUPLES_QUERY = """
+SELECT quote_ident(schemaname) || '.' || quote_ident(relname), pg_table_size(relid), n_dead_tup,
+       CASE WHEN n_live_tup + n_dead_tup > 0 THEN n_dead_tup::float8 / (n_live_tup + n_dead_tup) ELSE 0 END
+FROM pg_stat_user_tables WHERE n_dead_tup >= %d
+"""
+APPROX_DEAD_QUERY = """
+SELECT quote_ident(schemaname) || '.' || quote_ident(relname), pg_table_size(relid), n_dead_tup,
+       (pgstattuple_approx(relid)).dead_tuple_percent / 100
+FROM pg_stat_user_tables WHERE n_dead_tup >= %d
+"""
+INDEX_BLOAT_QUERY = """
+SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname), pg_relation_size(c.oid)
+FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace JOIN pg_index i ON i.indexrelid = c.oid
+     JOIN pg_am a ON a.oid = c.relam
+WHERE c.relkind = 'i' AND c.relpersistence <> 't' AND a.amname = 'btree' AND i.indisvalid
+      AND n.nspname NOT IN ('pg_catalog', 'information_schema') AND n.nspname !~ '^pg_toast'
+      AND pg_relation_size(c.oid) >= %d
+ORDER BY 2 DESC
+"""
+MIN_DEAD_TUPLES = 1000
+MIN_INDEX_SIZE = 10 * 1024 * 1024
+FILL_DENSITY = 90.0
+
+
+def maintenance_plan(session, min_dead=0.1, min_bloat=0.3, deadline=None):
+    """Rank tables by dead tuples and btree indexes by bloat in every database, biggest expected benefit first.
+
+    Dead ratio is precise when pgstattuple extension is installed in database, else taken from statistics
+    collector; index bloat is estimated only with pgstattuple, against default leaf fill density. pgstattuple
+    reads whole relations, so with deadline (time.monotonic() value) it runs only while time is left and
+    indexes which were not measured in time are left out.
+    """
+
+    def measure(sql):
+        """Run pgstattuple query within time left, None if it failed or did not fit"""
+
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining < 1:
+                return None
+            session.query("SET statement_timeout = " + str(int(remaining * 1000)))
+        try:
+            return session.query(sql)[1]
+        except SessionError:
+            return None
+        finally:
+            if deadline is not None:
+                session.query("RESET statement_timeout")
+
+    databases = [row[0] for row in session.query(
+        "SELECT datname FROM pg_database WHERE datallowconn AND NOT datistemplate ORDER BY 1")[1]]
+    reindex = server_version_num() >= 120000
+    approx = server_version_num() >= 90500
+    previous, tasks = session.database, []
+    try:
+        for database in databases:
+            session.connect(database)
+            stattuple = session.value("SELECT 1 FROM pg_extension WHERE extname = 'pgstattuple'") is not None
+            rows = measure(APPROX_DEAD_QUERY % MIN_DEAD_TUPLES) if stattuple and approx else None
+            if rows is None:
+                rows = session.query(DEAD_TUPLES_QUERY % MIN_DEAD_TUPLES)[1]
+            for name, size, dead, ratio in rows:
+                if float(ratio) >= min_dead:
+                    tasks.append({"database": database, "action": "vacuum", "object": name, "size": int(size),
+                                  "ratio": float(ratio), "benefit": int(int(size) * float(ratio))})
+            if stattuple and reindex:
+                for name, size in session.query(INDEX_BLOAT_QUERY % MIN_INDEX_SIZE)[1]:
+                    density = measure("SELECT avg_leaf_density FROM pgstatindex(" + quote_literal(name) + ")")
+                    if density is None:
+                        continue
+                    density = density[0][0]
+                    bloat = max(0.0, 1 - float(density) / FILL_DENSITY) if density != "NaN" else 0.0
+                    if bloat >= min_bloat:
+                        tasks.append({"database": database, "action": "reindex", "object": name, "size": int(size),
+                                      "ratio": bloat, "benefit": int(int(size) * bloat)})
+    finally:
+        session.connect(previous)
+    return sorted(tasks, key=lambda task: -task["benefit"])
+
+
+def show_maintenance(tasks, results=None):
+    rows = []
+    for number, task in enumerate(tasks):
+        row = [task["database"], task["object"], task["action"], pretty_size(task["size"]),
+               "%.0f%%" % (task["ratio"] * 100), pretty_size(task["benefit"])]
+        if results is not None:
+            status, seconds = results.get(number, ("skipped", 0.0))
+            row += [status, "%.1f" % seconds]
+        rows.append(row)
+    printf(format_table(["Database", "Object", "Action", "Size", "Dead/bloat", "Benefit"] +
+                        (["Status", "Seconds"] if results is not None else []), rows), TextFormat.Colors.orange)
+
+
+def conninfo(database, timeout=None):
+    """libpq connection string, statement_timeout makes server cancel command when budget is over"""
+
+    info = "dbname='" + database.replace("\\", "\\\\").replace("'", "\\'") + "'"
+    if timeout is not None:
+        info += " options='-c statement_timeout=" + str(max(1, int(timeout * 1000))) + "'"
+    return info
+
+
+def drop_invalid_indexes(database, index):
+    """REINDEX CONCURRENTLY leaves invalid copy of index when it is cancelled, drop it"""
+
+    schema, name = index.rsplit(".", 1) if "." in index else ("public", index)
+    sql = ("SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname) FROM pg_index i "
+           "JOIN pg_class c ON c.oid = i.indexrelid JOIN pg_namespace n ON n.oid = c.relnamespace "
+           "WHERE NOT i.indisvalid AND quote_ident(n.nspname) = " + quote_literal(schema) +
+           " AND c.relname ~ ('^' || " + quote_literal(name.strip('"')) + " || '_cc(new|old)[0-9]*$')")
+    result = run(["psql", "-X", "-q", "-A", "-t", "-d", conninfo(database), "-c", sql], user="postgres")
+    for invalid in result.lines if result.ok else []:
+        if invalid.strip():
+            run(["psql", "-X", "-q", "-d", conninfo(database), "-c", "DROP INDEX CONCURRENTLY " + invalid.strip()],
+                user="postgres")
+
+
+def maintenance_job(task, deadline):
+    """Run one vacuum/reindex, return status and duration"""
+
+    remaining = deadline - time.monotonic() if deadline is not None else None
+    if remaining is not None and remaining < 1:
+        return "skipped", 0.0
+    sql = ("VACUUM (ANALYZE) " if task["action"] == "vacuum" else "REINDEX INDEX CONCURRENTLY ") + task["object"]
+    with OPERATION_LOG.step(task["action"] + " " + task["database"] + "." + task["object"]):
+        result = run(["psql", "-X", "-q", "-v", "ON_ERROR_STOP=1", "-d", conninfo(task["database"], remaining),
+                      "-c", sql], echo=VERBOSE_MODE, user="postgres")
+    if result.ok:
+        return "done", result.duration
+    if task["action"] == "reindex":
+        drop_invalid_indexes(task["database"], task["object"])
+    return "out of budget" if "statement timeout" in result.output else "failed", result.duration
+
+
+def maintain(tasks, jobs=2, budget=None, started=None):
+    """Run tasks in order of benefit with at most jobs at once, nothing new starts after budget (seconds) is over.
+
+    Budget counts from started (time.monotonic() value, now by default). Running command is cancelled by
+    statement_timeout when budget ends. Return results by task number.
+    """
+
+    deadline = (started or time.monotonic()) + budget if budget else None
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(maintenance_job, task, deadline): number for number, task in enumerate(tasks)}
+        for future in concurrent.futures.as_completed(futures):
+            number = futures[future]
+            results[number] = future.result()
+            status = results[number][0]
+            if status != "skipped":
+                printf(" · " + tasks[number]["action"].capitalize() + " " + tasks[number]["database"] + "." +
+                       tasks[number]["object"] + "...", TextFormat.Colors.lightblue, end=" ")
+                color = TextFormat.Colors.green if status == "done" else TextFormat.Colors.red
+                printf(status.capitalize() + ".", color, TextFormat.bold)
+    return results
+
+
+def maintenance_menu(session):
+    """Show ranked maintenance plan and run it with asked limits"""
+
+    printf(" · Estimating dead tuples and bloat...", TextFormat.Colors.lightblue)
+    tasks = maintenance_plan(session)
+    if not tasks:
+        printf("Nothing needs maintenance.", TextFormat.Colors.green, TextFormat.bold)
+    else:
+        show_maintenance(tasks)
+        jobs = input("Parallel jobs (default 2) >>> ").strip() or "2"
+        budget = input("Time budget in minutes (empty for no limit) >>> ").strip()
+        if jobs.isdigit() and int(jobs) > 0 and (budget.isdigit() or not budget):
+            show_maintenance(tasks, maintain(tasks, int(jobs), int(budget) * 60 if budget else None))
+        else:
+            printf("[Wrong Input] Positive numbers expected.", TextFormat.Colors.yellow)
+    input("Press <Enter> to continue..")
+
+
+WAL_SEGMENT = re.compile(r"^[0-9A-F]{24}$")
+
+
+def same_content(path, archived):
+    """Compare WAL file with archived copy, gzipped or not"""
+
+    with open(path, "rb") as original, (gzip.open if archived.endswith(".gz") else open)(archived, "rb") as copy:
+        while True:
+            chunk = original.read(COPY_BUFFER)
+            if chunk != copy.read(COPY_BUFFER):
+                return False
+            if not chunk:
+                return True
+
+
+def archive_file(source, directory, level):
+    """Copy one WAL file into archive, gzip it if level is given; written under temporary name and renamed, so
+    existing archive file is always complete and segment pushed ahead is not copied again.
+
+    Existing archive file with other content means archive is shared with another server, it is never overwritten.
+    """
+
+    name = os.path.basename(source)
+    for existing in (os.path.join(directory, name + ".gz"), os.path.join(directory, name)):
+        if os.path.exists(existing):
+            if same_content(source, existing):
+                return
+            raise FileExistsError(existing + " exists with different content")
+    target = os.path.join(directory, name + (".gz" if level else ""))
+    temporary = target + ".tmp-" + str(os.getpid()) + "-" + str(threading.get_ident())
+    try:
+        with open(source, "rb") as data, open(temporary, "wb") as output:
+            if level:
+                with gzip.GzipFile(fileobj=output, mode="wb", compresslevel=level, mtime=0) as compressed:
+                    shutil.copyfileobj(data, compressed, COPY_BUFFER)
+            else:
+                shutil.copyfileobj(data, output, COPY_BUFFER)
+            output.flush()
+            os.fsync(output.fileno())
+        os.rename(temporary, target)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def restore_file(name, directory, destination):
+    """Copy WAL file from archive to destination, False if archive does not have it"""
+
+    for source, opener in ((os.path.join(directory, name + ".gz"), gzip.open), (os.path.join(directory, name), open)):
+        if os.path.exists(source):
+            temporary = destination + ".tmp-" + str(threading.get_ident())
+            with opener(source, "rb") as data, open(temporary, "wb") as output:
+                shutil.copyfileobj(data, output, COPY_BUFFER)
+            os.rename(temporary, destination)
+            return True
+    return False
+
+
+def fsync_directory(directory):
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def wal_push(path, directory, jobs=4, level=1):
+    """archive_command: archive requested file and next segments waiting in archive_status at once.
+
+    Server asks for pushed-ahead segments later and gets them acknowledged immediately.
+    """
+
+    name, wal_dir = os.path.basename(path), os.path.dirname(path)
+    names = [name]
+    if WAL_SEGMENT.match(name) and jobs > 1:
+        ready = sorted(entry[:-6] for entry in os.listdir(os.path.join(wal_dir, "archive_status"))
+                       if entry.endswith(".ready") and WAL_SEGMENT.match(entry[:-6]))
+        names += [other for other in ready if other > name][:jobs - 1]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(names)) as pool:
+        futures = [pool.submit(archive_file, os.path.join(wal_dir, other), directory, level) for other in names]
+    # failed segment pushed ahead is simply archived again when server asks for it
+    futures[0].result()
+    fsync_directory(directory)
+
+
+def wal_fetch(name, destination, directory, jobs=4, spool=None):
+    """restore_command: restore requested file, decompress next archived segments into spool in parallel.
+
+    Return False when archive does not have requested file, which ends archive recovery.
+    """
+
+    spool = spool or os.getcwd().rstrip("/") + ".wal_spool"  # server runs commands in data directory
+    os.makedirs(spool, exist_ok=True)
+    for entry in os.listdir(spool):
+        if (entry < name and WAL_SEGMENT.match(name)) or ".tmp-" in entry:
+            os.remove(os.path.join(spool, entry))
+    spooled = os.path.join(spool, name)
+    if os.path.exists(spooled):
+        shutil.move(spooled, destination)
+        found = True
+        ahead = []
+    else:
+        found = None
+        ahead = [name]
+    if WAL_SEGMENT.match(name) and jobs > 1:
+        archived = sorted({entry.split(".")[0] for entry in os.listdir(directory)
+                           if WAL_SEGMENT.match(entry.split(".")[0])})
+        ahead += [other for other in archived if other > name and other[:8] == name[:8] and
+                  not os.path.exists(os.path.join(spool, other))][:jobs - 1]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(ahead), 1)) as pool:
+        futures = {other: pool.submit(restore_file, other, directory, destination if other == name else
+                                      os.path.join(spool, other)) for other in ahead}
+    if found is None:
+        found = futures[name].result()
+    return found
+
+
+def archive_settings(every=False):
+    """Archiving settings of selected cluster (all clusters by name with every), None if archiving was not enabled"""
+
+    try:
+        with open(os.path.join(STATE_DIR, "archive.json")) as file:
+            settings = json.load(file)
+    except (OSError, ValueError):
+        settings = {}
+    return settings if every else settings.get(CLUSTER or "default")
+
+
+def enable_archiving(session, root=ARCHIVE_DIR, jobs=4, level=1, restart=None):
+    """Point archive_command to helper installed from this script, restart only if archive_mode was off.
+
+    WAL goes into subdirectory named by system identifier, so clusters sharing root and cluster initialized
+    again never mix their segments.
+    """
+
+    script = os.path.abspath(sys.argv[0])
+    if not os.path.isfile(script) or script.startswith("/dev/"):
+        printf("[Not Supported] Save script to disk to install archive helper.", TextFormat.Colors.yellow,
+               TextFormat.bold)
+        return False
+    identifier = system_identifier()
+    directory = os.path.join(root, identifier)
+    postgres_directory(root)
+    postgres_directory(directory)
+    os.makedirs(os.path.dirname(ARCHIVE_HELPER), exist_ok=True)
+    shutil.copy(script, ARCHIVE_HELPER)
+    os.chmod(ARCHIVE_HELPER, 0o755)
+    os.makedirs(STATE_DIR, exist_ok=True)
+    settings = archive_settings(every=True)
+    settings[CLUSTER or "default"] = {"dir": directory, "jobs": jobs, "compress": level,
+                                      "system_identifier": identifier}
+    with open(os.path.join(STATE_DIR, "archive.json"), "w") as file:
+        json.dump(settings, file, indent=2, sort_keys=True)
+
+    wanted = {"archive_mode": "on",
+              "archive_command": " ".join([sys.executable, ARCHIVE_HELPER, "wal-push", "%p", "--dir",
+                                           shlex.quote(directory), "--jobs", str(jobs), "--compress", str(level)])}
+    if session.value("SHOW wal_level") == "minimal":
+        wanted["wal_level"] = "replica" if server_version_num() >= 90600 else "archive"
+    changes = {name: value for name, value in wanted.items() if session.value("SHOW " + name) != value}
+    if not changes:
+        printf("Archiving is already enabled.", TextFormat.Colors.green, TextFormat.bold)
+        return True
+    return set_parameters(session, changes, ask=False, restart=restart)
+
+
+def show_archiving(session):
+    """Archiver counters, segments waiting for archiving and archive size"""
+
+    directory = (archive_settings() or {}).get("dir", "-")
+    wal_dir = os.path.join(PGDATA, "pg_wal" if server_version_num() >= 100000 else "pg_xlog")
+    try:
+        backlog = sum(1 for entry in os.listdir(os.path.join(wal_dir, "archive_status")) if entry.endswith(".ready"))
+    except OSError:
+        backlog = "unknown"
+    rows = [["archive_mode", session.value("SHOW archive_mode")],
+            ["Archive directory", directory],
+            ["Archive size", pretty_size(directory_size(directory)) if os.path.isdir(directory) else "-"],
+            ["Waiting for archiving", str(backlog)]]
+    if server_version_num() >= 90400:
+        columns, values = session.query("SELECT archived_count, last_archived_wal, last_archived_time, failed_count, "
+                                        "last_failed_wal, last_failed_time FROM pg_stat_archiver")
+        rows += [[column, value] for column, value in zip(columns, values[0])]
+    printf(format_table(["Archiving", "Value"], rows, max_width=60), TextFormat.Colors.orange)
+
+
+def physical_backups(before=None, system=None):
+    """Physical backups as (path, manifest), newest first, optionally only those started before given time and
+    only those of server with given system identifier"""
+
+    found = []
+    for name in list_backups():
+        path = os.path.join(BACKUP_ROOT, name)
+        with open(os.path.join(path, "manifest.json")) as file:
+            manifest = json.load(file)
+        if not manifest.get("physical") or not manifest.get("base", {}).get("ok") or \
+                system is not None and manifest.get("system_identifier") != system:
+            continue
+        created = time.mktime(time.strptime(manifest["created"], "%Y-%m-%d %H:%M:%S"))
+        if before is None or created < before:
+            found.append((path, manifest))
+    return found
+
+
+def recovery_progress(started, target, timeout=6 * 3600):
+    """Follow replay till server leaves recovery, progress is time of last replayed transaction"""
+
+    begun = time.monotonic()
+    while time.monotonic() < begun + timeout:
+        try:
+            session = PsqlSession()
+            try:
+                recovering, replayed = session.query(
+                    "SELECT pg_is_in_recovery(), extract(epoch FROM pg_last_xact_replay_timestamp())")[1][0]
+            finally:
+                session.close()
+        except SessionError:
+            recovering, replayed = "t", "[NULL]"  # connections are refused till recovery reaches consistency
+        if recovering == "f":
+            print_progress_bar(1, 1, prefix=" · Recovery:")
+            return True
+        if replayed != "[NULL]":
+            done = min(max((float(replayed) - started) / max(target - started, 1.0), 0.0), 1.0)
+            suffix = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(float(replayed)))
+        else:
+            done, suffix = 0.0, "waiting for consistent state"
+        print_progress_bar(int(done * 1000), 1000, prefix=" · Recovery:", suffix=suffix + " " * 10, print_end="\r")
+        SERVER_STATE.invalidate()
+        if native_running() is False and time.monotonic() > begun + 30:  # start is not blocked, give it time
+            print()
+            return False
+        pause(2)
+    print()
+    return False
+
+
+def restore_data_directory(base, archives, target_time, settings):
+    """Extract base backup into empty data directory, write recovery settings and start recovery"""
+
+    postgres_directory(PGDATA)
+    os.chmod(PGDATA, 0o700)
+    shutil.rmtree(PGDATA.rstrip("/") + ".wal_spool", ignore_errors=True)  # segments left by earlier recovery
+    for name in archives:
+        target_dir = PGDATA if name.startswith("base.tar") else os.path.join(PGDATA, name.split(".")[0])
+        printf(" · Extracting " + name + "...", TextFormat.Colors.lightblue, end=" ")
+        sys.stdout.flush()
+        with OPERATION_LOG.step("pitr extract " + name):
+            result = run(["tar", "-xf", os.path.join(base, name), "-C", target_dir], echo=VERBOSE_MODE,
+                         user="postgres")
+        printf("Done." if result.ok else "Failed.", TextFormat.Colors.green if result.ok else TextFormat.Colors.red,
+               TextFormat.bold)
+        if not result.ok:
+            report_failure(result)
+            return False
+
+    version = server_version_num()
+    restore_command = " ".join([sys.executable, ARCHIVE_HELPER, "wal-fetch", "%f", "%p", "--dir",
+                                shlex.quote(settings["dir"]), "--jobs", str(settings["jobs"])])
+    recovery = {"restore_command": restore_command, "recovery_target_time": target_time}
+    if version >= 90500:
+        recovery["recovery_target_action"] = "promote"
+    else:
+        recovery["pause_at_recovery_target"] = "off"
+    if version >= 120000:
+        conf = ConfigFile(os.path.join(PGDATA, "postgresql.conf"))
+        for name, value in recovery.items():
+            conf.set(name, value)
+        conf.save()
+        open(os.path.join(PGDATA, "recovery.signal"), "w").close()
+    else:
+        with open(os.path.join(PGDATA, "recovery.conf"), "w") as file:
+            file.writelines(name + " = " + quote_conf(value) + "\n" for name, value in recovery.items())
+    postgres_files(PGDATA)
+
+    result = cmd(["systemctl", "start", "--no-block", SERVICE])
+    if not result.ok:
+        report_failure(result)
+    return result.ok
+
+
+def pitr_copies(directory):
+    """Data directories moved aside by point-in-time restore, removing never deletes them"""
+
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if ".before-pitr-" in name]
+
+
+def put_back(aside):
+    """Undo failed point-in-time restore: restored directory is kept for its logs, previous one is started again"""
+
+    cmd(["systemctl", "stop", SERVICE])
+    failed = PGDATA.rstrip("/") + ".failed-pitr-" + time.strftime("%Y%m%d-%H%M%S")
+    if os.path.exists(PGDATA):
+        os.rename(PGDATA, failed)
+    if aside is not None:
+        os.rename(aside, PGDATA)
+        result = cmd(["systemctl", "start", SERVICE])
+        if not result.ok:
+            report_failure(result)
+    SERVER_STATE.invalidate()
+    printf("[Failed] Previous data directory is back in " + PGDATA + ", restored one is moved to " + failed + ".",
+           TextFormat.Colors.red, TextFormat.bold)
+
+
+def point_in_time_restore(target_time, backup_path=None):
+    """Replace data directory with physical backup and replay archived WAL up to given time, return True on success.
+
+    Current data directory is kept next to new one, it is put back if anything fails.
+    """
+
+    try:
+        target = time.mktime(time.strptime(target_time, "%Y-%m-%d %H:%M:%S"))
+    except ValueError:
+        printf("[Wrong Input] Time must look like 2020-05-31 13:45:00.", TextFormat.Colors.yellow)
+        return False
+    settings = archive_settings()
+    if settings is None:
+        printf("[Not Exist] WAL archiving was not enabled for this cluster.", TextFormat.Colors.yellow, TextFormat.bold)
+        return False
+    system = settings["system_identifier"]
+    backups = physical_backups(target, system) if backup_path is None else \
+        [entry for entry in physical_backups(system=system) if entry[0] == os.path.abspath(backup_path)]
+    if not backups:
+        printf("[Not Exist] No physical backup of this cluster started before " + target_time + ".",
+               TextFormat.Colors.yellow, TextFormat.bold)
+        return False
+    source, manifest = backups[0]
+    base = os.path.join(source, "base")
+    archives = sorted(os.listdir(base))
+    # tablespace tars need tablespace_map and symlinks which are not recreated, refuse before server is touched
+    tablespaces = [name for name in archives if not name.startswith(("base.tar", "pg_wal.tar", "pg_xlog.tar"))]
+    if tablespaces:
+        printf("[Not Supported] Backup " + source + " has tablespaces (" + ", ".join(tablespaces) + "), restore it "
+               "manually.", TextFormat.Colors.yellow, TextFormat.bold)
+        return False
+    if not any(name.startswith("base.tar") for name in archives):
+        printf("[Not Exist] Backup " + source + " has no base.tar.", TextFormat.Colors.yellow, TextFormat.bold)
+        return False
+    if not os.path.exists(ARCHIVE_HELPER):
+        printf("[Not Exist] Archive helper " + ARCHIVE_HELPER + " is missing, enable archiving again.",
+               TextFormat.Colors.yellow, TextFormat.bold)
+        return False
+    printf(" · Using base backup " + source + " from " + manifest["created"], TextFormat.Colors.lightblue)
+
+    close_session()
+    printf(" · Stopping server...", TextFormat.Colors.lightblue, end=" ")
+    sys.stdout.flush()
+    result = cmd(["systemctl", "stop", SERVICE])
+    SERVER_STATE.invalidate()
+    if not result.ok:
+        printf("Failed.", TextFormat.Colors.red, TextFormat.bold)
+        report_failure(result)
+        return False
+    printf("Done.", TextFormat.Colors.green, TextFormat.bold)
+    aside = PGDATA.rstrip("/") + ".before-pitr-" + time.strftime("%Y%m%d-%H%M%S")
+    if os.path.exists(PGDATA):
+        os.rename(PGDATA, aside)
+        printf(" · Current data directory moved to " + aside, TextFormat.Colors.lightblue)
+    else:
+        aside = None
+    try:
+        if not restore_data_directory(base, archives, target_time, settings):
+            put_back(aside)
+            return False
+    except OSError as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        put_back(aside)
+        return False
+    started = time.mktime(time.strptime(manifest["created"], "%Y-%m-%d %H:%M:%S"))
+    if not recovery_progress(started, target):
+        printf("[Failed] Server did not finish recovery, its log stays in restored directory.",
+               TextFormat.Colors.red, TextFormat.bold)
+        put_back(aside)
+        return False
+    SERVER_STATE.invalidate()
+    printf("Restored to " + target_time + (", previous data is kept in " + aside if aside else "") + ".",
+           TextFormat.Colors.green, TextFormat.bold)
+    return True
+
+
+def archiving_menu(session):
+    """Continuous archiving and guided point-in-time restore"""
+
+    printf("  1. Enable WAL archiving\n"
+           "  2. Archiving status\n"
+           "  3. Point-in-time restore\n"
+           "  0. Back")
+    choice = input("Your choice >>> ")
+    if choice == '1':
+        directory = input("Archive directory (default " + ARCHIVE_DIR + ") >>> ").strip() or ARCHIVE_DIR
+        jobs = input("Parallel WAL transfers (default 4) >>> ").strip()
+        enabled = enable_archiving(session, directory, int(jobs) if jobs.isdigit() and int(jobs) else 4)
+        if enabled and not physical_backups(system=system_identifier()) and \
+                input("Take base backup now? It is needed for point-in-time restore [y,n] >>> ").lower() == 'y':
+            target, manifest = backup(get_session(), physical=True)
+            show_backup_report(manifest)
+    elif choice == '2':
+        show_archiving(session)
+    elif choice == '3':
+        for path, manifest in physical_backups(system=(archive_settings() or {}).get("system_identifier", "")):
+            printf(manifest["created"] + "  " + path, TextFormat.Colors.orange)
+        target_time = input("Restore to time (YYYY-MM-DD HH:MM:SS) >>> ").strip()
+        printf("Server will be stopped and data directory replaced (current one is kept aside).",
+               TextFormat.Colors.yellow, TextFormat.bold)
+        if input("Continue? [y,n] >>> ").lower() == 'y':
+            point_in_time_restore(target_time)
+    if choice != '0':
+        input("Press <Enter> to continue..")
+
+
+def wal_command():
+    """archive_command/restore_command helper run by server as "postgres", return exit status"""
+
+    directory = get_option(("--dir",))
+    jobs, level = get_option(("--jobs",), "4"), get_option(("--compress",), "1")
+    arguments = [arg for arg in sys.argv[2:4] if not arg.startswith("-")]
+    if directory is None or not jobs.isdigit() or not level.isdigit() or \
+            len(arguments) < (1 if sys.argv[1] == "wal-push" else 2):
+        print("usage: wal-push PATH | wal-fetch NAME PATH --dir DIR [--jobs N] [--compress 0-9]", file=sys.stderr)
+        return 2
+    try:
+        if sys.argv[1] == "wal-push":
+            wal_push(arguments[0], directory, int(jobs) or 1, min(int(level), 9))
+            return 0
+        return 0 if wal_fetch(arguments[0], arguments[1], directory, int(jobs) or 1, get_option(("--spool",))) else 1
+    except OSError as error:
+        print(sys.argv[1] + ": " + str(error), file=sys.stderr)
+        return 1
+
+
+def archiving_command():
+    """Non-interactive archiving setup, status and point-in-time restore, return exit status"""
+
+    action = sys.argv[2] if len(sys.argv) > 2 else None
+    directory, jobs = get_option(("--dir",), ARCHIVE_DIR), get_option(("--jobs", "-j"), "4")
+    level, target_time = get_option(("--compress",), "1"), get_option(("--time",))
+    if action not in ("enable", "status", "restore") or not jobs.isdigit() or not level.isdigit() or \
+            (action == "restore" and target_time is None):
+        printf("[Wrong Usage] postgre.py archive enable [--dir DIR] [--jobs N] [--compress 0-9] [--base] | status | "
+               "restore --time \"YYYY-MM-DD HH:MM:SS\" [--from BACKUP]", TextFormat.Colors.yellow, TextFormat.bold)
+        return 2
+    if not is_root():
+        return 2
+    if action == "restore":
+        return 0 if point_in_time_restore(target_time, get_option(("--from",))) else 1
+    try:
+        session = get_session()
+        try:
+            if action == "status":
+                show_archiving(session)
+                return 0
+            if not enable_archiving(session, directory, int(jobs) or 1, min(int(level), 9), restart=True):
+                return 1
+            if sys.argv.__contains__("--base"):
+                target, manifest = backup(get_session(), physical=True)
+                show_backup_report(manifest)
+                return 0 if manifest["base"]["ok"] else 1
+        finally:
+            close_session()
+    except (SessionError, OSError) as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        return 1
+    return 0
+
+
+def settings_command():
+    """Non-interactive parameter change and deferred restart, return exit status"""
+
+    if not is_root():
+        return 2
+    if sys.argv[1] == "restart-pending":
+        at = get_option(("--at",))
+        if at is not None:
+            return schedule_restart(at)
+        if not pending_restart():
+            printf("Nothing to do, there are no restart-only changes.", TextFormat.Colors.green, TextFormat.bold)
+            return 0
+        return 0 if restart_server() else 1
+
+    changes = parse_assignments([arg for arg in sys.argv[2:] if "=" in arg and not arg.startswith("-")])
+    restart = get_option(("--restart",), "later")
+    if not changes or restart not in ("now", "later"):
+        printf("[Wrong Usage] postgre.py set NAME=VALUE... [--restart now|later] [--yes] | "
+               "restart-pending [--at HH:MM]", TextFormat.Colors.yellow, TextFormat.bold)
+        return 2
+    try:
+        session = PsqlSession()
+        try:
+            ok = set_parameters(session, changes, ask=not sys.argv.__contains__("--yes"), restart=restart == "now")
+        finally:
+            session.close()
+    except SessionError as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        return 1
+    return 0 if ok else 1
+
+
+def schedule_restart(at):
+    """Run restart-pending once at given time of day with transient systemd timer"""
+
+    script = os.path.abspath(sys.argv[0])
+    if not os.path.isfile(script) or script.startswith("/dev/") or not re.match(r"^\d{1,2}:\d{2}$", at):
+        printf("[Not Supported] Save script to disk and give time as HH:MM to schedule restart.",
+               TextFormat.Colors.yellow, TextFormat.bold)
+        return 2
+    hour, minute = (int(part) for part in at.split(":"))
+    now = time.localtime()
+    day = time.time() + (86400 if (hour, minute) <= (now.tm_hour, now.tm_min) else 0)
+    when = time.strftime("%Y-%m-%d", time.localtime(day)) + " %02d:%02d:00" % (hour, minute)
+    unit, cluster = "postgre-restart-pending", []
+    if CLUSTER is not None:
+        unit, cluster = unit + "-" + CLUSTER, ["--cluster", CLUSTER]
+    result = cmd(["systemd-run", "--on-calendar=" + when, "--unit=" + unit, sys.executable, script, "restart-pending"] +
+                 cluster)
+    if not result.ok:
+        report_failure(result)
+        return 1
+    printf("Restart scheduled at " + when + ".", TextFormat.Colors.green, TextFormat.bold)
+    return 0
+
+
+def statements_command():
+    """Non-interactive statement analyzer, return exit status"""
+
+    arguments = get_arguments(2, ("--by", "--limit", "--restart")) or [None]
+    action, names = arguments[0], arguments[1:]
+    order = get_option(("--by",), "total")
+    limit = get_option(("--limit",), "20")
+    restart = get_option(("--restart",), "later")
+    if action not in ("enable", "top", "snapshot", "compare", "log") or order not in STATEMENT_ORDER or \
+            not limit.isdigit() or action == "compare" and not names or restart not in ("now", "later"):
+        printf("[Wrong Usage] postgre.py statements enable | top [--by total|mean|calls|io] [--limit N] | snapshot | "
+               "compare BEFORE [AFTER] | log [FILE...] [--restart now|later] [--yes]",
+               TextFormat.Colors.yellow, TextFormat.bold)
+        return 2
+    if not is_root():
+        return 2
+    try:
+        session = get_session()
+        try:
+            if action == "log":
+                show_slow_log(session, names, int(limit))
+                return 0
+            if not enable_statements(session, not sys.argv.__contains__("--yes"), restart == "now"):
+                return 1
+            session = get_session()
+            if action == "top":
+                top_statements(session, order, int(limit))
+            elif action == "snapshot":
+                printf("Saved into " + save_snapshot(session), TextFormat.Colors.green, TextFormat.bold)
+            elif action == "compare":
+                after = load_snapshot(names[1]) if len(names) > 1 else statements(session)
+                return 1 if compare_snapshots(load_snapshot(names[0]), after, limit=int(limit)) else 0
+        finally:
+            close_session()
+    except (SessionError, OSError) as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        return 1
+    return 0
+
+
+def bench_command():
+    """Non-interactive benchmark and history comparison, return 1 when regressed"""
+
+    arguments = get_arguments(2, ("--scale", "--time", "--threshold", "--clients", "-c", "--threads", "-j")) or ["run"]
+    action, picked = arguments[0], arguments[1:3]
+    options = [get_option(("--scale",), "10"), get_option(("--time",), "30"), get_option(("--threshold",), "10")]
+    clients, threads = get_option(("--clients", "-c"), "1,4,16"), get_option(("--threads", "-j"), "1,4")
+    numbers = options + clients.split(",") + threads.split(",")
+    if action not in ("run", "history", "compare") or not all(number.isdigit() for number in numbers):
+        printf("[Wrong Usage] postgre.py bench [--scale N] [--clients 1,4,16] [--threads 1,4] [--time SEC] "
+               "[--threshold PCT] | history | compare [BASELINE [RUN]]", TextFormat.Colors.yellow, TextFormat.bold)
+        return 2
+    threshold = int(options[2]) / 100.0
+    runs = bench_history()
+    if action == "history":
+        for started, results in runs.items():
+            best = max(results, key=lambda measured: measured["tps"])
+            printf(started + "  scale " + str(best["scale"]) + "  best %.1f tps" % best["tps"] +
+                   " (clients %d, threads %d)" % (best["clients"], best["threads"]), TextFormat.Colors.orange)
+        return 0
+    if action == "compare":
+        names = list(runs)
+        if len(names) < 2 and len(picked) < 2 or any(name not in runs for name in picked):
+            printf("[Failed] Two stored runs are needed, see \"postgre.py bench history\".", TextFormat.Colors.red,
+                   TextFormat.bold)
+            return 1
+        baseline = picked[0] if picked else names[-2]
+        current = picked[1] if len(picked) > 1 else names[-1]
+        return 1 if show_bench(runs[current], runs[baseline], threshold) else 0
+    if not is_root():
+        return 2
+    try:
+        session = PsqlSession()
+        try:
+            results = benchmark(session, int(options[0]), [int(c) for c in clients.split(",")],
+                                [int(j) for j in threads.split(",")], int(options[1]))
+        finally:
+            session.close()
+    except (SessionError, OSError) as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        return 1
+    if not results:
+        return 1
+    baseline = list(runs.values())
+    return 1 if show_bench(results, baseline[-1] if baseline else None, threshold) else 0
+
+
+def maintain_command():
+    """Non-interactive maintenance for nightly window, return 1 if some object failed"""
+
+    jobs, budget = get_option(("--jobs", "-j"), "2"), get_option(("--budget",), "0")
+    min_dead, min_bloat = get_option(("--min-dead",), "10"), get_option(("--min-bloat",), "30")
+    if not all(number.isdigit() for number in (jobs, budget, min_dead, min_bloat)) or not int(jobs):
+        printf("[Wrong Usage] postgre.py maintain [--jobs N] [--budget MINUTES] [--min-dead PCT] [--min-bloat PCT] "
+               "[--dry-run]", TextFormat.Colors.yellow, TextFormat.bold)
+        return 2
+    if not is_root():
+        return 2
+    started = time.monotonic()  # estimate is part of maintenance window
+    try:
+        session = PsqlSession()
+        try:
+            tasks = maintenance_plan(session, int(min_dead) / 100.0, int(min_bloat) / 100.0,
+                                     started + int(budget) * 60 if int(budget) else None)
+        finally:
+            session.close()
+    except (SessionError, OSError) as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        return 1
+    if sys.argv.__contains__("--dry-run") or not tasks:
+        show_maintenance(tasks)
+        return 0
+    results = maintain(tasks, int(jobs), int(budget) * 60 or None, started)
+    show_maintenance(tasks, results)
+    return 1 if any(status == "failed" for status, _ in results.values()) else 0
+
+
+def indexes_command():
+    """Non-interactive index report, optionally save suggested DDL into file"""
+
+    database, path = get_option(("--db",)), get_option(("--sql",))
+    if database is None:
+        printf("[Wrong Usage] postgre.py indexes --db NAME [--sql FILE]", TextFormat.Colors.yellow, TextFormat.bold)
+        return 2
+    if not is_root():
+        return 2
+    try:
+        session = PsqlSession()
+        try:
+            session.connect(database)
+            findings = index_report(session)
+            show_findings(session, findings)
+        finally:
+            session.close()
+    except (SessionError, OSError) as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        return 1
+    if path is not None:
+        with open(path, "w") as file:
+            file.writelines("-- " + finding[0] + ": " + finding[3] + "\n" + finding[4] + "\n" for finding in findings)
+        printf("Suggestions saved into " + path, TextFormat.Colors.green, TextFormat.bold)
+    return 0
+
+
+def log_command():
+    """Summary of recorded commands by step, or recent failures with their output"""
+
+    last = get_option(("--last",), "10")
+    if not last.isdigit():
+        printf("[Wrong Usage] postgre.py log [--failed [--last N]]", TextFormat.Colors.yellow, TextFormat.bold)
+        return 2
+    if sys.argv.__contains__("--failed"):
+        failed = [record for record in OPERATION_LOG.records() if record.get("exit_code") or record.get("timed_out")]
+        for record in failed[-int(last):] if int(last) else []:
+            printf(record["timestamp"] + "  [" + record["step"] + "]  " + " ".join(record["command"]) +
+                   ("  timed out" if record["timed_out"] else "  exit " + str(record["exit_code"])),
+                   TextFormat.Colors.red, TextFormat.bold)
+            printf("\n".join(record["output"][-10:]), TextFormat.Colors.darkgrey)
+        return 0
+    steps = {}
+    for record in OPERATION_LOG.records():
+        entry = steps.setdefault(record.get("step", "-"), [0, 0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += 1 if record.get("exit_code") or record.get("timed_out") else 0
+        entry[2] += record.get("duration", 0.0)
+        entry[3] = max(entry[3], record.get("duration", 0.0))
+    rows = sorted(steps.items(), key=lambda item: -item[1][2])
+    printf(format_table(["Step", "Commands", "Failed", "Total s", "Mean s", "Max s"],
+                        [[step, str(count), str(failures), "%.1f" % total, "%.2f" % (total / count), "%.1f" % longest]
+                         for step, (count, failures, total, longest) in rows], max_width=60), TextFormat.Colors.orange)
+    printf("Log: " + OPERATION_LOG.path, TextFormat.Colors.lightblue)
+    return 0
+
+
+def clean_directory(path, keep=()):
+    """Delete everything inside directory like "rm -rf path/*" does: directory itself, dot entries and entries
+    which are or contain paths in keep stay.
+
+    Return False if something could not be deleted.
+    """
+
+    if not os.path.isdir(path):
+        return True
+    cleaned = True
+    for name in os.listdir(path):
+        full_path = os.path.join(path, name)
+        if name.startswith(".") or any(kept == full_path or kept.startswith(full_path + "/") for kept in keep):
+            continue
+        try:
+            if os.path.isdir(full_path) and not os.path.islink(full_path):
+                shutil.rmtree(full_path)
+            else:
+                os.remove(full_path)
+        except OSError as error:
+            printf("[Warning] " + str(error), TextFormat.Colors.yellow)
+            cleaned = False
+    return cleaned
+
+
+def backup_before_remove():
+    """Offer backup of all databases and roles before data is deleted, return False if removing must stop"""
+
+    if not is_running():
+        printf("Server is stopped. Start it to make backup of all databases before removing?",
+               TextFormat.Colors.yellow, TextFormat.bold)
+        if str(input("[y,n] >>> ")).lower() != 'y':
+            printf("[Warning] Databases will be removed without backup.", TextFormat.Colors.red, TextFormat.bold)
+            return True
+        result = cmd(["systemctl", "start", SERVICE])
+        SERVER_STATE.invalidate()
+        if not result.ok:
+            report_failure(result)
+            return False
+    else:
+        printf("Make backup of all databases into " + BACKUP_ROOT + " before removing?", TextFormat.Colors.yellow,
+               TextFormat.bold)
+        if str(input("[y,n] >>> ")).lower() != 'y':
+            return True
+    try:
+        target, manifest = backup(get_session())
+    except (SessionError, OSError) as error:
+        printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+        return False
+    finally:
+        close_session()
+    show_backup_report(manifest)
+    if not manifest["globals"]:
+        printf("[Failed] Roles and tablespaces were not saved.", TextFormat.Colors.red, TextFormat.bold)
+    return manifest["globals"] and all(entry["ok"] for entry in manifest["databases"].values())
+
+
+def backup_clusters_before_remove(clusters):
+    """Offer backup of default server and of every named cluster, return False if removing must stop"""
+
+    try:
+        for name in [None] + sorted(clusters):
+            select_cluster(name)
+            if name is not None:
+                printf("Cluster " + name + ":", TextFormat.Colors.lightblue, TextFormat.bold)
+            if not backup_before_remove():
+                return False
+        return True
+    finally:
+        select_cluster(None)
+
+
+def remove():
+    """Remove PostgreSQL"""
+
+    if is_installed():
+        printf("Do you want to keep configurations and databases?", TextFormat.Colors.yellow, TextFormat.bold)
+        answer = str(input("[y,n] >>> "))
+        clusters = load_clusters() if answer.lower() == 'n' else {}
+        if clusters:
+            printf("Named clusters " + ", ".join(sorted(clusters)) + " are removed too.", TextFormat.Colors.yellow,
+                   TextFormat.bold)
+        if answer.lower() == 'n' and not backup_clusters_before_remove(clusters):
+            printf("[Cancelled] Backup failed, removing aborted.", TextFormat.Colors.lightblue, TextFormat.bold)
+            clear(3)
+            return
+        # standbys go first, their replication slots are dropped while primaries still run
+        for name in sorted(clusters, key=lambda name: "primary_port" not in clusters[name]):
+            printf(" · Removing cluster " + name + "...", TextFormat.Colors.lightblue)
+            remove_cluster(name, purge=True)
+        if (answer.lower() == 'y') | (answer.lower() == 'n'):
+            send_notify("Removing PostgreSQL..")
+            clear()
+            printf(" · Removing postgresql-server package...\n", TextFormat.Colors.lightblue)
+            result = cmd(["yum", "-y", "remove", "postgresql-server"])
+            SERVER_STATE.invalidate()
+            if not result.ok:
+                clear(3)
+                printf(" · Removing postgresql-server package...", TextFormat.Colors.lightblue, end=" ")
+                printf("Failed.", TextFormat.Colors.red, TextFormat.bold)
+                report_failure(result)
+                send_notify("Removing failed!")
+                clear(3)
+                return
+            clear(3)
+            printf(" · Removing postgresql-server package...", TextFormat.Colors.lightblue, end=" ")
+            printf("Done.", TextFormat.Colors.green, TextFormat.bold)
+            pause(1)
+
+            if answer.lower() == 'n':
+                printf(" · Removing configurations from /var/lib/pgsql ...\n", TextFormat.Colors.lightblue)
+                # WAL archive and data directories moved aside by point-in-time restore are the only way back
+                kept = [os.path.abspath(settings["dir"]) for settings in archive_settings(every=True).values()]
+                kept += pitr_copies("/var/lib/pgsql")
+                cleaned = clean_directory("/var/lib/pgsql", kept)
+                for path in kept:
+                    if os.path.exists(path):
+                        printf(" · Kept " + path, TextFormat.Colors.lightblue)
+                if not cleaned:
+                    pause(3)  # leave warnings on screen
+                clear(3)
+                printf(" · Removing postgresql-server package...", TextFormat.Colors.lightblue, end=" ")
+                printf("Done.", TextFormat.Colors.green, TextFormat.bold)
+                printf(" · Removing configurations from /var/lib/pgsql ...", TextFormat.Colors.lightblue, end=" ")
+                printf("Done." if cleaned else "Failed, some files are left.",
+                       TextFormat.Colors.green if cleaned else TextFormat.Colors.red, TextFormat.bold)
+                pause(1)
+                print()
+
+            printf("All done!", TextFormat.Colors.green, TextFormat.bold)
+            send_notify("Successfully removed!")
+            clear(3)
+        else:
+            printf("[Cancelled] Removing aborted.", TextFormat.Colors.lightblue, TextFormat.bold)
+            clear(3)
+    else:
+        clear()
+        show_welcome()
+        printf("[Not Installed] Can`t remove PostgreSQL, because it is not installed!", TextFormat.Colors.yellow,
+               TextFormat.bold)
+        clear(3)
+
+
+def get_option(names, default=None):
+    """Return value which follows one of flags in command line"""
+
+    for i, arg in enumerate(sys.argv[:-1]):
+        if arg in names:
+            return sys.argv[i + 1]
+    return default
+
+
+def get_interval(default):
+    """Positive number of seconds given by --interval, exit with usage error on anything else"""
+
+    try:
+        interval = float(get_option(("--interval",), default))
+    except ValueError:
+        interval = -1.0
+    if not 0 < interval < float("inf"):
+        printf("[Wrong Usage] --interval takes positive number of seconds, e.g. --interval " + default,
+               TextFormat.Colors.yellow, TextFormat.bold)
+        sys.exit(2)
+    return interval
+
+
+VALUE_OPTIONS = ("--ttl", "-t", "--rpm-dir", "--cluster", "--profile-output")
+
+
+def get_arguments(start, options=()):
+    """Return command line arguments from given position which are neither flags nor values of flags in options"""
+
+    arguments, skip = [], False
+    for arg in sys.argv[start:]:
+        if skip:
+            skip = False
+        elif arg in options or arg in VALUE_OPTIONS:
+            skip = True
+        elif not arg.startswith("-"):
+            arguments.append(arg)
+    return arguments
+
+
+def entry_point():
+    global VERBOSE_MODE, NATIVE_PROBES, RPM_DIR, PROFILER
+
+    if sys.argv.__contains__("--profile"):
+        PROFILER = Profiler()
+        root = PROFILER.span("postgre.py " + " ".join(sys.argv[1:]), "main")
+        root.__enter__()
+
+        def export():
+            root.__exit__(None, None, None)
+            PROFILER.export(get_option(("--profile-output",), "postgre_profile.json"))
+        atexit.register(export)
+
+    ttl = get_option(("--ttl", "-t"))
+    if ttl is not None:
+        try:
+            SERVER_STATE.ttl = float(ttl)
+        except ValueError:
+            SERVER_STATE.ttl = -1.0
+        if SERVER_STATE.ttl < 0:
+            printf("[Wrong Usage] --ttl takes number of seconds, e.g. --ttl 30", TextFormat.Colors.yellow,
+                   TextFormat.bold)
+            sys.exit(2)
+
+    RPM_DIR = get_option(("--rpm-dir",))
+
+    if sys.argv.__contains__("--shell-probes"):
+        NATIVE_PROBES = False
+
+    if sys.argv.__contains__("--verbose") | sys.argv.__contains__("-v"):
+        VERBOSE_MODE = True
+
+    if len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
+        OPERATION_LOG.default_step = sys.argv[1]
+
+    cluster = get_option(("--cluster",))
+    if cluster is not None and not select_cluster(cluster):
+        printf("[Not Exist] Cluster \"" + cluster + "\" is not registered.", TextFormat.Colors.yellow, TextFormat.bold)
+        sys.exit(2)
+
+    if len(sys.argv) > 1 and sys.argv[1] in ("wal-push", "wal-fetch"):
+        sys.exit(wal_command())
+
+    elif len(sys.argv) > 1 and sys.argv[1] == "apply":
+        sys.exit(apply())
+
+    elif len(sys.argv) > 1 and sys.argv[1] in ("export", "import"):
+        sys.exit(transfer())
+
+    elif len(sys.argv) > 1 and sys.argv[1] in ("backup", "restore"):
+        sys.exit(backup_command())
+
+    elif len(sys.argv) > 1 and sys.argv[1] in ("set", "restart-pending"):
+        sys.exit(settings_command())
+
+    elif len(sys.argv) > 1 and sys.argv[1] == "statements":
+        sys.exit(statements_command())
+
+    elif len(sys.argv) > 1 and sys.argv[1] == "bench":
+        sys.exit(bench_command())
+
+    elif len(sys.argv) > 1 and sys.argv[1] == "maintain":
+        sys.exit(maintain_command())
+
+    elif len(sys.argv) > 1 and sys.argv[1] == "indexes":
+        sys.exit(indexes_command())
+
+    elif len(sys.argv) > 1 and sys.argv[1] == "cluster":
+        sys.exit(cluster_command())
+
+    elif len(sys.argv) > 1 and sys.argv[1] == "replica":
+        sys.exit(replica_command())
+
+    elif len(sys.argv) > 1 and sys.argv[1] == "log":
+        sys.exit(log_command())
+
+    elif len(sys.argv) > 1 and sys.argv[1] == "archive":
+        sys.exit(archiving_command())
+
+    elif VERBOSE_MODE:
+        main()
+
+    elif sys.argv.__contains__("--serve"):
+        if not is_root():
+            sys.exit(2)
+        sys.exit(serve(get_option(("--listen",), "127.0.0.1:9187"), get_interval("15")))
+
+    elif sys.argv.__contains__("--status") | sys.argv.__contains__("-s"):
+        show_status()
+        if sys.argv.__contains__("--replication") and is_running() and os.getuid() == 0:
+            try:
+                show_replication(get_session())
+                close_session()
+            except SessionError:
+                pass
+
+    elif sys.argv.__contains__("--dashboard") | sys.argv.__contains__("-d"):
+        if is_root():
+            interval = get_interval("2")
+            try:
+                session = PsqlSession()
+                dashboard(session, interval)
+                session.close()
+            except SessionError as error:
+                printf("[Failed] " + str(error), TextFormat.Colors.red, TextFormat.bold)
+                sys.exit(1)
+
+    elif sys.argv.__contains__("--author") | sys.argv.__contains__("-a"):
+        show_welcome(only_banner=True)
+        printf("If you have any questions or suggestions,\nfeel free to write me here: t.me/savchuk_vlad.")
+
+    elif sys.argv.__contains__("--version") | sys.argv.__contains__("-V"):
+        print(version())
+
+    elif sys.argv.__contains__("--help") | sys.argv.__contains__("-h"):
+        man_page = r""".\" manpage for PostgreSQL Installer
+.\" Contact t.me/savchuk_vlad to correct errors or typos
+.TH posgtgre.py 1 "31 May 2020" "version 1.0" "PostgreSQL Installer manpage"
+
+.SH NAME
+.B PostgreSQL Installer
+- install, configure, manage and remove PostgreSQL server on CentOS.
+
+.SH SYNOPSIS
+.B postgre.py
+.RI "[" FLAG "]..."
+.br
+.B postgre.py apply
+.RB "[" --state " running|stopped] [" --autostart " on|off] [" --rpm-dir " DIRECTORY]"
+.RB "[" --tune " oltp|analytics|mixed] [" --dry-run "]"
+.br
+.B postgre.py export
+.BI --db " NAME " --dir " DIRECTORY"
+.RB "[" --tables " A,B] [" --jobs " N] [" --format " csv|bin] [" --compress "] [" --chunks " N] [" --header "]"
+.br
+.B postgre.py import
+.BI --db " NAME " --dir " DIRECTORY"
+.RB "[" --jobs " N] [" --header "]"
+.br
+.B postgre.py backup
+.RB "[" --jobs " N] [" --compress " 0-9] [" --physical "]"
+.br
+.B postgre.py restore
+.BI --from " DIRECTORY"
+.RB "[" --jobs " N]"
+.br
+.B postgre.py set
+.IR NAME = VALUE ...
+.RB "[" --restart " now|later] [" --yes "]"
+.br
+.B postgre.py restart-pending
+.RB "[" --at " HH:MM]"
+.br
+.B postgre.py statements
+.RB "enable | top [" --by " total|mean|calls|io] [" --limit " N] | snapshot | compare"
+.IR "BEFORE " [ AFTER "] | log [" FILE ...]
+.RB "[" --restart " now|later] [" --yes "]"
+.br
+.B postgre.py bench
+.RB "[" --scale " N] [" --clients " 1,4,16] [" --threads " 1,4] [" --time " SEC] [" --threshold " PCT] | history"
+.RI "| compare [" BASELINE " [" RUN "]]"
+.br
+.B postgre.py maintain
+.RB "[" --jobs " N] [" --budget " MINUTES] [" --min-dead " PCT] [" --min-bloat " PCT] [" --dry-run "]"
+.br
+.B postgre.py indexes
+.BI --db " NAME"
+.RB "[" --sql " FILE]"
+.br
+.B postgre.py cluster
+.RB "list | create " \fINAME\fR... " [" --port " N] [" --start "] | start|stop|restart|enable|disable"
+.RB \fINAME\fR... | --all " [" --jobs " N] | remove " \fINAME\fR " [" --purge "]"
+.br
+.B postgre.py replica
+.RB "create " \fINAME\fR " [" --port " N] [" --from " HOST[:PORT]] | prepare " --allow " CIDR | status"
+.br
+.B postgre.py log
+.RB "[" --failed " [" --last " N]]"
+.br
+.B postgre.py archive
+.RB "enable [" --dir " DIR] [" --jobs " N] [" --compress " 0-9] [" --base "] | status | restore " --time
+.RB \fR"\fIYYYY-MM-DD HH:MM:SS\fR" " [" --from " BACKUP]"
+
+.SH DESCRIPTION
+.B postgre.py
 - use this script for installation, configuration, managing and removing PostgreSQL server in CentOS.
 .PP
 
@@ -505,6 +4947,18 @@ Run script in verbose mode.
 .TP
 .B -s | --status
 Print current server status in system.
+.B --replication
+also connects to server and shows standbys with lag.
+.TP
+.B -d | --dashboard
+Show live TPS, cache hit ratio, tuple rates, sessions, checkpoints and memory of server processes, updated every
+.B --interval
+seconds (2 by default).
+.TP
+.BI "--serve [--listen " ADDRESS:PORT "] [--interval " SECONDS ]
+Run as metrics exporter: server status and pg_stat_* statistics are collected every SECONDS (15 by default) into
+memory and served in Prometheus text format on /metrics and as JSON on /json (127.0.0.1:9187 by default), so every
+scrape reads the same snapshot and never touches server.
 .TP
 .B -a | --author
 Information about author.
@@ -512,9 +4966,187 @@ Information about author.
 .B -V | --version
 Show installed PostgreSQL version.
 .TP
+.BI "-t | --ttl " SECONDS
+How long cached server status is reused between menu redraws (default 30).
+.TP
+.BI "--rpm-dir " DIRECTORY
+Install server from pre-downloaded rpm files in DIRECTORY without contacting repositories. Otherwise packages
+are downloaded into /var/cache/postgre_installer/rpms in background as soon as the script starts.
+.TP
+.B --shell-probes
+Detect server status with shell commands (yum, systemctl, hostnamectl) instead of reading system files.
+.TP
+.BI "--cluster " NAME
+Manage named cluster instead of default one in menus and every command (its data directory, port and
+postgresql-NAME unit are used).
+.TP
+.BI "--profile [--profile-output " FILE ]
+Time every external command, status probe, psql query, menu render and sleep. On exit spans are saved as Chrome
+trace-event JSON into FILE (default postgre_profile.json, open in chrome://tracing or Perfetto) and summary table
+with total and self time is printed.
+.TP
 .B -h | --help
 Show this man-page.
 
+.SH COMMANDS
+.TP
+.B apply
+Bring server into desired state without menus: install package, initialize database, start/stop service and
+enable/disable autostart, skipping every step which is already satisfied. Use
+.B --tune
+to also write settings computed from memory, CPU count and storage type for given workload profile into
+postgresql.conf and restart server if they changed. Use
+.B --dry-run
+to only print planned steps. Exit status is 0 on success, 1 if some step failed and 2 on wrong usage.
+.TP
+.B export
+Write tables of database (all if
+.B --tables
+is not given) into DIRECTORY with COPY TO STDOUT, one file per table, by
+.B --jobs
+parallel workers (CPU count by default).
+.B --chunks
+splits every table into ranges of heap pages exported concurrently (PostgreSQL 14 and newer),
+.B --compress
+gzips files on the fly. Files are named TABLE[--CHUNK].csv|bin[.gz].
+.TP
+.B import
+Load every exported file from DIRECTORY into its table with COPY FROM STDIN by parallel workers.
+.TP
+.B backup
+Dump roles and every database into /var/backups/postgre_installer/TIMESTAMP with directory format
+.B pg_dump
+using
+.B --jobs
+parallel jobs (CPU count by default) and gzip level
+.B --compress
+(6 by default), then print time and size of every database.
+.B --physical
+makes compressed base backup with
+.B pg_basebackup
+instead.
+.TP
+.B restore
+Restore roles and databases from backup DIRECTORY with parallel
+.BR pg_restore .
+.TP
+.B set
+Validate parameters against pg_settings, write them into postgresql.conf keeping comments and includes (or with
+ALTER SYSTEM if they come from postgresql.auto.conf), show diff and apply by configuration reload. Parameters which
+need restart are kept pending unless
+.B --restart now
+is given.
+.B --yes
+skips confirmation.
+.TP
+.B restart-pending
+Restart server if there are pending restart-only changes.
+.B --at
+schedules it once for given time with a transient systemd timer.
+.TP
+.B statements
+Analyze statements with pg_stat_statements, which is preloaded (restart only if it is not loaded yet) and created
+by
+.BR enable .
+As with
+.BR set ,
+preloading waits for "restart-pending" unless
+.B --restart now
+is given, and
+.B --yes
+skips confirmations.
+.B top
+prints heaviest statements,
+.B snapshot
+saves counters into /var/lib/postgre_installer/snapshots and
+.B compare
+shows mean time of every statement after BEFORE snapshot (till AFTER snapshot or now) against its mean before it,
+exit status is 1 if some statement regressed by more than 20%.
+.B log
+aggregates log_min_duration_statement entries of server logs (or given files) in one streaming pass.
+.TP
+.B bench
+Initialize pgbench dataset of given scale in "pgbench" database (kept while scale is the same), run every
+client/thread combination for given time and print TPS with latency percentiles from per-transaction logs.
+Runs are appended to /var/lib/postgre_installer/bench_history.jsonl and compared with previous run (or given runs
+with
+.BR compare ),
+exit status is 1 if TPS dropped or p95 latency grew by more than threshold (default 10%).
+.TP
+.B maintain
+Rank tables of every database by dead tuples (from statistics, or pgstattuple when extension is installed) and
+btree indexes by bloat (pgstattuple only) and run VACUUM (ANALYZE) and REINDEX CONCURRENTLY (PostgreSQL 12+)
+biggest benefit first with N parallel jobs (default 2). Nothing new starts when
+.B --budget
+is over and running command is cancelled, invalid index copies left by cancelled reindex are dropped. Budget
+includes pgstattuple estimate, indexes not measured in time are left out of plan.
+.B --dry-run
+only prints ranked plan.
+.TP
+.B indexes
+Report large tables read mostly by sequential scans (with most selective unindexed column from pg_stats as index
+candidate), indexes never scanned (unique and constraint indexes excluded) and duplicate or prefix-redundant
+indexes, each with size and suggested DDL, which is also written into FILE. Index candidates are only a hint from
+column statistics and are written commented out, check them against real queries with EXPLAIN.
+.TP
+.B cluster
+Manage several clusters on one host. Registry is kept in /etc/postgre_installer/clusters.json, data in
+/var/lib/pgsql/clusters/NAME/data and every cluster gets postgresql-NAME unit which includes packaged unit with its
+own PGDATA and port (next free from 5433 if not given).
+.B create
+initializes all given clusters at once, other actions also run concurrently for all clusters (at most
+.B --jobs
+if given).
+.B remove
+keeps data directory unless
+.B --purge
+is given.
+.TP
+.B replica
+.B create
+makes hot standby cluster NAME of selected cluster (see
+.BR --cluster )
+on this host: primary gets replication settings (restarted only if they changed) and pg_hba.conf rule, data is
+copied by pg_basebackup with streamed WAL and replication slot (pg_basebackup 11+), recovery.conf (before 12) or
+standby.signal is written and standby is started on its own port. With
+.B --from
+standby follows remote primary, which must be prepared on its host by
+.B prepare
+(role "replicator" allowed from CIDR). Password of "replicator" is asked without echo (or taken from PGPASSWORD)
+and standby keeps it in ~postgres/.pgpass, never on command line.
+.B status
+and
+.B --status --replication
+show connected standbys with lag. Removing standby cluster drops its slot on primary, or warns if primary can not
+be reached.
+.TP
+.B log
+Every executed command is recorded as JSON line (timestamp, step, command, user, duration, exit code, output) in
+/var/log/postgre_installer/operations.jsonl (~/.postgre_installer when it is not writable). File is gzipped into
+operations-DATE.jsonl.gz when it grows over 10 MB or gets older than 7 days, newest 10 archives are kept.
+.B log
+prints time spent by every step over current file and archives,
+.B --failed
+prints last N failed commands with their output.
+.TP
+.B archive
+.B enable
+copies this script to /usr/local/bin/postgre-wal and sets archive_mode and archive_command (restart only if
+archive_mode was off) so WAL goes into subdirectory of DIR (default /var/backups/postgre_installer/wal_archive, it
+is kept when PostgreSQL is removed) named by system identifier of selected cluster, gzipped at given level (1 by
+default, 0 disables compression). Helper archives N segments at once: requested one and next ones which are already
+waiting, later requests for them return immediately. Segment which is already archived with other content fails
+archiving instead of being skipped.
+.B --base
+takes physical backup to start from.
+.B restore
+stops server, moves data directory aside, extracts newest physical backup of the same cluster started before given
+time (or BACKUP) and replays archived WAL up to that time with recovery progress shown, next N segments are
+decompressed ahead in parallel. Server is promoted when target is reached. Backup with tablespaces is refused
+before server is stopped; if extraction, start or recovery fails, previous data directory is put back and started.
+Directories moved aside (DATA.before-pitr-TIME) are kept when server or cluster is removed, even with
+.BR --purge .
+
 .SH EXAMPLES
 The following will show a typical usage.
 .PP
@@ -522,6 +5154,8 @@ The following will show a typical usage.
 .BR $ " sudo python3 postgre.py -v"
 .br
 .BR $ " sudo python3 postgre.py --status"
+.br
+.BR $ " sudo python3 postgre.py apply --state running --autostart on"
 
 .SH EXIT STATUS
 If operating system isn`t CentOS, output will be the next:
@@ -546,10 +5180,9 @@ MIT License
 Copyright (c) 2020 Vlad Savchuk
 """
         if not os.path.exists("./postgre_manpage"):
-            os.system("touch postgre_manpage")
             with open("postgre_manpage", "w") as file:
                 file.write(man_page)
-        os.system("man ./postgre_manpage")
+        interactive(["man", "./postgre_manpage"])
 
     else:
         main()
@@ -559,6 +5192,8 @@ def main():
     try:
         if is_centos():
             if is_root():
+                if RPM_DIR is None and not is_installed():
+                    PREFETCH.start()
                 clear()
                 while True:
                     choice = main_menu()
@@ -570,6 +5205,7 @@ def main():
                             choice = config_menu()
                             config(choice)
                             if choice == '0':
+                                close_session()
                                 break
 
                     elif choice == '3':
@@ -577,11 +5213,17 @@ def main():
                             choice = operations_menu()
                             operations(choice)
                             if choice == '0':
+                                close_session()
                                 break
 
                     elif choice == '4':
                         remove()
 
+                    elif choice == '5':
+                        while clusters_menu() != '0':
+                            pass
+                        clear()
+
                     elif choice.lower() == 'q':
                         clear()
                         break